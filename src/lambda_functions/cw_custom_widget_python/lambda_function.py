@@ -5,51 +5,412 @@
 Lex Analytics CloudWatch Dashboard Custom Widget Lambda Handler
 """
 
+from functools import lru_cache
+from os import getenv
+from time import monotonic
+
 # pylint: disable=import-error
-from lib.client import get_client
 from lib.logger import get_logger
-from lib.cw_logs import get_query_results_as_df
-from widgets.slots import render_slots_top_n_widget
-from widgets.session_attributes import render_session_attributes_top_n_widget
+from lib.cw_logs import (
+    QueryTimeoutError,
+    get_query_results_as_df,
+    get_rows_as_columns,
+    get_rows_as_df,
+)
+from lib.log_source import LogInsightsSource
+from lib.query_cache import align_time_range, get_query_result_cache_from_env
+from lib.query_coordinator import DEFAULT_PRIORITY, get_query_coordinator_from_env
+from lib.messages import decode_messages
+from lib.profiling import get_request_profiler_from_env
+from lib.metrics import (
+    WidgetMetrics,
+    get_metrics_namespace_from_env,
+    record_phase,
+    reset_current_metrics,
+    set_current_metrics,
+)
+from widgets import STDLIB_ENGINE, get_engine, get_widget_renderer, is_registered_widget
+from widgets.html_renderer import get_max_output_bytes
 
-# pylint: enable=import-error
+# Heavy modules (boto3, pandas and the widget modules) are imported on first
+# use instead of at module import time to reduce the Lambda cold start.
+# pylint: disable=import-outside-toplevel
 
 LOGGER = get_logger(__name__)
-CLIENT = get_client("logs")
+# query result cache kept in the warm Lambda container
+QUERY_CACHE = get_query_result_cache_from_env()
+# Embedded Metric Format namespace of the request metrics. None if not emitted
+METRICS_NAMESPACE = get_metrics_namespace_from_env()
+# log group of the conversation logs counted by the rollup materializer
+ROLLUP_LOG_GROUP_NAME = getenv("ROLLUP_LOG_GROUP_NAME", "")
+_DEFAULT_ROLLUP_MIN_TIME_RANGE_IN_SECS = 24 * 3600
+# query result fields used by the widgets
+_INPUT_FIELDS = ["@timestamp", "@message"]
+# time reserved to render the widget after the query polling deadline
+_RENDER_TIME_MARGIN_IN_SECS = 5
+# widget parameters of the values counted by Log Insights stats queries
+_QUERY_AGGREGATION_PARAMS = ["slotNames", "sessionAttributeKeys"]
+_NO_DATA_FOUND = "<pre>No data found</pre>"
+_PARTIAL_RESULTS_BANNER = (
+    "<p><b>Partial results:</b> the query did not complete before the widget"
+    " deadline. Values are based on the logs scanned so far.</p>"
+)
+
+
+def get_deadline(context):
+    """Get the query polling deadline in monotonic time from the Lambda context"""
+    if context is None:
+        return None
+    remaining_time = context.get_remaining_time_in_millis() / 1000
+    return monotonic() + max(remaining_time - _RENDER_TIME_MARGIN_IN_SECS, 0)
+
+
+def get_aws_client(service_name):
+    """Get a boto3 client, created on first use"""
+    from lib.client import get_client
+
+    return get_client(service_name)
+
+
+def get_logs_client():
+    """Get the CloudWatch Logs client, created on first use"""
+    return get_aws_client("logs")
+
+
+@lru_cache(maxsize=None)
+def get_rollup_store():
+    """Get the hourly rollup store written by the rollup materializer function
+
+    Created on first use. Returns None if no rollup store is configured.
+    """
+    from lib.rollup_store import get_rollup_store_from_env
+
+    return get_rollup_store_from_env(get_client=get_aws_client)
+
+
+@lru_cache(maxsize=None)
+def get_log_store():
+    """Get the Parquet conversation log store
+
+    Created on first use. Returns None if no log store is configured.
+    """
+    if not getenv("LOG_STORE_URI"):
+        return None
+    from lib.log_store import get_log_store_from_env
+
+    return get_log_store_from_env()
+
+
+@lru_cache(maxsize=None)
+def get_query_coordinator():
+    """Get the query coordinator, created on first use
+
+    Shares identical in-flight queries and limits the concurrent queries.
+    Returns None if the coordinator is disabled.
+    """
+    return get_query_coordinator_from_env(get_client=get_aws_client)
 
 
-def handler(event, _):
-    """Lambda Handler"""
+@lru_cache(maxsize=None)
+def get_request_profiler():
+    """Get the request profiler configured from the environment"""
+    return get_request_profiler_from_env(get_client=get_aws_client)
+
+
+def add_partial_results_banner(output, is_partial):
+    """Prepend the partial results banner to the widget HTML if needed"""
+    if is_partial:
+        return _PARTIAL_RESULTS_BANNER + output
+    return output
+
+
+def handler(event, context):
+    """Lambda Handler
+
+    Requests are profiled with cProfile and tracemalloc when the profile
+    widget parameter is set or when sampled (see lib.profiling).
+    """
     LOGGER.debug(event)
+    profiler = get_request_profiler()
+    if profiler.is_enabled(event):
+        return profiler.profile(
+            lambda: handle_request(event=event, context=context),
+            logger=LOGGER,
+            request_id=getattr(context, "aws_request_id", None),
+        )
+    return handle_request(event=event, context=context)
+
+
+def handle_request(event, context):
+    """Render the widget HTML of a request and record its metrics
+
+    Records the request phase durations and query statistics and emits them
+    as Embedded Metric Format metrics if a metrics namespace is configured.
+    A timings footer is added to the widget with the showTimings parameter.
+    """
+    widget_types = event.get("widgetTypes") or [event["widgetType"]]
+    metrics = WidgetMetrics(
+        namespace=METRICS_NAMESPACE,
+        dimensions={"WidgetType": ",".join(widget_types), "RenderPath": "raw"},
+    )
+    token = set_current_metrics(metrics)
+    try:
+        with metrics.phase("Total"):
+            output = render_request(event=event, context=context, metrics=metrics)
+    finally:
+        reset_current_metrics(token)
+        if METRICS_NAMESPACE is not None:
+            metrics.emit()
+    if event.get("showTimings", False):
+        output += metrics.get_timings_footer()
+    return output
+
+
+def render_request(event, context, metrics):
+    """Render the widget HTML of a request"""
+    # pylint: disable=too-many-locals,too-many-statements,too-many-branches
     widget_context = event.get("widgetContext")
 
     time_range = widget_context.get("timeRange", {}).get("zoom") or widget_context.get("timeRange")
     start_time = time_range.get("start") // 1000
     end_time = time_range.get("end") // 1000
+    if QUERY_CACHE is not None:
+        # align to the dashboard period so that refreshes map to the same cache key.
+        # Ranges that are still live are not cached and are queried as requested
+        aligned_start_time, aligned_end_time = align_time_range(
+            start_time=start_time,
+            end_time=end_time,
+            period=widget_context.get("period"),
+        )
+        if QUERY_CACHE.is_cacheable(aligned_end_time):
+            start_time, end_time = aligned_start_time, aligned_end_time
 
     log_group = event["logGroups"]
     query = event["query"]
-    widget_type = event["widgetType"]
+    # several widget types sharing the same query can be rendered from one query
+    widget_types = event.get("widgetTypes") or [event["widgetType"]]
+    widget_type = widget_types[0]
+    is_batch = len(widget_types) > 1
+    engine = get_engine(event)
+    # split the time range into shards queried in parallel
+    shard_count = int(event.get("queryShardCount", 1))
+    # queries with a lower priority value get a query slot first
+    query_priority = int(event.get("queryPriority", DEFAULT_PRIORITY))
 
-    try:
-        input_df = get_query_results_as_df(
-            log_group_names=[log_group],
+    # render the results available when the query deadline is reached
+    allow_partial_results = event.get("allowPartialResults", True)
+
+    deadline = get_deadline(context)
+
+    # read only the columns used by the widgets from the Parquet log store
+    log_store = get_log_store()
+    if log_store is not None:
+        metrics.dimensions["RenderPath"] = "logStore"
+
+        def read_messages(paths):
+            with metrics.phase("Query"):
+                return log_store.read_messages(
+                    bot_id=event.get("botId"),
+                    bot_locale_id=event.get("botLocaleId"),
+                    start_time=start_time,
+                    end_time=end_time,
+                    paths=paths,
+                    metrics=metrics,
+                )
+
+        return render_widgets_from_messages(
+            widget_types=widget_types, event=event, get_messages=read_messages
+        )
+
+    # exported conversation logs are read from files when LOG_SOURCE_PATHS is
+    # set, with the field filters of the widget query like Log Insights
+    log_source = None
+    if getenv("LOG_SOURCE_PATHS"):
+        from lib.file_log_source import get_file_log_source_from_env
+
+        log_source = get_file_log_source_from_env(query=query)
+    if log_source is None:
+        log_source = LogInsightsSource(
             query=query,
-            start_time=start_time,
-            end_time=end_time,
-            logs_client=CLIENT,
+            log_group_names=[log_group],
+            get_logs_client=get_logs_client,
             logger=LOGGER,
+            cache=QUERY_CACHE,
+            shard_count=shard_count,
+            deadline=deadline,
+            coordinator=get_query_coordinator(),
+            priority=query_priority,
         )
+
+    def get_input_rows(start_time, end_time):
+        return log_source.get_rows(start_time=start_time, end_time=end_time, metrics=metrics)
+
+    def get_input_df(start_time, end_time):
+        return get_rows_as_df(get_input_rows(start_time, end_time), fields=_INPUT_FIELDS)
+
+    # serve long time ranges from the hourly rollups
+    rollup_min_time_range = event.get(
+        "rollupMinTimeRangeInSecs", _DEFAULT_ROLLUP_MIN_TIME_RANGE_IN_SECS
+    )
+    if (
+        not is_batch
+        and end_time - start_time >= rollup_min_time_range
+        and get_rollup_store() is not None
+    ):
+        from widgets.rollups import is_rollup_query, is_rollup_widget, render_rollup_widget
+
+        # the rollups only count the logs selected by the materializer query
+        is_rollup_source = log_group == ROLLUP_LOG_GROUP_NAME and is_rollup_query(
+            query=query, bot_id=event.get("botId"), bot_locale_id=event.get("botLocaleId")
+        )
+        if is_rollup_widget(widget_type) and not is_rollup_source:
+            LOGGER.info("query does not match the rollups - rendering from live queries")
+        elif is_rollup_widget(widget_type):
+            metrics.dimensions["RenderPath"] = "rollup"
+            output, is_partial = render_rollup_widget(
+                widget_type=widget_type,
+                event=event,
+                get_input_df=get_input_df,
+                start_time=start_time,
+                end_time=end_time,
+                rollup_store=get_rollup_store(),
+                allow_partial_results=allow_partial_results,
+            )
+            return add_partial_results_banner(output, is_partial)
+
+    # count the values with Log Insights stats queries instead of fetching raw messages
+    if (
+        not is_batch
+        and isinstance(log_source, LogInsightsSource)
+        and any(event.get(param) for param in _QUERY_AGGREGATION_PARAMS)
+    ):
+        from widgets.query_aggregation import (
+            is_query_aggregation_widget,
+            render_query_aggregation_widget,
+        )
+
+        if is_query_aggregation_widget(widget_type, event):
+
+            def get_count_df(count_query):
+                return get_query_results_as_df(
+                    log_group_names=[log_group],
+                    query=count_query,
+                    start_time=start_time,
+                    end_time=end_time,
+                    logs_client=get_logs_client(),
+                    logger=LOGGER,
+                    cache=QUERY_CACHE,
+                    deadline=deadline,
+                    metrics=metrics,
+                    coordinator=get_query_coordinator(),
+                    priority=query_priority,
+                )
+
+            result = render_query_aggregation_widget(
+                widget_type=widget_type,
+                event=event,
+                get_count_df=get_count_df,
+                allow_partial_results=allow_partial_results,
+            )
+            if result is not None:
+                metrics.dimensions["RenderPath"] = "queryAggregation"
+                return add_partial_results_banner(*result)
+            LOGGER.warning("query aggregation truncated at row limit - rendering from raw messages")
+
+    # only query the time buckets not seen by previous refreshes in this container
+    if not is_batch and event.get("incrementalRefresh", False):
+        from widgets.incremental import is_incremental_widget, render_incremental_widget
+
+        if is_incremental_widget(widget_type):
+            metrics.dimensions["RenderPath"] = "incremental"
+            output, is_partial = render_incremental_widget(
+                widget_type=widget_type,
+                event=event,
+                get_input_df=get_input_df,
+                start_time=start_time,
+                end_time=end_time,
+                bucket_size=widget_context.get("period"),
+                allow_partial_results=allow_partial_results,
+            )
+            return add_partial_results_banner(output, is_partial)
+
+    # the stdlib engine renders from lists of values instead of a dataframe
+    get_rows_as_input = get_rows_as_columns if engine == STDLIB_ENGINE else get_rows_as_df
+    is_partial = False
+    try:
+        input_rows = get_input_rows(start_time=start_time, end_time=end_time)
+    except QueryTimeoutError as exception:
+        if not allow_partial_results:
+            LOGGER.error("exception running query: %s", exception)
+            raise
+        LOGGER.warning("rendering partial results: %s", exception)
+        input_rows = exception.rows
+        is_partial = True
     except Exception as exception:  # pylint disable=broad-except
         LOGGER.error("exception running query: %s", exception)
         raise
+    with metrics.phase("Conversion"):
+        input_df = get_rows_as_input(input_rows, fields=_INPUT_FIELDS)
+
+    output = render_widgets(widget_types=widget_types, event=event, input_df=input_df)
+    return add_partial_results_banner(output, is_partial)
+
+
+def render_widget(widget_type, event, input_df):
+    """Render the widget HTML from the query results"""
+    return render_widgets(widget_types=[widget_type], event=event, input_df=input_df)
+
+
+def render_widgets(widget_types, event, input_df):
+    """Render the HTML of one or more widgets from the same query results
+
+    The input is a dataframe or, with the stdlib engine, a dictionary of field
+    to list of values. The @message field is decoded once with the paths used
+    by all the widgets.
+    """
+    renderers = get_widget_renderers(widget_types)
+
+    input_messages = input_df.get("@message")
+    if input_messages is None or len(input_messages) == 0:
+        return _NO_DATA_FOUND
+
+    paths = list(dict.fromkeys(path for message_paths, _ in renderers for path in message_paths))
+    with record_phase("Decode"):
+        messages = decode_messages(input_messages, paths)
+    widget_event = get_widget_event(event, len(renderers))
+    return "".join(render(event=widget_event, messages=messages) for _, render in renderers)
+
+
+def render_widgets_from_messages(widget_types, event, get_messages):
+    """Render the HTML of one or more widgets from decoded messages
+
+    get_messages is a function that takes the message paths used by the
+    widgets and returns a dictionary of path to list of values, in the format
+    of lib.messages.decode_messages.
+    """
+    renderers = get_widget_renderers(widget_types)
+    paths = list(dict.fromkeys(path for message_paths, _ in renderers for path in message_paths))
+    messages = get_messages(paths)
+    if not any(messages.values()):
+        return _NO_DATA_FOUND
+    widget_event = get_widget_event(event, len(renderers))
+    return "".join(render(event=widget_event, messages=messages) for _, render in renderers)
+
+
+def get_widget_event(event, widget_count):
+    """Get the parameters of each widget of a request
 
-    if input_df.empty:
-        return "<pre>No data found</pre>"
+    The widgets of a batch share the output byte budget (maxOutputBytes) of
+    the request in equal parts.
+    """
+    if widget_count <= 1:
+        return event
+    return {**event, "maxOutputBytes": get_max_output_bytes(event) // widget_count}
 
-    if widget_type == "slotsTopN":
-        return render_slots_top_n_widget(event=event, input_df=input_df)
-    if widget_type == "sessionAttributesTopN":
-        return render_session_attributes_top_n_widget(event=event, input_df=input_df)
 
-    raise RuntimeError(f"unknown widget type: {widget_type}")
+def get_widget_renderers(widget_types):
+    """Get the (message paths, render function) of registered widget types"""
+    for widget_type in widget_types:
+        if not is_registered_widget(widget_type):
+            raise RuntimeError(f"unknown widget type: {widget_type}")
+    return [get_widget_renderer(widget_type) for widget_type in widget_types]
@@ -3,14 +3,41 @@
 
 """CloudWatch Log Insights Query"""
 
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+import re
 from time import sleep
-import pandas as pd
 
+from .metrics import WidgetMetrics
+from .polling import PollScheduler
+from .query_cache import get_cache_key
+from .query_coordinator import DEFAULT_PRIORITY, QueryWaitTimeoutError
 
 _QUERY_WAIT_STATUS = ["Scheduled", "Running"]
 _QUERY_TARGET_STATUS = ["Complete"]
-_QUERY_MAX_TRIES = 60
-_DEFAULT_POLL_SLEEP_TIME_IN_SECS = 0.5
+# max number of rows returned by a Log Insights query
+_QUERY_MAX_ROW_LIMIT = 10000
+_QUERY_LIMIT_REGEX = re.compile(r"\|\s*limit\s+(\d+)\s*$", re.IGNORECASE)
+# convert result columns with a lower ratio of unique values to categorical
+_CATEGORICAL_MAX_UNIQUE_RATIO = 0.5
+_CATEGORICAL_MIN_ROWS = 100
+# raw log fields decoded or parsed by the widgets are kept as objects
+_NON_CATEGORICAL_FIELDS = {"@timestamp", "@message", "@ptr", "@log", "@logStream"}
+# leave room in the account concurrent query quota for other widgets
+_DEFAULT_MAX_CONCURRENT_QUERIES = 4
+
+
+class QueryTimeoutError(RuntimeError):
+    """Log Insights query did not complete before the deadline
+
+    The rows attribute contains the partial results available when the query
+    was stopped.
+    """
+
+    def __init__(self, message, rows, statistics=None):
+        super().__init__(message)
+        self.rows = rows
+        self.statistics = statistics
 
 
 def get_query_results_as_df(
@@ -20,32 +47,392 @@ def get_query_results_as_df(
     end_time,
     logger,
     logs_client,
-    poll_sleep_time_in_secs=_DEFAULT_POLL_SLEEP_TIME_IN_SECS,
-    max_tries=_QUERY_MAX_TRIES,
+    deadline=None,
+    cache=None,
+    shard_count=1,
+    max_concurrent_queries=_DEFAULT_MAX_CONCURRENT_QUERIES,
+    fields=None,
+    metrics=None,
+    coordinator=None,
+    priority=DEFAULT_PRIORITY,
 ):
-    """Get CloudWatch Log Insights Query Results as a Pandas Dataframe"""
+    """Get CloudWatch Log Insights Query Results as a Pandas Dataframe
+
+    If a list of fields is passed, only those fields are kept as columns.
+    See get_query_results for the other arguments.
+    """
     # pylint: disable=too-many-arguments
+    rows = get_query_results(
+        query=query,
+        log_group_names=log_group_names,
+        start_time=start_time,
+        end_time=end_time,
+        logger=logger,
+        logs_client=logs_client,
+        deadline=deadline,
+        cache=cache,
+        shard_count=shard_count,
+        max_concurrent_queries=max_concurrent_queries,
+        metrics=metrics,
+        coordinator=coordinator,
+        priority=priority,
+    )
+    return get_rows_as_df(rows, fields=fields)
+
+
+def get_query_results(
+    query,
+    log_group_names,
+    start_time,
+    end_time,
+    logger,
+    logs_client,
+    deadline=None,
+    cache=None,
+    shard_count=1,
+    max_concurrent_queries=_DEFAULT_MAX_CONCURRENT_QUERIES,
+    metrics=None,
+    coordinator=None,
+    priority=DEFAULT_PRIORITY,
+):
+    """Get CloudWatch Log Insights Query Result Rows
+
+    If a query result cache is passed, results are read from the cache when
+    available and results of windows that are no longer live are added to it.
+
+    If shard_count is greater than one, the time range is split into shards
+    that are queried in parallel. See run_sharded_query. The limit command of
+    the query, if any, is applied once to the merged rows.
+
+    The deadline is a time.monotonic() value after which polling the query
+    stops. It is usually derived from the Lambda remaining time. Queries that
+    do not complete by then are stopped and a QueryTimeoutError is raised.
+
+    If a lib.metrics.WidgetMetrics object is passed, the query phase durations
+    and statistics are added to it.
+
+    If a lib.query_coordinator.QueryCoordinator is passed, concurrent calls
+    with the same query, log groups and time range share one in-flight query
+    and each Log Insights query waits for a slot of the coordinator
+    concurrency limit. Queries with a lower priority value get a slot first.
+    """
+    # pylint: disable=too-many-arguments,too-many-locals
+    limit = None
+    if shard_count > 1:
+        query, limit = get_query_with_row_limit(query)
+
+    cache_key = get_cache_key(
+        query=query,
+        log_group_names=log_group_names,
+        start_time=start_time,
+        end_time=end_time,
+    )
+    if cache is not None:
+        rows = cache.get(cache_key)
+        if rows is not None:
+            logger.debug("query result cache hit - key: %s", cache_key)
+            if metrics is not None:
+                metrics.add("QueryCacheHits", 1)
+            return rows[:limit]
+
+    def get_rows():
+        if shard_count > 1:
+            return run_sharded_query(
+                query=query,
+                log_group_names=log_group_names,
+                start_time=start_time,
+                end_time=end_time,
+                logger=logger,
+                logs_client=logs_client,
+                shard_count=shard_count,
+                max_concurrent_queries=max_concurrent_queries,
+                deadline=deadline,
+                metrics=metrics,
+                coordinator=coordinator,
+                priority=priority,
+            )
+        return run_query(
+            query=query,
+            log_group_names=log_group_names,
+            start_time=start_time,
+            end_time=end_time,
+            logger=logger,
+            logs_client=logs_client,
+            deadline=deadline,
+            metrics=metrics,
+            coordinator=coordinator,
+            priority=priority,
+        )
+
+    try:
+        if coordinator is None:
+            rows = get_rows()
+        else:
+            try:
+                rows, is_shared = coordinator.share(cache_key, get_rows, deadline=deadline)
+            except QueryWaitTimeoutError as exception:
+                raise QueryTimeoutError(
+                    "Deadline reached waiting for shared query", rows=[]
+                ) from exception
+            if is_shared:
+                logger.debug("shared in-flight query results - key: %s", cache_key)
+                if metrics is not None:
+                    metrics.add("QuerySharedResults", 1)
+    except QueryTimeoutError as exception:
+        exception.rows = exception.rows[:limit]
+        raise
+
+    if cache is not None and cache.is_cacheable(end_time):
+        cache.put(cache_key, rows)
+    return rows[:limit]
+
+
+def run_query(
+    query,
+    log_group_names,
+    start_time,
+    end_time,
+    logger,
+    logs_client,
+    deadline=None,
+    metrics=None,
+    coordinator=None,
+    priority=DEFAULT_PRIORITY,
+):
+    """Run a CloudWatch Log Insights Query and wait for its result rows
+
+    If the query does not complete before the deadline, it is stopped to free
+    the account query concurrency and a QueryTimeoutError is raised with the
+    partial results that were available.
+
+    If a query coordinator is passed, the query holds one of its slots from
+    start to completion.
+    """
+    # pylint: disable=too-many-arguments,too-many-locals
+    scheduler = PollScheduler(deadline=deadline)
+    if scheduler.get_remaining_time() <= 0:
+        raise QueryTimeoutError("Deadline reached before starting query", rows=[])
+    if metrics is None:
+        metrics = WidgetMetrics()
+
     args = {
         "logGroupNames": log_group_names,
         "startTime": start_time,
         "endTime": end_time,
         "queryString": query,
     }
-    response = logs_client.start_query(**args)
-    logger.debug(response)
-    query_id = response["queryId"]
-
-    tries = 0
-    while True:
-        response = logs_client.get_query_results(queryId=query_id)
+    with query_slot(coordinator, priority=priority, deadline=scheduler.deadline, metrics=metrics):
+        # poll delays are based on the time elapsed since the query start
+        scheduler = PollScheduler(deadline=scheduler.deadline)
+        with metrics.phase("StartQuery"):
+            response = logs_client.start_query(**args)
         logger.debug(response)
-        status = response["status"]
-        if status not in _QUERY_WAIT_STATUS or tries >= max_tries:
-            break
-        sleep(poll_sleep_time_in_secs)
-        tries = tries + 1
+        query_id = response["queryId"]
+
+        with metrics.phase("Query"):
+            while True:
+                with metrics.phase("Polling"):
+                    response = logs_client.get_query_results(queryId=query_id)
+                metrics.add("Polls", 1)
+                logger.debug(response)
+                status = response["status"]
+                if status not in _QUERY_WAIT_STATUS:
+                    break
+                delay = scheduler.get_next_delay(response.get("statistics"))
+                if delay is None:
+                    stop_query(query_id=query_id, logger=logger, logs_client=logs_client)
+                    logger.warning(
+                        "query deadline reached - query id: %s, partial rows: %s, polls: %s",
+                        query_id,
+                        len(response.get("results", [])),
+                        scheduler.polls,
+                    )
+                    metrics.add_query_statistics(
+                        response.get("statistics"), len(response.get("results", []))
+                    )
+                    raise QueryTimeoutError(
+                        "Deadline reached waiting for query",
+                        rows=response.get("results", []),
+                        statistics=response.get("statistics"),
+                    )
+                sleep(delay)
     if status not in _QUERY_TARGET_STATUS:
-        logger.error("failed waiting for query - response: %s, tries: %s", response, tries)
+        logger.error(
+            "failed waiting for query - response: %s, polls: %s", response, scheduler.polls
+        )
         raise RuntimeError("Failed waiting for query")
 
-    return pd.DataFrame(({i["field"]: i["value"] for i in r} for r in response["results"]))
+    metrics.add_query_statistics(response.get("statistics"), len(response["results"]))
+    return response["results"]
+
+
+@contextmanager
+def query_slot(coordinator, priority, deadline, metrics):
+    """Hold a query slot of a query coordinator, if any, while running a query
+
+    Raises a QueryTimeoutError if no slot is free before the deadline.
+    """
+    if coordinator is None:
+        yield
+        return
+    try:
+        with metrics.phase("QuerySlotWait"):
+            token = coordinator.acquire_slot(priority=priority, deadline=deadline)
+    except QueryWaitTimeoutError as exception:
+        raise QueryTimeoutError("Deadline reached waiting for a query slot", rows=[]) from exception
+    try:
+        yield
+    finally:
+        coordinator.release_slot(token)
+
+
+def stop_query(query_id, logger, logs_client):
+    """Stop a running Log Insights query ignoring errors"""
+    try:
+        logs_client.stop_query(queryId=query_id)
+    except Exception as exception:  # pylint: disable=broad-except
+        # the query may have completed or been stopped in the meantime
+        logger.warning("failed to stop query - query id: %s, error: %s", query_id, exception)
+
+
+def get_query_with_row_limit(query):
+    """Get the query with the max row limit and the limit of the query
+
+    Queries without a limit command return up to 1000 rows. The limit command
+    of the query, if any, is replaced by the max row limit so that shards are
+    only checked for truncation at the row limit of Log Insights. The limit of
+    the query is returned, or None, to be applied to the merged rows.
+    """
+    match = _QUERY_LIMIT_REGEX.search(query)
+    limit = int(match.group(1)) if match else None
+    query = _QUERY_LIMIT_REGEX.sub("", query).rstrip()
+    return f"{query} | limit {_QUERY_MAX_ROW_LIMIT}", limit
+
+
+def get_time_shards(start_time, end_time, shard_count):
+    """Split an inclusive time range in seconds into contiguous non-overlapping shards"""
+    duration = end_time - start_time + 1
+    shard_count = max(1, min(shard_count, duration))
+    boundaries = [start_time + (duration * i) // shard_count for i in range(shard_count + 1)]
+    return [(boundaries[i], boundaries[i + 1] - 1) for i in range(shard_count)]
+
+
+def run_sharded_query(
+    query,
+    log_group_names,
+    start_time,
+    end_time,
+    logger,
+    logs_client,
+    shard_count,
+    max_concurrent_queries=_DEFAULT_MAX_CONCURRENT_QUERIES,
+    **query_kwargs,
+):
+    """Run a Log Insights query over time shards in parallel and merge the rows
+
+    Shards that return as many rows as the Log Insights row limit may have been
+    truncated. Those are split in half and queried again until no shard is truncated or a
+    shard cannot be split any further.
+
+    Only queries that return raw log events (not aggregations with stats) can
+    be merged by concatenating the shard rows.
+
+    If any shard reaches the deadline, a QueryTimeoutError is raised after all
+    the shards finish with the merged rows of the complete and partial shards.
+    """
+    # pylint: disable=too-many-arguments,too-many-locals
+    shard_rows = {}
+    is_partial = False
+    with ThreadPoolExecutor(max_workers=max_concurrent_queries) as executor:
+
+        def submit(shard):
+            return executor.submit(
+                run_query,
+                query=query,
+                log_group_names=log_group_names,
+                start_time=shard[0],
+                end_time=shard[1],
+                logger=logger,
+                logs_client=logs_client,
+                **query_kwargs,
+            )
+
+        pending = {
+            submit(shard): shard for shard in get_time_shards(start_time, end_time, shard_count)
+        }
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                shard = pending.pop(future)
+                try:
+                    rows = future.result()
+                except QueryTimeoutError as exception:
+                    is_partial = True
+                    shard_rows[shard] = exception.rows
+                    continue
+                shard_start_time, shard_end_time = shard
+                if len(rows) >= _QUERY_MAX_ROW_LIMIT and shard_end_time > shard_start_time:
+                    logger.debug("bisecting shard at row limit - shard: %s", shard)
+                    for sub_shard in get_time_shards(shard_start_time, shard_end_time, 2):
+                        pending[submit(sub_shard)] = sub_shard
+                    continue
+                if len(rows) >= _QUERY_MAX_ROW_LIMIT:
+                    logger.warning("shard at row limit cannot be split - shard: %s", shard)
+                shard_rows[shard] = rows
+
+    rows = [row for shard in sorted(shard_rows) for row in shard_rows[shard]]
+    if is_partial:
+        raise QueryTimeoutError("Deadline reached waiting for sharded query", rows=rows)
+    return rows
+
+
+def get_rows_as_columns(rows, fields=None):
+    """Convert Log Insights result rows to a dictionary of field to column of values
+
+    Columns are built directly from the result rows, which can be any
+    iterable, e.g. the rows streamed by a log source. Fields not in the
+    optional fields list are dropped. Missing values are None.
+    """
+    row_count = 0
+    columns = {}
+    for row_count, row in enumerate(rows, 1):
+        for cell in row:
+            field = cell["field"]
+            column = columns.get(field)
+            if column is None:
+                if fields is not None and field not in fields:
+                    continue
+                column = [None] * (row_count - 1)
+                columns[field] = column
+            elif len(column) >= row_count:
+                # duplicate field in a row, the last value is kept
+                column.pop()
+            elif len(column) < row_count - 1:
+                column.extend([None] * (row_count - 1 - len(column)))
+            column.append(cell.get("value"))
+    for column in columns.values():
+        column.extend([None] * (row_count - len(column)))
+    return columns
+
+
+def get_rows_as_df(rows, fields=None):
+    """Convert Log Insights result rows to a Pandas Dataframe
+
+    Columns are built directly from the result rows (see get_rows_as_columns)
+    and columns with a low ratio of unique values are converted to the
+    categorical dtype to save memory. Pandas is imported on first use to keep
+    it out of the Lambda cold start imports.
+    """
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
+    columns = get_rows_as_columns(rows, fields=fields)
+    input_df = pd.DataFrame(columns)
+    row_count = len(input_df)
+    if row_count < _CATEGORICAL_MIN_ROWS:
+        return input_df
+    for field, column in columns.items():
+        if field in _NON_CATEGORICAL_FIELDS:
+            continue
+        if len(set(column)) <= row_count * _CATEGORICAL_MAX_UNIQUE_RATIO:
+            input_df[field] = input_df[field].astype("category")
+    return input_df
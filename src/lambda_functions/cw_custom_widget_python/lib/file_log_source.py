@@ -0,0 +1,278 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Exported Conversation Log File Source
+
+Streams exported Lex conversation logs from plain, memory-mapped or gzip
+compressed (.gz) JSON lines files in one of these formats, detected on each
+line:
+
+    {"bot": {...}, "sessionId": ...}                   conversation log record
+    2021-09-10T00:00:00.123Z {"bot": {...}, ...}       CloudWatch Logs export to S3
+    {"messageType": "DATA_MESSAGE", "logEvents": ...}  Firehose subscription data
+
+The field filters of the widget query (see lib.log_source.get_query_filters),
+the bot id and locale id filters and the time range filter are applied while
+streaming and the rows are yielded as the files are read. Queries with other
+commands or conditions are rejected. Lines that do not contain the filter
+values are skipped before decoding. Conversation log record lines are decoded
+to read their timestamp. Otherwise only the bot objects of the messages of the
+log events in the time range are decoded if all the filters are on bot fields,
+the widgets decode the messages. Lines that cannot be decoded are skipped and
+counted in the MalformedRecords metric.
+"""
+
+from calendar import timegm
+from functools import lru_cache
+import glob
+import gzip
+import json
+import mmap
+import os
+from os import getenv
+import re
+import time
+
+from .log_source import LogSource, get_query_filters
+from .messages import get_path_value, loads
+from .metrics import MILLISECONDS
+
+_GZIP_SUFFIX = ".gz"
+# lengths of the ISO 8601 timestamp prefixes up to the minutes and the seconds
+_MINUTES_TIMESTAMP_LENGTH = len("2021-09-10T00:00")
+_SECONDS_TIMESTAMP_LENGTH = len("2021-09-10T00:00:00")
+_SECONDS_START = _MINUTES_TIMESTAMP_LENGTH + 1
+_FRACTION_START = _SECONDS_TIMESTAMP_LENGTH + 1
+_JSON_DECODER = json.JSONDecoder()
+_BOT_OBJECT_PATTERN = re.compile(r'"bot"\s*:\s*(\{[^{}]*\})')
+_BOT_FIELD_PREFIX = "bot."
+
+
+class FileLogSource(LogSource):
+    """Log source that streams exported conversation logs from local files
+
+    Files are read in the order of the paths. Plain files are memory-mapped
+    if use_mmap is True. Only the log events that match the field filters of
+    the query and the bot id and locale id, if set, are read. Raises
+    ValueError if the query has other commands or conditions.
+    """
+
+    def __init__(self, paths, query=None, bot_id=None, bot_locale_id=None, use_mmap=True):
+        self._paths = list(paths)
+        self._filters = get_query_filters(query or "") + [
+            (path, value)
+            for path, value in [("bot.id", bot_id), ("bot.localeId", bot_locale_id)]
+            if value
+        ]
+        self._use_mmap = use_mmap
+        # values that have to be in a line for it to match the filters, except
+        # the values that are escaped in JSON
+        self._line_filters = [
+            value.encode("utf-8") for _, value in self._filters if json.dumps(value)[1:-1] == value
+        ]
+        # the bot object is the only part of the messages decoded for the bot filters
+        self._has_bot_filters_only = all(
+            path.startswith(_BOT_FIELD_PREFIX) for path, _ in self._filters
+        )
+
+    def get_rows(self, start_time, end_time, metrics=None):
+        """Yield the result rows of the conversation logs in a time range
+
+        Rows are yielded while the files are read. The read time, which
+        excludes the time spent by the caller between rows, and the
+        statistics are added to the metrics once all the rows are read.
+        """
+        # pylint: disable=too-many-locals
+        start_time_ms = start_time * 1000
+        end_time_ms = (end_time + 1) * 1000
+        row_count = 0
+        lines_scanned = 0
+        bytes_scanned = 0
+        malformed_lines = 0
+        read_time = 0.0
+        read_start = time.perf_counter()
+        for path in self._paths:
+            for line in iter_file_lines(path, use_mmap=self._use_mmap):
+                lines_scanned += 1
+                bytes_scanned += len(line)
+                if not all(map(line.__contains__, self._line_filters)):
+                    continue
+                try:
+                    # rows of a line are only yielded if all its events can be decoded
+                    line_rows = [
+                        get_result_row(timestamp_ms, message)
+                        for timestamp_ms, message, record in parse_log_line(
+                            line, decode_records=False
+                        )
+                        if start_time_ms <= timestamp_ms < end_time_ms
+                        and self._is_event_match(message, record)
+                    ]
+                except (KeyError, TypeError, ValueError):
+                    malformed_lines += 1
+                    continue
+                row_count += len(line_rows)
+                for row in line_rows:
+                    read_time += time.perf_counter() - read_start
+                    yield row
+                    read_start = time.perf_counter()
+        read_time += time.perf_counter() - read_start
+        if metrics is not None:
+            metrics.add("QueryTime", read_time * 1000, MILLISECONDS)
+            metrics.add_query_statistics(
+                {
+                    "recordsScanned": lines_scanned,
+                    "recordsMatched": row_count,
+                    "bytesScanned": bytes_scanned,
+                },
+                row_count,
+            )
+            if malformed_lines:
+                metrics.add("MalformedRecords", malformed_lines)
+
+    def _is_event_match(self, message, record):
+        """Returns True if a log event matches the filters
+
+        If the record of the event was not decoded, only the bot object of the
+        message is decoded when all the filters are on bot fields.
+        """
+        if not self._filters:
+            return True
+        if record is None:
+            record = (
+                {"bot": get_message_bot(message)} if self._has_bot_filters_only else loads(message)
+            )
+        return self.is_match(record)
+
+    def is_match(self, record):
+        """Returns True if a conversation log record matches the filters"""
+        return all(get_path_value(record, path) == value for path, value in self._filters)
+
+
+def iter_file_lines(path, use_mmap=True):
+    """Iterate over the lines of a plain, memory-mapped or gzip compressed file as bytes"""
+    if path.endswith(_GZIP_SUFFIX):
+        with gzip.open(path, "rb") as log_file:
+            yield from log_file
+        return
+    with open(path, "rb") as log_file:
+        if not use_mmap or os.fstat(log_file.fileno()).st_size == 0:
+            yield from log_file
+            return
+        with mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+            yield from iter(mapped_file.readline, b"")
+
+
+def parse_log_line(line, decode_records=True):
+    """Parse a line of exported conversation logs
+
+    Returns a list of (timestamp in epoch milliseconds, JSON message, decoded
+    record) tuples. Firehose subscription lines may hold several log events.
+    Conversation log record lines are always decoded to read their timestamp.
+    The messages of the other formats are only decoded if decode_records is
+    True, otherwise their record is None.
+    """
+    line = line.strip()
+    if not line:
+        return []
+    if not line.startswith(b"{"):
+        # CloudWatch Logs export: <ISO 8601 timestamp> <message>
+        timestamp, _, message = line.partition(b" ")
+        message = message.decode("utf-8")
+        record = loads(message) if decode_records else None
+        return [(parse_timestamp(timestamp.decode("utf-8")), message, record)]
+    if b'"logEvents"' not in line:
+        message = line.decode("utf-8")
+        record = loads(message)
+        return [(parse_timestamp(record["timestamp"]), message, record)]
+    try:
+        documents = [loads(line)]
+    except ValueError:
+        # Firehose may concatenate the subscription data documents
+        documents = _decode_concatenated_json(line.decode("utf-8"))
+    return [
+        (
+            log_event["timestamp"],
+            log_event["message"],
+            loads(log_event["message"]) if decode_records else None,
+        )
+        for data in documents
+        if data.get("messageType") == "DATA_MESSAGE"
+        for log_event in data.get("logEvents", [])
+    ]
+
+
+def get_message_bot(message):
+    """Get the bot object of a JSON conversation log message
+
+    Conversation log records have a single bot object without nested objects,
+    so only that object is decoded. Messages without exactly one such object
+    are decoded whole.
+    """
+    bots = _BOT_OBJECT_PATTERN.findall(message)
+    if len(bots) == 1:
+        return loads(bots[0])
+    return loads(message).get("bot") or {}
+
+
+def _decode_concatenated_json(text):
+    """Decode JSON documents that may be concatenated without separators"""
+    index = 0
+    while index < len(text):
+        document, index = _JSON_DECODER.raw_decode(text, index)
+        yield document
+        while index < len(text) and text[index].isspace():
+            index += 1
+
+
+def parse_timestamp(timestamp):
+    """Parse an ISO 8601 UTC timestamp (e.g. 2021-09-10T00:00:00.123Z) to epoch milliseconds"""
+    fraction = timestamp[_FRACTION_START:].rstrip("Z")
+    milliseconds = int(f"{fraction:0<3}"[:3]) if fraction else 0
+    seconds = _parse_minutes(timestamp[:_MINUTES_TIMESTAMP_LENGTH]) + int(
+        timestamp[_SECONDS_START:_SECONDS_TIMESTAMP_LENGTH]
+    )
+    return seconds * 1000 + milliseconds
+
+
+def get_result_row(timestamp_ms, message):
+    """Format a log event as a Log Insights query result row"""
+    minutes, milliseconds = divmod(timestamp_ms, 60000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return [
+        {
+            "field": "@timestamp",
+            "value": f"{_format_minutes(minutes)}:{seconds:02d}.{milliseconds:03d}",
+        },
+        {"field": "@message", "value": message},
+    ]
+
+
+# log events are mostly in time order, so consecutive events share their minute
+@lru_cache(maxsize=1024)
+def _parse_minutes(timestamp):
+    return timegm(time.strptime(timestamp, "%Y-%m-%dT%H:%M"))
+
+
+@lru_cache(maxsize=1024)
+def _format_minutes(minutes):
+    return time.strftime("%Y-%m-%d %H:%M", time.gmtime(minutes * 60))
+
+
+def get_file_log_source_from_env(query=None, bot_id=None, bot_locale_id=None):
+    """Get a file log source configured from environment variables
+
+    The rows are filtered with the widget query (see FileLogSource).
+    LOG_SOURCE_PATHS is a comma separated list of file paths or glob patterns.
+    Memory mapping of plain files is disabled by setting LOG_SOURCE_MMAP to
+    false. Returns None if LOG_SOURCE_PATHS is not set.
+    """
+    patterns = [p.strip() for p in getenv("LOG_SOURCE_PATHS", "").split(",") if p.strip()]
+    if not patterns:
+        return None
+    paths = [path for pattern in patterns for path in sorted(glob.glob(pattern))]
+    return FileLogSource(
+        paths=paths,
+        query=query,
+        bot_id=bot_id,
+        bot_locale_id=bot_locale_id,
+        use_mmap=getenv("LOG_SOURCE_MMAP", "true").lower() == "true",
+    )
@@ -0,0 +1,134 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Conversation Log Sources
+
+The widgets render from Log Insights style result rows (lists of field and
+value cells with the @timestamp and @message fields). A log source returns
+those rows for a time range:
+
+- LogInsightsSource runs the widget query with lib.cw_logs (default)
+- lib.file_log_source.FileLogSource streams exported conversation logs from
+  local files, without the Log Insights scan cost and row limit, e.g. for
+  historical analyses and offline benchmarks
+
+Sources that do not run Log Insights apply the field filters of the widget
+query (see get_query_filters).
+"""
+
+import re
+
+from .cw_logs import get_query_results
+
+# string literals, words (keywords, field names and numbers) and symbols of a query
+_QUERY_TOKEN_REGEX = re.compile(r"""'((?:[^'\\]|\\.)*)'|"((?:[^"\\]|\\.)*)"|([\w.@`]+)|(\S)""")
+# keywords of the filter queries, which are case insensitive
+_QUERY_KEYWORDS = ["filter", "and"]
+_QUERY_FIELD_REGEX = re.compile(r"[\w.@`]+")
+_QUERY_ESCAPE_REGEX = re.compile(r"\\(.)")
+
+
+class LogSource:  # pylint: disable=too-few-public-methods
+    """Conversation log source interface"""
+
+    def get_rows(self, start_time, end_time, metrics=None):
+        """Get the result rows of the conversation logs in a time range
+
+        Returns a list or an iterator of rows. The time range is inclusive in epoch seconds. If a
+        lib.metrics.WidgetMetrics object is passed, the read statistics are
+        added to it.
+        """
+        raise NotImplementedError
+
+
+class LogInsightsSource(LogSource):  # pylint: disable=too-few-public-methods
+    """Log source that runs a Log Insights query
+
+    get_logs_client is a function that returns a CloudWatch Logs client. It is
+    called when rows are read, so that widgets rendered without any query (e.g.
+    from rollups) do not create a client. The other keyword arguments are
+    passed to lib.cw_logs.get_query_results.
+    """
+
+    def __init__(self, query, log_group_names, get_logs_client, **query_kwargs):
+        self._query = query
+        self._log_group_names = log_group_names
+        self._get_logs_client = get_logs_client
+        self._query_kwargs = query_kwargs
+
+    def get_rows(self, start_time, end_time, metrics=None):
+        return get_query_results(
+            query=self._query,
+            log_group_names=self._log_group_names,
+            start_time=start_time,
+            end_time=end_time,
+            logs_client=self._get_logs_client(),
+            metrics=metrics,
+            **self._query_kwargs,
+        )
+
+
+def get_query_tokens(query):
+    """Get the tokens of a Log Insights query
+
+    String literals are ("literal", value) tuples, with single and double
+    quotes alike. The filter keywords are lower case.
+    """
+    tokens = []
+    for match in _QUERY_TOKEN_REGEX.finditer(query):
+        token = match.group(match.lastindex)
+        if match.lastindex <= 2:
+            tokens.append(("literal", token))
+        else:
+            tokens.append(token.lower() if token.lower() in _QUERY_KEYWORDS else token)
+    return tokens
+
+
+def get_query_filters(query):
+    """Get the field filters of a Log Insights query
+
+    Supports FILTER commands of field = 'value' comparisons joined with AND,
+    like the queries of the dashboard widgets:
+
+        FILTER bot.id = 'BOTID' AND bot.localeId = 'en_US'
+
+    Returns a list of (field, value) tuples, empty for an empty query.
+    Raises ValueError for any other query.
+    """
+    commands = [[]]
+    for token in get_query_tokens(query):
+        if token == "|":
+            commands.append([])
+        else:
+            commands[-1].append(token)
+    if commands == [[]]:
+        return []
+    filters = []
+    for command in commands:
+        command_filters = _get_command_filters(command)
+        if command_filters is None:
+            raise ValueError(f"unsupported query, only FILTER field = 'value' [AND ...]: {query}")
+        filters.extend(command_filters)
+    return filters
+
+
+def _get_command_filters(command):
+    """Get the (field, value) filters of the tokens of a FILTER command or None if not supported"""
+    if command[:1] != ["filter"] or len(command) < 4:
+        return None
+    filters = []
+    for index in range(1, len(command), 4):
+        comparison = command[slice(index, index + 4)]
+        # comparisons are joined with AND
+        if len(comparison) < 3 or comparison[3:] != (["and"] if index + 4 < len(command) else []):
+            return None
+        field, operator, literal = comparison[:3]
+        if (
+            not isinstance(field, str)
+            or not _QUERY_FIELD_REGEX.fullmatch(field)
+            or field in _QUERY_KEYWORDS
+            or operator != "="
+            or not isinstance(literal, tuple)
+        ):
+            return None
+        filters.append((field.strip("`"), _QUERY_ESCAPE_REGEX.sub(r"\1", literal[1])))
+    return filters
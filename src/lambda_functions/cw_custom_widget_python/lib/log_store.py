@@ -0,0 +1,309 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Partitioned Parquet Conversation Log Store
+
+Stores Lex conversation log records as Parquet files partitioned by bot id,
+locale id and hour, in the same layout as the rollups:
+
+    bot_id=<bot id>/locale_id=<locale id>/hour=2021-09-10T00/<part>.parquet
+
+Each record is a row with the event time in epoch milliseconds, one column
+per scalar message path (see MESSAGE_PATH_COLUMNS) and flattened columns for
+the slot original values (slot:<slot name>) and the session attributes
+(session_attribute:<key>).
+
+Reads are pushed down to the files: only the partitions of the bot, locale
+and hours of the time range are listed, row groups outside of the time range
+are skipped with the event time statistics and only the columns of the
+requested message paths are read, e.g. the intent and slot columns for the
+slots widgets. The reader returns decoded message columns that the widgets
+render from without decoding JSON.
+
+The store URI is a local directory or a URI supported by pyarrow (e.g.
+s3://bucket/prefix). pyarrow is only needed when the store is used and is not
+included in the Lambda layer.
+
+Conversion of exported conversation log files (see lib.file_log_source):
+
+    python -m lib.log_store --store-uri /tmp/log_store conversation-logs/*.gz
+"""
+
+import argparse
+from datetime import datetime, timezone
+import hashlib
+import os
+from os import getenv
+
+import pyarrow as pa
+from pyarrow import fs
+import pyarrow.parquet as pq
+
+from .file_log_source import iter_file_lines, parse_log_line
+
+HOUR_IN_SECS = 3600
+EVENT_TIME_COLUMN = "event_time"
+# scalar message path -> column
+MESSAGE_PATH_COLUMNS = {
+    "timestamp": "timestamp",
+    "sessionId": "session_id",
+    "requestId": "request_id",
+    "inputMode": "input_mode",
+    "inputTranscript": "input_transcript",
+    "missedUtterance": "missed_utterance",
+    "sessionState.intent.name": "intent_name",
+    "sessionState.intent.state": "intent_state",
+    "sessionState.dialogAction.type": "dialog_action_type",
+    "sessionState.originatingRequestId": "originating_request_id",
+}
+_COLUMN_TYPES = {EVENT_TIME_COLUMN: pa.int64(), "missed_utterance": pa.bool_()}
+_PARQUET_SUFFIX = ".parquet"
+
+
+def _get_slot_original_value(slot):
+    return ((slot or {}).get("value") or {}).get("originalValue")
+
+
+def _get_slot(original_value):
+    return {"value": {"originalValue": original_value}}
+
+
+def _get_session_attribute(value):
+    return value
+
+
+# message path of a dictionary -> (item column prefix, function getting the stored value of
+# an item, function rebuilding an item from its stored value)
+MESSAGE_PATH_COLUMN_PREFIXES = {
+    "sessionState.intent.slots": ("slot:", _get_slot_original_value, _get_slot),
+    "sessionState.sessionAttributes": (
+        "session_attribute:",
+        _get_session_attribute,
+        _get_session_attribute,
+    ),
+}
+
+
+def _get_path_value(record, path):
+    value = record
+    for key in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def get_partition_dir(bot_id, bot_locale_id, hour):
+    """Get the partition directory of an hour"""
+    hour_string = datetime.fromtimestamp(hour, tz=timezone.utc).strftime("%Y-%m-%dT%H")
+    return f"bot_id={bot_id}/locale_id={bot_locale_id}/hour={hour_string}"
+
+
+def get_record_columns(log_events):
+    """Flatten (event time in epoch milliseconds, record) tuples into columns
+
+    Item columns of the dictionary message paths are added in order of first
+    appearance. Missing values are None.
+    """
+    row_count = len(log_events)
+    columns = {EVENT_TIME_COLUMN: [event_time for event_time, _ in log_events]}
+    for path, column in MESSAGE_PATH_COLUMNS.items():
+        columns[column] = [_get_path_value(record, path) for _, record in log_events]
+    for path, (prefix, get_value, _) in MESSAGE_PATH_COLUMN_PREFIXES.items():
+        for row_index, (_, record) in enumerate(log_events):
+            items = _get_path_value(record, path)
+            if not isinstance(items, dict):
+                continue
+            for key, item in items.items():
+                value = get_value(item)
+                if value is None:
+                    continue
+                column = columns.setdefault(f"{prefix}{key}", [None] * row_count)
+                column[row_index] = value
+    return columns
+
+
+class ParquetLogStore:
+    """Conversation log store of Parquet files partitioned by bot, locale and hour"""
+
+    def __init__(self, uri):
+        if "://" not in uri:
+            uri = os.path.abspath(uri)
+        self._filesystem, self._root_dir = fs.FileSystem.from_uri(uri)
+
+    def write_records(self, log_events, part_name):
+        """Write (event time in epoch milliseconds, record) tuples to the store
+
+        The records of each bot, locale and hour are written to a part file
+        named after part_name. Writing the same part again replaces it.
+        Returns the number of files written.
+        """
+        partitions = {}
+        for event_time, record in log_events:
+            bot = record.get("bot") or {}
+            hour = event_time // 1000 - (event_time // 1000) % HOUR_IN_SECS
+            partition = (bot.get("id"), bot.get("localeId"), hour)
+            partitions.setdefault(partition, []).append((event_time, record))
+
+        for (bot_id, bot_locale_id, hour), partition_events in partitions.items():
+            partition_dir = f"{self._root_dir}/{get_partition_dir(bot_id, bot_locale_id, hour)}"
+            self._filesystem.create_dir(partition_dir, recursive=True)
+            columns = get_record_columns(partition_events)
+            table = pa.table(
+                {
+                    column: pa.array(values, type=_COLUMN_TYPES.get(column, pa.string()))
+                    for column, values in columns.items()
+                }
+            )
+            pq.write_table(
+                table,
+                f"{partition_dir}/{part_name}{_PARQUET_SUFFIX}",
+                filesystem=self._filesystem,
+            )
+        return len(partitions)
+
+    def get_part_paths(self, bot_id, bot_locale_id, start_time, end_time):
+        """Get the paths of the part files of the hours of a time range in time order"""
+        first_hour = start_time - start_time % HOUR_IN_SECS
+        selectors = [
+            fs.FileSelector(
+                f"{self._root_dir}/{get_partition_dir(bot_id, bot_locale_id, hour)}",
+                allow_not_found=True,
+            )
+            for hour in range(first_hour, end_time + 1, HOUR_IN_SECS)
+        ]
+        return [
+            file_info.path
+            for selector in selectors
+            for file_info in sorted(self._filesystem.get_file_info(selector), key=lambda i: i.path)
+            if file_info.type == fs.FileType.File and file_info.path.endswith(_PARQUET_SUFFIX)
+        ]
+
+    def read_messages(self, bot_id, bot_locale_id, start_time, end_time, paths, metrics=None):
+        """Read the values of message paths of the records in an inclusive time range
+
+        Returns a dictionary of path to list of values in the format of
+        lib.messages.decode_messages. Raises a ValueError if a path is not
+        stored. If a lib.metrics.WidgetMetrics object is passed, the read
+        statistics are added to it.
+        """
+        # pylint: disable=too-many-arguments,too-many-locals
+        unknown_paths = [
+            p
+            for p in paths
+            if p not in MESSAGE_PATH_COLUMNS and p not in MESSAGE_PATH_COLUMN_PREFIXES
+        ]
+        if unknown_paths:
+            raise ValueError(f"message paths not in the log store: {unknown_paths}")
+
+        messages = {path: [] for path in paths}
+        part_paths = self.get_part_paths(bot_id, bot_locale_id, start_time, end_time)
+        time_filter = [
+            (EVENT_TIME_COLUMN, ">=", start_time * 1000),
+            (EVENT_TIME_COLUMN, "<", (end_time + 1) * 1000),
+        ]
+        row_count = 0
+        for part_path in part_paths:
+            with self._filesystem.open_input_file(part_path) as part_file:
+                column_names = pq.ParquetFile(part_file).schema_arrow.names
+            prefix_columns = {
+                path: [c for c in column_names if c.startswith(prefix)]
+                for path, (prefix, _, _) in MESSAGE_PATH_COLUMN_PREFIXES.items()
+                if path in paths
+            }
+            columns = [
+                MESSAGE_PATH_COLUMNS[p]
+                for p in paths
+                if p in MESSAGE_PATH_COLUMNS and MESSAGE_PATH_COLUMNS[p] in column_names
+            ] + [c for path_columns in prefix_columns.values() for c in path_columns]
+            table = pq.read_table(
+                part_path,
+                columns=columns,
+                filters=time_filter,
+                filesystem=self._filesystem,
+            )
+            row_count += table.num_rows
+            for path in paths:
+                if path in prefix_columns:
+                    messages[path].extend(
+                        _read_path_dictionaries(table, path, prefix_columns[path])
+                    )
+                elif MESSAGE_PATH_COLUMNS[path] in column_names:
+                    messages[path].extend(table.column(MESSAGE_PATH_COLUMNS[path]).to_pylist())
+                else:
+                    messages[path].extend([None] * table.num_rows)
+
+        if metrics is not None:
+            metrics.add("LogStoreFiles", len(part_paths))
+            metrics.add("RowsReturned", row_count)
+        return messages
+
+
+def _read_path_dictionaries(table, path, columns):
+    """Rebuild the dictionaries of a message path from its flattened item columns
+
+    Rows without any stored item are None, as for records without the path.
+    """
+    prefix, _, get_item = MESSAGE_PATH_COLUMN_PREFIXES[path]
+    prefix_length = len(prefix)
+    keys = [column[prefix_length:] for column in columns]
+    if not keys:
+        return [None] * table.num_rows
+    values = [table.column(column).to_pylist() for column in columns]
+    dictionaries = []
+    for row in zip(*values):
+        items = {key: get_item(value) for key, value in zip(keys, row) if value is not None}
+        dictionaries.append(items or None)
+    return dictionaries
+
+
+def get_log_store_from_env():
+    """Get a Parquet log store configured from the LOG_STORE_URI environment variable
+
+    Returns None if no log store is configured.
+    """
+    uri = getenv("LOG_STORE_URI")
+    if not uri:
+        return None
+    return ParquetLogStore(uri=uri)
+
+
+def convert_files(paths, log_store):
+    """Convert exported conversation log files to a Parquet log store
+
+    Each file is written to its own part files, named after a hash of its
+    path, so that converting a file again replaces its records. Returns the
+    number of records written and the number of lines that could not be
+    decoded.
+    """
+    record_count = 0
+    malformed_lines = 0
+    for path in paths:
+        part_name = hashlib.sha256(os.path.abspath(path).encode("utf-8")).hexdigest()[:16]
+        log_events = []
+        for line in iter_file_lines(path):
+            try:
+                log_events.extend(
+                    (event_time, record) for event_time, _, record in parse_log_line(line)
+                )
+            except (KeyError, TypeError, ValueError):
+                malformed_lines += 1
+        log_store.write_records(log_events, part_name=part_name)
+        record_count += len(log_events)
+    return record_count, malformed_lines
+
+
+def main():
+    """Convert exported conversation log files to a Parquet log store"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--store-uri", required=True, help="log store directory or URI")
+    parser.add_argument("paths", nargs="+", help="exported conversation log files")
+    args = parser.parse_args()
+    record_count, malformed_lines = convert_files(args.paths, ParquetLogStore(uri=args.store_uri))
+    print(
+        f"converted {record_count} records from {len(args.paths)} files"
+        f" - skipped {malformed_lines} malformed lines"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Lex Conversation Log Message Decoding
+
+Decodes the JSON @message field of Lex conversation log records and extracts
+only the requested paths (e.g. "sessionState.intent.name") into columns in a
+single pass. The decoded records are discarded right away so that fields that
+are not needed (interpretations, bot, messages...) are never materialized in
+a dataframe.
+
+Uses orjson to decode JSON when it is installed and falls back to the standard
+library json module otherwise.
+"""
+
+import json
+
+try:
+    import orjson  # pylint: disable=import-error
+
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+
+def _get_path_value(record, keys):
+    value = record
+    for key in keys:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def get_path_value(record, path):
+    """Get the value of a dotted path in a decoded message or None if it is missing"""
+    return _get_path_value(record, path.split("."))
+
+
+def decode_messages(messages, paths):
+    """Decode JSON messages and extract the values of dotted paths
+
+    Returns a dictionary of path to list of values. Missing paths are None.
+    """
+    path_keys = [tuple(path.split(".")) for path in paths]
+    columns = [[] for _ in paths]
+    path_columns = list(zip(path_keys, columns))
+    for message in messages:
+        record = loads(message)
+        for keys, column in path_columns:
+            column.append(_get_path_value(record, keys))
+    return dict(zip(paths, columns))
+
+
+def decode_messages_df(message_series, paths):
+    """Decode a series of JSON messages into a dataframe with one column per path"""
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
+    return pd.DataFrame(
+        decode_messages(message_series, paths),
+        index=message_series.index,
+        columns=paths,
+    )
@@ -0,0 +1,163 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Custom Widget Request Metrics
+
+Records the duration of the phases of a widget request and the Log Insights
+query statistics, and emits them as a CloudWatch Embedded Metric Format (EMF)
+record written to stdout, which CloudWatch Logs extracts as metrics:
+
+    QuerySlotWaitTime wait for a query slot of the query coordinator
+    StartQueryTime    start_query calls (query scheduling)
+    QueryTime         from the query start to its final status (execution)
+    PollingTime       get_query_results calls (polling overhead)
+    ConversionTime    result rows to dataframe or columns
+    DecodeTime        JSON decoding of the @message field
+    AggregationTime   counting of the widget values
+    RenderTime        HTML rendering
+    TotalTime         whole widget request
+
+Durations of parallel queries are summed. Query metrics are recorded through
+the metrics argument of the lib.cw_logs functions. Widget modules record
+their phases with record_phase in the metrics of the current request, which
+are set by the handler with set_current_metrics.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+import json
+from os import getenv
+from threading import Lock
+import time
+
+DEFAULT_NAMESPACE = "LexAnalytics/CustomWidget"
+MILLISECONDS = "Milliseconds"
+_TIME_SUFFIX = "Time"
+_TIMINGS_FOOTER = "<p><small>Timings: {timings}</small></p>"
+# Log Insights query statistics -> (metric name, unit)
+_QUERY_STATISTICS = {
+    "recordsScanned": ("RecordsScanned", "Count"),
+    "recordsMatched": ("RecordsMatched", "Count"),
+    "bytesScanned": ("BytesScanned", "Bytes"),
+}
+
+_CURRENT_METRICS = ContextVar("current_metrics", default=None)
+
+
+class WidgetMetrics:
+    """Metrics of a widget request keyed by metric name
+
+    Values added with the same name are summed. Safe to update from the query
+    threads.
+    """
+
+    def __init__(self, namespace=DEFAULT_NAMESPACE, dimensions=None):
+        self.namespace = namespace
+        self.dimensions = dict(dimensions or {})
+        # metric name -> [value, unit]
+        self._metrics = {}
+        self._lock = Lock()
+
+    def add(self, name, value, unit="Count"):
+        """Add a value to a metric"""
+        with self._lock:
+            metric = self._metrics.setdefault(name, [0, unit])
+            metric[0] += value
+
+    @contextmanager
+    def phase(self, name):
+        """Add the duration of a block in milliseconds to the <name>Time metric"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(f"{name}{_TIME_SUFFIX}", (time.perf_counter() - start) * 1000, MILLISECONDS)
+
+    def add_query_statistics(self, statistics, row_count):
+        """Add the statistics and the number of returned rows of a Log Insights query"""
+        self.add("QueryCount", 1)
+        self.add("RowsReturned", row_count)
+        for key, (name, unit) in _QUERY_STATISTICS.items():
+            if (statistics or {}).get(key) is not None:
+                self.add(name, statistics[key], unit)
+
+    def get_emf_record(self, timestamp=None):
+        """Get the metrics as an Embedded Metric Format record
+
+        Metrics are emitted with the first dimension alone and with all the
+        dimensions, e.g. per widget type and per widget type and render path.
+        """
+        dimension_names = list(self.dimensions)
+        dimension_sets = [dimension_names]
+        if len(dimension_names) > 1:
+            dimension_sets.insert(0, dimension_names[:1])
+        timestamp = time.time() if timestamp is None else timestamp
+        return {
+            "_aws": {
+                "Timestamp": int(timestamp * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": self.namespace,
+                        "Dimensions": dimension_sets,
+                        "Metrics": [
+                            {"Name": name, "Unit": unit}
+                            for name, (_, unit) in self._metrics.items()
+                        ],
+                    }
+                ],
+            },
+            **self.dimensions,
+            **{name: value for name, (value, _) in self._metrics.items()},
+        }
+
+    def emit(self):
+        """Write the Embedded Metric Format record to stdout"""
+        # the Lambda runtime sends stdout to CloudWatch Logs, which extracts
+        # the metrics of EMF records, so the record is printed instead of logged
+        # to keep it a bare JSON line without the logger prefix
+        print(json.dumps(self.get_emf_record()), flush=True)
+
+    def get_timings_footer(self):
+        """Get a compact HTML footer with the metric values"""
+        timings = ", ".join(
+            (
+                f"{_get_phase_name(name)} {value:.0f} ms"
+                if unit == MILLISECONDS
+                else f"{name} {value}"
+            )
+            for name, (value, unit) in self._metrics.items()
+        )
+        return _TIMINGS_FOOTER.format(timings=timings)
+
+
+def _get_phase_name(name):
+    # str.removesuffix is not available in Python 3.8
+    return name[: -len(_TIME_SUFFIX)] if name.endswith(_TIME_SUFFIX) else name
+
+
+def get_metrics_namespace_from_env():
+    """Get the EMF namespace from the METRICS_NAMESPACE environment variable
+
+    Returns None if metrics are not emitted.
+    """
+    return getenv("METRICS_NAMESPACE") or None
+
+
+def set_current_metrics(metrics):
+    """Set the metrics of the current request and return a token to reset them"""
+    return _CURRENT_METRICS.set(metrics)
+
+
+def reset_current_metrics(token):
+    """Reset the metrics of the current request"""
+    _CURRENT_METRICS.reset(token)
+
+
+@contextmanager
+def record_phase(name):
+    """Record the duration of a block in the metrics of the current request, if any"""
+    metrics = _CURRENT_METRICS.get()
+    if metrics is None:
+        yield
+        return
+    with metrics.phase(name):
+        yield
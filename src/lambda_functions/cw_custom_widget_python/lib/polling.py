@@ -0,0 +1,89 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""CloudWatch Log Insights Query Poll Scheduler
+
+Schedules GetQueryResults polls with exponential backoff and jitter bounded
+by a hard deadline. Small queries are polled quickly while long running
+queries are polled less often to reduce API calls and throttling.
+
+The query statistics do not include the total amount of data to be scanned.
+The remaining time is estimated from the elapsed time while the scanned
+records keep growing: a query that has been scanning for a while is likely to
+keep running for a comparable time, so polls are spaced proportionally to the
+elapsed time.
+"""
+
+import random
+from time import monotonic
+
+_DEFAULT_INITIAL_DELAY_IN_SECS = 0.1
+_DEFAULT_MAX_DELAY_IN_SECS = 5.0
+_DEFAULT_BACKOFF_MULTIPLIER = 2.0
+# fraction of the elapsed time used as the estimate of the remaining time
+_DEFAULT_ELAPSED_TIME_FACTOR = 0.25
+# default time to wait for a query when no deadline is given
+_DEFAULT_TIMEOUT_IN_SECS = 30.0
+
+
+class PollScheduler:
+    """Poll delay scheduler with exponential backoff, jitter and a deadline"""
+
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+    def __init__(
+        self,
+        deadline=None,
+        initial_delay_in_secs=_DEFAULT_INITIAL_DELAY_IN_SECS,
+        max_delay_in_secs=_DEFAULT_MAX_DELAY_IN_SECS,
+        backoff_multiplier=_DEFAULT_BACKOFF_MULTIPLIER,
+        elapsed_time_factor=_DEFAULT_ELAPSED_TIME_FACTOR,
+        clock=monotonic,
+        jitter=random.random,
+    ):
+        self._clock = clock
+        self._start_time = clock()
+        self._deadline = (
+            deadline if deadline is not None else self._start_time + _DEFAULT_TIMEOUT_IN_SECS
+        )
+        self._initial_delay_in_secs = initial_delay_in_secs
+        self._max_delay_in_secs = max_delay_in_secs
+        self._backoff_multiplier = backoff_multiplier
+        self._elapsed_time_factor = elapsed_time_factor
+        self._jitter = jitter
+        self._polls = 0
+        self._records_scanned = 0.0
+
+    @property
+    def polls(self):
+        """Number of delays returned by the scheduler"""
+        return self._polls
+
+    @property
+    def deadline(self):
+        """Deadline in monotonic clock seconds"""
+        return self._deadline
+
+    def get_remaining_time(self):
+        """Get the time in seconds left before the deadline"""
+        return self._deadline - self._clock()
+
+    def get_next_delay(self, statistics=None):
+        """Get the time in seconds to sleep before the next poll
+
+        Returns None when the deadline has been reached.
+        """
+        remaining_time = self.get_remaining_time()
+        if remaining_time <= 0:
+            return None
+
+        backoff_delay = self._initial_delay_in_secs * self._backoff_multiplier**self._polls
+        # "equal jitter": keep half of the delay and randomize the other half
+        delay = backoff_delay / 2 + self._jitter() * backoff_delay / 2
+
+        records_scanned = float((statistics or {}).get("recordsScanned", 0.0))
+        if records_scanned > self._records_scanned:
+            elapsed_time = self._clock() - self._start_time
+            delay = max(delay, elapsed_time * self._elapsed_time_factor)
+        self._records_scanned = max(records_scanned, self._records_scanned)
+
+        self._polls = self._polls + 1
+        return min(delay, self._max_delay_in_secs, remaining_time)
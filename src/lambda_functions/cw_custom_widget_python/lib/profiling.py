@@ -0,0 +1,148 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Opt-in Request Profiling
+
+Profiles widget requests with cProfile and tracemalloc when the profile
+widget parameter is set or for a sampled fraction of the requests set with
+the PROFILE_SAMPLE_RATE environment variable (e.g. 0.01 for 1%).
+
+The profile (pstats format, e.g. for snakeviz) and a report of the top
+allocations are written to PROFILE_DIR (default /tmp/profiles) and uploaded
+to PROFILE_S3_BUCKET under PROFILE_S3_PREFIX if a bucket is set. A summary of
+the top hotspots is logged. Profiling slows down the request, mostly because
+of tracemalloc, so keep the sample rate low in production. cProfile only
+profiles the handler thread, the parallel query threads are not included.
+"""
+
+import io
+import os
+from os import getenv
+import random
+import time
+from uuid import uuid4
+
+_DEFAULT_PROFILE_DIR = "/tmp/profiles"  # nosec
+_DEFAULT_TOP_N = 20
+# number of frames kept by tracemalloc for each allocation
+_TRACEMALLOC_FRAMES = 5
+
+
+class RequestProfiler:
+    """Profiles the CPU time and the memory allocations of requests"""
+
+    def __init__(
+        self,
+        output_dir=_DEFAULT_PROFILE_DIR,
+        sample_rate=0.0,
+        top_n=_DEFAULT_TOP_N,
+        s3_bucket=None,
+        s3_prefix="profiles",
+        get_client=None,
+    ):
+        # pylint: disable=too-many-arguments
+        self.output_dir = output_dir
+        self.sample_rate = sample_rate
+        self.top_n = top_n
+        self._s3_bucket = s3_bucket
+        self._s3_prefix = s3_prefix.strip("/")
+        self._get_client = get_client
+
+    def is_enabled(self, event):
+        """Returns True if the request is profiled"""
+        if event.get("profile", False):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate  # nosec
+
+    def profile(self, function, logger, request_id=None):
+        """Call a function with profiling and write the profile and allocation reports
+
+        Failures writing the reports are logged and do not fail the call.
+        """
+        # imported on first use to keep them out of the cold start
+        # pylint: disable=import-outside-toplevel
+        import cProfile
+        import tracemalloc
+
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start(_TRACEMALLOC_FRAMES)
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            return function()
+        finally:
+            profiler.disable()
+            elapsed_time = time.perf_counter() - start
+            snapshot = tracemalloc.take_snapshot()
+            _, peak_memory = tracemalloc.get_traced_memory()
+            if not was_tracing:
+                tracemalloc.stop()
+            name = f"{int(time.time())}-{request_id or uuid4()}"
+            try:
+                self._write_reports(
+                    name=name,
+                    profiler=profiler,
+                    snapshot=snapshot,
+                    peak_memory=peak_memory,
+                    elapsed_time=elapsed_time,
+                    logger=logger,
+                )
+            except Exception as exception:  # pylint: disable=broad-except
+                logger.warning("failed to write profile - name: %s, error: %s", name, exception)
+
+    def _write_reports(self, name, profiler, snapshot, peak_memory, elapsed_time, logger):
+        # pylint: disable=too-many-arguments
+        import pstats  # pylint: disable=import-outside-toplevel
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        profile_path = os.path.join(self.output_dir, f"{name}.prof")
+        profiler.dump_stats(profile_path)
+
+        allocations_path = os.path.join(self.output_dir, f"{name}.allocations.txt")
+        statistics = snapshot.statistics("traceback")[: self.top_n]
+        _write_allocations(allocations_path, statistics=statistics, peak_memory=peak_memory)
+
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(self.top_n)
+        logger.info(
+            "request profile - name: %s, time: %.3f s, peak traced memory: %s bytes,"
+            " top allocations:\n%s\ntop functions:\n%s",
+            name,
+            elapsed_time,
+            peak_memory,
+            "\n".join(str(statistic) for statistic in statistics[:5]),
+            stream.getvalue(),
+        )
+
+        if self._s3_bucket:
+            s3_client = self._get_client("s3")
+            for path in [profile_path, allocations_path]:
+                key = os.path.basename(path)
+                s3_client.upload_file(
+                    path, self._s3_bucket, f"{self._s3_prefix}/{key}" if self._s3_prefix else key
+                )
+
+
+def _write_allocations(path, statistics, peak_memory):
+    with open(path, "w", encoding="utf-8") as allocations_file:
+        allocations_file.write(f"peak traced memory: {peak_memory} bytes\n")
+        for statistic in statistics:
+            allocations_file.write(f"\n{statistic}\n")
+            allocations_file.writelines(f"    {line}\n" for line in statistic.traceback.format())
+
+
+def get_request_profiler_from_env(get_client):
+    """Get a request profiler configured from environment variables
+
+    get_client is a function that takes a service name and returns a boto3
+    client. It is only called to upload the reports to S3.
+    """
+    return RequestProfiler(
+        output_dir=getenv("PROFILE_DIR") or _DEFAULT_PROFILE_DIR,
+        sample_rate=float(getenv("PROFILE_SAMPLE_RATE", "0")),
+        top_n=int(getenv("PROFILE_TOP_N", str(_DEFAULT_TOP_N))),
+        s3_bucket=getenv("PROFILE_S3_BUCKET") or None,
+        s3_prefix=getenv("PROFILE_S3_PREFIX", "profiles"),
+        get_client=get_client,
+    )
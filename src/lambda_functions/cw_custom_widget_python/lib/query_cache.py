@@ -0,0 +1,227 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""CloudWatch Log Insights Query Result Cache
+
+Caches the raw rows returned by Log Insights queries so that dashboard
+refreshes with the same query, log groups and period aligned time range are
+served from the warm Lambda container instead of running a new query.
+
+The cache has two tiers:
+- an in-memory LRU tier that lives as long as the Lambda container
+- an optional on-disk tier (e.g. under /tmp) that is enabled by setting the
+  QUERY_CACHE_DIR environment variable
+
+Both tiers evict entries by TTL and by size. Windows whose end time is still
+"live" (close to the current time) are never cached since Log Insights may
+still be ingesting events for them.
+"""
+
+from collections import OrderedDict
+import hashlib
+import json
+import os
+from os import getenv
+import re
+from threading import Lock
+import time
+
+_DEFAULT_TTL_IN_SECS = 3600
+_DEFAULT_MAX_ENTRIES = 32
+_DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+_DEFAULT_DISK_MAX_BYTES = 256 * 1024 * 1024
+# log events may arrive several minutes after they are generated
+DEFAULT_LIVE_WINDOW_IN_SECS = 600
+_CACHE_FILE_SUFFIX = ".json"
+# quoted string literal (kept as is) or whitespace run (collapsed to one space)
+_QUERY_TOKEN_REGEX = re.compile(r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`[^`]*`)|\s+""")
+
+
+def align_time_range(start_time, end_time, period):
+    """Align a time range in epoch seconds to the dashboard period
+
+    The start time is rounded down and the end time is rounded up to a period
+    boundary so that refreshes within the same period produce the same range.
+    """
+    if not period or period <= 0:
+        return start_time, end_time
+    aligned_start_time = start_time - (start_time % period)
+    aligned_end_time = end_time + (-end_time % period)
+    return aligned_start_time, aligned_end_time
+
+
+def normalize_query(query):
+    """Collapse the whitespace of a query outside of its string literals"""
+    return _QUERY_TOKEN_REGEX.sub(lambda match: match.group(1) or " ", query).strip()
+
+
+def get_cache_key(query, log_group_names, start_time, end_time):
+    """Get a cache key from the normalized query, the log groups and the time range
+
+    The key is also used to share the in-flight queries (see
+    lib.query_coordinator).
+    """
+    key_data = json.dumps(
+        [normalize_query(query), sorted(set(log_group_names)), start_time, end_time],
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(key_data.encode("utf-8")).hexdigest()
+
+
+def get_rows_size(rows):
+    """Estimate the size in bytes of Log Insights result rows"""
+    return sum(len(i["field"]) + len(i.get("value", "")) for r in rows for i in r)
+
+
+class QueryResultCache:
+    """Two tier (memory LRU and optional disk) Log Insights result cache"""
+
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+    def __init__(
+        self,
+        ttl_in_secs=_DEFAULT_TTL_IN_SECS,
+        max_entries=_DEFAULT_MAX_ENTRIES,
+        max_bytes=_DEFAULT_MAX_BYTES,
+        disk_dir=None,
+        disk_max_bytes=_DEFAULT_DISK_MAX_BYTES,
+        live_window_in_secs=DEFAULT_LIVE_WINDOW_IN_SECS,
+        clock=time.time,
+    ):
+        self._ttl_in_secs = ttl_in_secs
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._disk_dir = disk_dir
+        self._disk_max_bytes = disk_max_bytes
+        self._live_window_in_secs = live_window_in_secs
+        self._clock = clock
+        # key -> (expiration time, size, rows)
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = Lock()
+        if self._disk_dir:
+            os.makedirs(self._disk_dir, exist_ok=True)
+
+    def is_cacheable(self, end_time):
+        """Returns True if the window ending at end_time is no longer live"""
+        return end_time <= self._clock() - self._live_window_in_secs
+
+    def get(self, key):
+        """Get cached rows or None if the key is not in the cache or expired"""
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expiration, _, rows = entry
+                if expiration > now:
+                    self._entries.move_to_end(key)
+                    return rows
+                self._remove(key)
+
+        rows = self._get_from_disk(key, now)
+        if rows is not None:
+            self._put_in_memory(key, rows, now)
+        return rows
+
+    def put(self, key, rows):
+        """Put rows in the cache"""
+        now = self._clock()
+        self._put_in_memory(key, rows, now)
+        self._put_on_disk(key, rows, now)
+
+    def clear(self):
+        """Remove all entries from the memory tier"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._size = self._size - size
+
+    def _put_in_memory(self, key, rows, now):
+        size = get_rows_size(rows)
+        if size > self._max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (now + self._ttl_in_secs, size, rows)
+            self._size = self._size + size
+            while len(self._entries) > self._max_entries or self._size > self._max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _get_disk_path(self, key):
+        return os.path.join(self._disk_dir, f"{key}{_CACHE_FILE_SUFFIX}")
+
+    def _get_from_disk(self, key, now):
+        if not self._disk_dir:
+            return None
+        path = self._get_disk_path(key)
+        try:
+            if os.path.getmtime(path) + self._ttl_in_secs <= now:
+                os.remove(path)
+                return None
+            with open(path, "r", encoding="utf-8") as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+
+    def _put_on_disk(self, key, rows, now):
+        if not self._disk_dir:
+            return
+        path = self._get_disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as cache_file:
+                json.dump(rows, cache_file, separators=(",", ":"))
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+        self._evict_disk(now)
+
+    def _evict_disk(self, now):
+        """Remove expired files and oldest files over the disk size budget"""
+        files = []
+        for entry in os.scandir(self._disk_dir):
+            if not entry.name.endswith(_CACHE_FILE_SUFFIX):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            if stat.st_mtime + self._ttl_in_secs <= now:
+                _remove_file(entry.path)
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_size = sum(f[1] for f in files)
+        for _, size, path in sorted(files):
+            if total_size <= self._disk_max_bytes:
+                break
+            _remove_file(path)
+            total_size = total_size - size
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def get_query_result_cache_from_env():
+    """Get a query result cache configured from environment variables
+
+    Returns None if the cache is disabled by setting QUERY_CACHE_ENABLED to false
+    """
+    if getenv("QUERY_CACHE_ENABLED", "true").lower() != "true":
+        return None
+    return QueryResultCache(
+        ttl_in_secs=int(getenv("QUERY_CACHE_TTL_IN_SECS", str(_DEFAULT_TTL_IN_SECS))),
+        max_entries=int(getenv("QUERY_CACHE_MAX_ENTRIES", str(_DEFAULT_MAX_ENTRIES))),
+        max_bytes=int(getenv("QUERY_CACHE_MAX_BYTES", str(_DEFAULT_MAX_BYTES))),
+        disk_dir=getenv("QUERY_CACHE_DIR") or None,
+        disk_max_bytes=int(getenv("QUERY_CACHE_DISK_MAX_BYTES", str(_DEFAULT_DISK_MAX_BYTES))),
+        live_window_in_secs=int(
+            getenv("QUERY_CACHE_LIVE_WINDOW_IN_SECS", str(DEFAULT_LIVE_WINDOW_IN_SECS))
+        ),
+    )
@@ -0,0 +1,495 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""CloudWatch Log Insights Query Coordinator
+
+Dashboards fire all their custom widgets at the same time. Several widgets
+often run the same query and together they can exceed the account concurrent
+Log Insights query quota, which throttles and times out the queries. The
+coordinator turns those bursts into orderly queuing:
+
+- single-flight: concurrent requests for the same query (normalized query
+  string, log groups and time range) share one in-flight query. The requests
+  that arrive while the query is running wait for its published rows. If the
+  query fails, a waiting request runs it.
+- concurrency limiter: caps the number of queries running at once. Queries
+  waiting for a slot are started by priority (lower values first) and then in
+  arrival order.
+
+The in-flight queries and their rows are kept in a pluggable flight backend:
+- InProcessQueryFlightBackend (default) shares the queries between the threads
+  of the Lambda container
+- FileQueryFlightBackend shares the queries between the processes of a host
+  with a lock file and a rows file per query
+- S3QueryFlightBackend shares the queries between the Lambda containers with a
+  lease object and a rows object per query. Each Lambda container serves one
+  invocation at a time, so identical widget requests are only shared by a
+  backend on a shared store.
+
+The running query slots are kept in a pluggable slot backend:
+- InProcessQuerySlotBackend (default) shares the slots between the threads of
+  the Lambda container, e.g. the shards and count queries of a widget
+- FileLockQuerySlotBackend holds one lock file per slot in a directory and
+  shares the slots between the processes of a host. It is a stand-in for a
+  shared backend in tests and local runs.
+
+The default slot limit is lower than the shard and count query fan-out of a
+widget. A backend implementing QuerySlotBackend on a shared store can cap the
+queries of all the Lambda containers. Priorities only order the waiters of a
+process.
+"""
+
+import fcntl
+import gzip
+from heapq import heapify, heappush
+from itertools import count
+import json
+import os
+from os import getenv
+from threading import Condition, Lock
+import time
+from time import monotonic, sleep
+import uuid
+
+# lower values are started first
+HIGH_PRIORITY = 0
+DEFAULT_PRIORITY = 1
+LOW_PRIORITY = 2
+# lower than the query fan-out of a widget (4 shards or count queries)
+_DEFAULT_MAX_CONCURRENT_QUERIES = 2
+# slots released by other processes are only seen when polling the backend
+_DEFAULT_POLL_INTERVAL_IN_SECS = 0.05
+_DEFAULT_FLIGHT_POLL_INTERVAL_IN_SECS = 0.05
+_S3_FLIGHT_POLL_INTERVAL_IN_SECS = 0.25
+# lease of the flights of requests without a deadline (Lambda timeout)
+_DEFAULT_FLIGHT_LEASE_IN_SECS = 300
+# published rows are only read by the requests waiting for the flight
+_PUBLISHED_ROWS_TTL_IN_SECS = 60
+_SLOT_FILE_NAME = "query-slot-{index}.lock"
+_FLIGHT_LOCK_FILE_NAME = "query-flight-{key}.lock"
+_FLIGHT_ROWS_FILE_NAME = "query-flight-{key}.json"
+_FLIGHT_LEASE_OBJECT_NAME = "lease.json"
+_FLIGHT_ROWS_OBJECT_NAME = "rows.json.gz"
+
+
+class QueryWaitTimeoutError(TimeoutError):
+    """Deadline reached waiting for a query slot or for a shared query"""
+
+
+class QuerySlotBackend:
+    """Query slot backend interface"""
+
+    def try_acquire(self):
+        """Acquire a free slot without waiting
+
+        Returns a token to release the slot or None if all the slots are taken.
+        """
+        raise NotImplementedError
+
+    def release(self, token):
+        """Release a slot acquired with try_acquire"""
+        raise NotImplementedError
+
+
+class InProcessQuerySlotBackend(QuerySlotBackend):
+    """Query slots shared by the threads of a process"""
+
+    def __init__(self, max_slots):
+        self._free_slots = list(range(max_slots))
+        self._lock = Lock()
+
+    def try_acquire(self):
+        with self._lock:
+            return self._free_slots.pop() if self._free_slots else None
+
+    def release(self, token):
+        with self._lock:
+            self._free_slots.append(token)
+
+
+class FileLockQuerySlotBackend(QuerySlotBackend):
+    """Query slots shared by the processes of a host with one lock file per slot
+
+    Locks are released by the operating system if a process dies while
+    holding a slot.
+    """
+
+    def __init__(self, lock_dir, max_slots):
+        self._lock_dir = lock_dir
+        self._max_slots = max_slots
+        os.makedirs(self._lock_dir, exist_ok=True)
+
+    def try_acquire(self):
+        for index in range(self._max_slots):
+            path = os.path.join(self._lock_dir, _SLOT_FILE_NAME.format(index=index))
+            lock_file = open(path, "a", encoding="utf-8")  # pylint: disable=consider-using-with
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                continue
+            return lock_file
+        return None
+
+    def release(self, token):
+        try:
+            fcntl.flock(token, fcntl.LOCK_UN)
+        finally:
+            token.close()
+
+
+class QueryFlightBackend:
+    """Query flight backend interface
+
+    A flight is a query run by one request for all the concurrent requests
+    with the same key. Times are in epoch seconds.
+    """
+
+    def try_lead(self, key, expiration_time):
+        """Start the flight of a key if it is not running
+
+        Returns a token to finish the flight or None if another request runs
+        it. The flight of a request that dies without finishing it expires at
+        the expiration time, or when its process exits for local backends.
+        """
+        raise NotImplementedError
+
+    def finish(self, token, rows=None):
+        """Finish a flight started with try_lead and publish its rows, if any"""
+        raise NotImplementedError
+
+    def get_status(self, key):
+        """Get a (is running, time its rows were last published or None) tuple"""
+        raise NotImplementedError
+
+    def get_rows(self, key):
+        """Get the rows last published for a key or None"""
+        raise NotImplementedError
+
+
+class InProcessQueryFlightBackend(QueryFlightBackend):
+    """Query flights shared by the threads of a process"""
+
+    def __init__(self):
+        # key -> [is running, published time, rows]
+        self._flights = {}
+        self._lock = Lock()
+
+    def try_lead(self, key, expiration_time):
+        with self._lock:
+            flight = self._flights.setdefault(key, [False, None, None])
+            if flight[0]:
+                return None
+            flight[0] = True
+            return key
+
+    def finish(self, token, rows=None):
+        now = time.time()
+        with self._lock:
+            flight = self._flights[token]
+            flight[0] = False
+            if rows is not None:
+                flight[1:] = [now, rows]
+            for key, (is_running, published_time, _) in list(self._flights.items()):
+                if not is_running and (published_time or 0) < now - _PUBLISHED_ROWS_TTL_IN_SECS:
+                    del self._flights[key]
+
+    def get_status(self, key):
+        with self._lock:
+            is_running, published_time, _ = self._flights.get(key, [False, None, None])
+            return is_running, published_time
+
+    def get_rows(self, key):
+        with self._lock:
+            _, _, rows = self._flights.get(key, [False, None, None])
+            return rows
+
+
+class FileQueryFlightBackend(QueryFlightBackend):
+    """Query flights shared by the processes of a host with lock and rows files
+
+    The lock file of a flight is locked while it runs and released by the
+    operating system if its process dies.
+    """
+
+    def __init__(self, flight_dir):
+        self._flight_dir = flight_dir
+        os.makedirs(self._flight_dir, exist_ok=True)
+
+    def _get_path(self, file_name, key):
+        return os.path.join(self._flight_dir, file_name.format(key=key))
+
+    def _lock(self, key, operation):
+        lock_file = open(  # pylint: disable=consider-using-with
+            self._get_path(_FLIGHT_LOCK_FILE_NAME, key), "a", encoding="utf-8"
+        )
+        try:
+            fcntl.flock(lock_file, operation | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return None
+        return lock_file
+
+    def try_lead(self, key, expiration_time):
+        lock_file = self._lock(key, fcntl.LOCK_EX)
+        return None if lock_file is None else (key, lock_file)
+
+    def finish(self, token, rows=None):
+        key, lock_file = token
+        try:
+            if rows is not None:
+                path = self._get_path(_FLIGHT_ROWS_FILE_NAME, key)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as rows_file:
+                    json.dump(rows, rows_file, separators=(",", ":"))
+                os.replace(tmp_path, path)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+        self._remove_expired_rows()
+
+    def _remove_expired_rows(self):
+        expiration_time = time.time() - _PUBLISHED_ROWS_TTL_IN_SECS
+        rows_file_prefix, rows_file_suffix = _FLIGHT_ROWS_FILE_NAME.split("{key}")
+        for entry in os.scandir(self._flight_dir):
+            if not entry.name.startswith(rows_file_prefix):
+                continue
+            if not entry.name.endswith(rows_file_suffix):
+                continue
+            try:
+                if entry.stat().st_mtime < expiration_time:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                # removed by another process
+                pass
+
+    def get_status(self, key):
+        # a shared lock is only refused while the flight holds the exclusive lock
+        lock_file = self._lock(key, fcntl.LOCK_SH)
+        if lock_file is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+        try:
+            published_time = os.stat(self._get_path(_FLIGHT_ROWS_FILE_NAME, key)).st_mtime
+        except FileNotFoundError:
+            published_time = None
+        return lock_file is None, published_time
+
+    def get_rows(self, key):
+        try:
+            with open(self._get_path(_FLIGHT_ROWS_FILE_NAME, key), encoding="utf-8") as rows_file:
+                return json.load(rows_file)
+        except FileNotFoundError:
+            return None
+
+
+class S3QueryFlightBackend(QueryFlightBackend):
+    """Query flights shared by the Lambda containers through an S3 bucket
+
+    Each flight has a JSON lease object with its owner, expiration time and
+    rows published time, and a gzip compressed JSON rows object. The S3 API
+    of the layer SDK has no conditional writes, so the lease is read back
+    after it is written and the last writer leads. Requests that start the
+    same flight at the same time may still both run the query. Old objects
+    are removed by a lifecycle rule of the bucket.
+
+    get_client is a function that returns a boto3 client. It is called on
+    first use so that the client is not created on import.
+    """
+
+    def __init__(self, bucket, prefix, get_client):
+        self._bucket = bucket
+        self._prefix = prefix.strip("/")
+        self._get_client = get_client
+
+    def _get_object_key(self, key, object_name):
+        return f"{self._prefix}/{key}/{object_name}" if self._prefix else f"{key}/{object_name}"
+
+    def _get_object(self, key, object_name):
+        s3_client = self._get_client("s3")
+        try:
+            response = s3_client.get_object(
+                Bucket=self._bucket, Key=self._get_object_key(key, object_name)
+            )
+        except s3_client.exceptions.NoSuchKey:
+            return None
+        return response["Body"].read()
+
+    def _get_lease(self, key):
+        payload = self._get_object(key, _FLIGHT_LEASE_OBJECT_NAME)
+        return json.loads(payload) if payload is not None else {}
+
+    def _put_lease(self, key, lease):
+        self._get_client("s3").put_object(
+            Bucket=self._bucket,
+            Key=self._get_object_key(key, _FLIGHT_LEASE_OBJECT_NAME),
+            Body=json.dumps(lease).encode("utf-8"),
+            ContentType="application/json",
+        )
+
+    def try_lead(self, key, expiration_time):
+        lease = self._get_lease(key)
+        if lease.get("expirationTime", 0) > time.time():
+            return None
+        owner = uuid.uuid4().hex
+        published_time = lease.get("publishedTime")
+        self._put_lease(
+            key,
+            {"owner": owner, "expirationTime": expiration_time, "publishedTime": published_time},
+        )
+        if self._get_lease(key).get("owner") != owner:
+            return None
+        return key, owner, published_time
+
+    def finish(self, token, rows=None):
+        key, owner, published_time = token
+        if rows is not None:
+            self._get_client("s3").put_object(
+                Bucket=self._bucket,
+                Key=self._get_object_key(key, _FLIGHT_ROWS_OBJECT_NAME),
+                Body=gzip.compress(json.dumps(rows, separators=(",", ":")).encode("utf-8")),
+                ContentType="application/gzip",
+            )
+            published_time = time.time()
+        self._put_lease(key, {"owner": owner, "expirationTime": 0, "publishedTime": published_time})
+
+    def get_status(self, key):
+        lease = self._get_lease(key)
+        return lease.get("expirationTime", 0) > time.time(), lease.get("publishedTime")
+
+    def get_rows(self, key):
+        payload = self._get_object(key, _FLIGHT_ROWS_OBJECT_NAME)
+        return json.loads(gzip.decompress(payload).decode("utf-8")) if payload is not None else None
+
+
+class QueryCoordinator:
+    """Single-flight query sharing and priority concurrency limiter"""
+
+    def __init__(
+        self,
+        backend,
+        flight_backend=None,
+        poll_interval_in_secs=_DEFAULT_POLL_INTERVAL_IN_SECS,
+        flight_poll_interval_in_secs=_DEFAULT_FLIGHT_POLL_INTERVAL_IN_SECS,
+    ):
+        self._backend = backend
+        self._flight_backend = flight_backend
+        self._poll_interval_in_secs = poll_interval_in_secs
+        self._flight_poll_interval_in_secs = flight_poll_interval_in_secs
+        self._condition = Condition()
+        # heap of (priority, sequence) of the requests waiting for a slot
+        self._waiters = []
+        self._sequence = count()
+
+    def share(self, key, function, deadline=None):
+        """Call a function once for all the concurrent requests with the same key
+
+        The function returns JSON serializable rows. Returns a tuple with the
+        rows and a flag indicating if they were published by the flight of
+        another request. Requests only use rows published after they started
+        waiting. If the flight they wait for ends without rows (e.g. the query
+        failed), one of them calls the function.
+
+        The deadline is a time.monotonic() value after which waiting for a
+        shared flight raises a QueryWaitTimeoutError.
+        """
+        if self._flight_backend is None:
+            return function(), False
+        wait_start_time = time.time()
+        while True:
+            is_running, published_time = self._flight_backend.get_status(key)
+            if published_time is not None and published_time > wait_start_time:
+                rows = self._flight_backend.get_rows(key)
+                if rows is not None:
+                    return rows, True
+            if not is_running:
+                lease_in_secs = _DEFAULT_FLIGHT_LEASE_IN_SECS
+                if deadline is not None:
+                    lease_in_secs = max(deadline - monotonic(), 0)
+                token = self._flight_backend.try_lead(
+                    key, expiration_time=time.time() + lease_in_secs
+                )
+                if token is not None:
+                    rows = None
+                    try:
+                        rows = function()
+                    finally:
+                        self._flight_backend.finish(token, rows)
+                    return rows, False
+            timeout = self._flight_poll_interval_in_secs
+            if deadline is not None:
+                timeout = min(timeout, deadline - monotonic())
+                if timeout <= 0:
+                    raise QueryWaitTimeoutError("Deadline reached waiting for a shared query")
+            sleep(timeout)
+
+    def acquire_slot(self, priority=DEFAULT_PRIORITY, deadline=None):
+        """Wait for a query slot and return a token to release it
+
+        Requests are granted slots by priority and then in arrival order.
+        Raises a QueryWaitTimeoutError if no slot is free before the deadline.
+        """
+        waiter = (priority, next(self._sequence))
+        with self._condition:
+            heappush(self._waiters, waiter)
+            try:
+                while True:
+                    if self._waiters[0] == waiter:
+                        token = self._backend.try_acquire()
+                        if token is not None:
+                            return token
+                    timeout = self._poll_interval_in_secs
+                    if deadline is not None:
+                        timeout = min(timeout, deadline - monotonic())
+                        if timeout <= 0:
+                            raise QueryWaitTimeoutError("Deadline reached waiting for a query slot")
+                    self._condition.wait(timeout)
+            finally:
+                self._waiters.remove(waiter)
+                heapify(self._waiters)
+                self._condition.notify_all()
+
+    def release_slot(self, token):
+        """Release a query slot"""
+        self._backend.release(token)
+        with self._condition:
+            self._condition.notify_all()
+
+
+def get_query_coordinator_from_env(get_client=None):
+    """Get a query coordinator configured from environment variables
+
+    Slots are shared between processes with lock files if QUERY_SLOT_LOCK_DIR
+    is set. Queries are shared between Lambda containers through S3 if
+    QUERY_FLIGHT_S3_BUCKET is set (get_client is a function that returns a
+    boto3 client) or between processes with files if QUERY_FLIGHT_DIR is
+    set. Returns None if the coordinator is disabled by setting
+    QUERY_COORDINATOR_ENABLED to false.
+    """
+    if getenv("QUERY_COORDINATOR_ENABLED", "true").lower() != "true":
+        return None
+    max_slots = int(getenv("QUERY_MAX_CONCURRENT_QUERIES", str(_DEFAULT_MAX_CONCURRENT_QUERIES)))
+    lock_dir = getenv("QUERY_SLOT_LOCK_DIR")
+    if lock_dir:
+        backend = FileLockQuerySlotBackend(lock_dir=lock_dir, max_slots=max_slots)
+    else:
+        backend = InProcessQuerySlotBackend(max_slots=max_slots)
+
+    flight_poll_interval_in_secs = _DEFAULT_FLIGHT_POLL_INTERVAL_IN_SECS
+    flight_bucket = getenv("QUERY_FLIGHT_S3_BUCKET")
+    flight_dir = getenv("QUERY_FLIGHT_DIR")
+    if flight_bucket and get_client is not None:
+        flight_backend = S3QueryFlightBackend(
+            bucket=flight_bucket,
+            prefix=getenv("QUERY_FLIGHT_S3_PREFIX", "query_flights"),
+            get_client=get_client,
+        )
+        flight_poll_interval_in_secs = _S3_FLIGHT_POLL_INTERVAL_IN_SECS
+    elif flight_dir:
+        flight_backend = FileQueryFlightBackend(flight_dir=flight_dir)
+    else:
+        flight_backend = InProcessQueryFlightBackend()
+    return QueryCoordinator(
+        backend=backend,
+        flight_backend=flight_backend,
+        flight_poll_interval_in_secs=flight_poll_interval_in_secs,
+    )
@@ -0,0 +1,196 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Hourly and Daily Rollup Store
+
+Stores pre-aggregated hourly and daily value counts of the top N widgets.
+Daily rollups merge the 24 hourly rollups of a UTC day so that long time
+ranges are read with one object per day instead of one per hour. Each rollup
+is a gzip compressed JSON document in a columnar layout where string columns
+are dictionary encoded:
+
+    {
+        "columns": ["intent", "slot", "value", "count"],
+        "dictionaries": {"intent": ["CheckBalance", ...], ...},
+        "data": {"intent": [0, 0, 1, ...], ..., "count": [10, 3, ...]}
+    }
+
+Rollups are keyed by dataset, bot id, locale id and hour or day. The storage backend
+is pluggable: S3RollupStore is used in the Lambda function and
+FileSystemRollupStore can be used locally and in tests.
+"""
+
+from datetime import datetime, timezone
+import gzip
+import json
+import os
+from os import getenv
+
+from botocore.exceptions import ClientError
+
+_ROLLUP_FILE_NAME = "rollup.json.gz"
+_COUNT_COLUMN = "count"
+HOUR_IN_SECS = 3600
+DAY_IN_SECS = 24 * HOUR_IN_SECS
+
+
+def encode_rollup(columns, counts):
+    """Encode a counts dictionary keyed by tuples into a compressed columnar document
+
+    The columns are the names of the key tuple items. A count column is added.
+    """
+    dictionaries = {column: {} for column in columns}
+    data = {column: [] for column in columns}
+    data[_COUNT_COLUMN] = []
+    for key, count in counts.items():
+        for column, value in zip(columns, key):
+            dictionary = dictionaries[column]
+            data[column].append(dictionary.setdefault(value, len(dictionary)))
+        data[_COUNT_COLUMN].append(count)
+
+    document = {
+        "columns": [*columns, _COUNT_COLUMN],
+        "dictionaries": {column: list(dictionaries[column]) for column in columns},
+        "data": data,
+    }
+    return gzip.compress(json.dumps(document, separators=(",", ":")).encode("utf-8"))
+
+
+def decode_rollup(payload):
+    """Decode a compressed columnar document into a counts dictionary keyed by tuples"""
+    document = json.loads(gzip.decompress(payload).decode("utf-8"))
+    key_columns = [c for c in document["columns"] if c != _COUNT_COLUMN]
+    decoded_columns = [
+        [document["dictionaries"][column][i] for i in document["data"][column]]
+        for column in key_columns
+    ]
+    return dict(zip(zip(*decoded_columns), document["data"][_COUNT_COLUMN]))
+
+
+def get_rollup_key(dataset, bot_id, bot_locale_id, start_time, period=HOUR_IN_SECS):
+    """Get the partitioned key of the hourly or daily (period of DAY_IN_SECS) rollup"""
+    # pylint: disable=too-many-arguments
+    start = datetime.fromtimestamp(start_time, tz=timezone.utc)
+    if period == DAY_IN_SECS:
+        partition = f"day={start.strftime('%Y-%m-%d')}"
+    else:
+        partition = f"hour={start.strftime('%Y-%m-%dT%H')}"
+    return f"{dataset}/bot_id={bot_id}/locale_id={bot_locale_id}/{partition}/{_ROLLUP_FILE_NAME}"
+
+
+class RollupStore:
+    """Rollup store backend interface"""
+
+    def get(self, key):
+        """Get the rollup payload or None if it does not exist"""
+        raise NotImplementedError
+
+    def put(self, key, payload):
+        """Put a rollup payload"""
+        raise NotImplementedError
+
+    def exists(self, key):
+        """Returns True if the rollup exists"""
+        return self.get(key) is not None
+
+    def has_counts(self, dataset, bot_id, bot_locale_id, start_time, period=HOUR_IN_SECS):
+        """Returns True if the hour or day has been materialized"""
+        # pylint: disable=too-many-arguments
+        return self.exists(get_rollup_key(dataset, bot_id, bot_locale_id, start_time, period))
+
+    def read_counts(self, dataset, bot_id, bot_locale_id, start_time, period=HOUR_IN_SECS):
+        """Read the counts of an hour or day or None if it has not been materialized"""
+        # pylint: disable=too-many-arguments
+        payload = self.get(get_rollup_key(dataset, bot_id, bot_locale_id, start_time, period))
+        return decode_rollup(payload) if payload is not None else None
+
+    def write_counts(
+        self, dataset, bot_id, bot_locale_id, start_time, columns, counts, period=HOUR_IN_SECS
+    ):
+        """Write the counts of an hour or day"""
+        # pylint: disable=too-many-arguments
+        self.put(
+            get_rollup_key(dataset, bot_id, bot_locale_id, start_time, period),
+            encode_rollup(columns, counts),
+        )
+
+
+class FileSystemRollupStore(RollupStore):
+    """Rollup store backed by a local directory"""
+
+    def __init__(self, root_dir):
+        self._root_dir = root_dir
+
+    def get(self, key):
+        try:
+            with open(os.path.join(self._root_dir, key), "rb") as rollup_file:
+                return rollup_file.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, payload):
+        path = os.path.join(self._root_dir, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as rollup_file:
+            rollup_file.write(payload)
+        os.replace(tmp_path, path)
+
+    def exists(self, key):
+        return os.path.exists(os.path.join(self._root_dir, key))
+
+
+class S3RollupStore(RollupStore):
+    """Rollup store backed by an S3 bucket"""
+
+    def __init__(self, bucket, prefix, s3_client):
+        self._bucket = bucket
+        self._prefix = prefix.strip("/")
+        self._s3_client = s3_client
+
+    def _get_object_key(self, key):
+        return f"{self._prefix}/{key}" if self._prefix else key
+
+    def get(self, key):
+        try:
+            response = self._s3_client.get_object(
+                Bucket=self._bucket, Key=self._get_object_key(key)
+            )
+        except self._s3_client.exceptions.NoSuchKey:
+            return None
+        return response["Body"].read()
+
+    def put(self, key, payload):
+        self._s3_client.put_object(
+            Bucket=self._bucket,
+            Key=self._get_object_key(key),
+            Body=payload,
+            ContentType="application/gzip",
+        )
+
+    def exists(self, key):
+        try:
+            self._s3_client.head_object(Bucket=self._bucket, Key=self._get_object_key(key))
+        except ClientError as exception:
+            if exception.response.get("Error", {}).get("Code") in ["404", "NoSuchKey"]:
+                return False
+            raise
+        return True
+
+
+def get_rollup_store_from_env(get_client):
+    """Get a rollup store configured from environment variables
+
+    Uses S3 if ROLLUP_S3_BUCKET is set or the local file system if ROLLUP_DIR
+    is set. Returns None if no rollup store is configured.
+    """
+    bucket = getenv("ROLLUP_S3_BUCKET")
+    if bucket:
+        return S3RollupStore(
+            bucket=bucket,
+            prefix=getenv("ROLLUP_S3_PREFIX", "rollups"),
+            s3_client=get_client("s3"),
+        )
+    root_dir = getenv("ROLLUP_DIR")
+    if root_dir:
+        return FileSystemRollupStore(root_dir=root_dir)
+    return None
@@ -0,0 +1,226 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Missed Utterance Clustering
+
+Groups utterance variants such as "i am lost", "I'm lost" and "im lost." into
+clusters in two steps:
+
+- normalization: Unicode compatibility form, case folding, punctuation
+  removal and (for English) expansion of contractions with or without the
+  apostrophe. Utterances with the same normalized text are one group.
+- near-duplicates: the normalized groups are compared with MinHash signatures
+  of their character trigrams and locality sensitive hashing (LSH) bands.
+  Each LSH bucket keeps its first (most frequent) group as a leader and the
+  groups hashed to the bucket afterwards are joined to its cluster if the
+  Jaccard similarity of their trigrams with the leader is above a threshold.
+
+Utterances are counted exactly before grouping, so the grouping runs on the
+distinct utterances. Each distinct normalized text is hashed once and
+compared with at most one leader per band, which keeps the time near linear
+in the number of utterances. The hash vectors of the trigrams are shared
+between utterances, so a signature is the element wise minimum of cached
+vectors.
+"""
+
+from collections import Counter
+from operator import itemgetter
+import random
+import re
+import unicodedata
+import zlib
+
+DEFAULT_SIMILARITY_THRESHOLD = 0.6
+# 10 bands of 3 rows: groups with a trigram similarity of 0.6 share a bucket
+# with a probability of 0.91 and of 0.98 at 0.7. The signature time grows with
+# the number of hashes (bands * rows)
+DEFAULT_LSH_BANDS = 10
+DEFAULT_LSH_ROWS = 3
+_MERSENNE_PRIME = (1 << 61) - 1
+_HASH_SEED = 0
+_PUNCTUATION_PATTERN = re.compile(r"[^\w\s]+")
+# contractions after the apostrophes are removed
+ENGLISH_CONTRACTIONS = {
+    "im": "i am",
+    "ive": "i have",
+    "youre": "you are",
+    "theyre": "they are",
+    "whats": "what is",
+    "thats": "that is",
+    "wheres": "where is",
+    "hows": "how is",
+    "isnt": "is not",
+    "arent": "are not",
+    "wasnt": "was not",
+    "dont": "do not",
+    "doesnt": "does not",
+    "didnt": "did not",
+    "cant": "can not",
+    "cannot": "can not",
+    "couldnt": "could not",
+    "wont": "will not",
+    "wouldnt": "would not",
+    "shouldnt": "should not",
+    "havent": "have not",
+    "wanna": "want to",
+    "gonna": "going to",
+}
+
+
+def normalize_utterance(utterance, contractions=None):
+    """Normalize an utterance for grouping
+
+    Returns the case folded utterance without punctuation and with single
+    spaces. Words found in the contractions dictionary are replaced.
+    """
+    text = unicodedata.normalize("NFKC", utterance).casefold()
+    words = _PUNCTUATION_PATTERN.sub("", text).split()
+    if contractions:
+        words = [contractions.get(word, word) for word in words]
+    return " ".join(words)
+
+
+def get_shingles(text):
+    """Get the character trigrams of a normalized text padded with spaces"""
+    padded_text = f" {text} "
+    if len(padded_text) < 3:
+        return frozenset([padded_text])
+    return frozenset(map("".join, zip(padded_text, padded_text[1:], padded_text[2:])))
+
+
+class _DisjointSets:
+    """Union-find of group indexes"""
+
+    def __init__(self, size):
+        self._parents = list(range(size))
+
+    def find(self, index):
+        """Get the root of the set of an index"""
+        parents = self._parents
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    def union(self, index, other_index):
+        """Join the sets of two indexes. The root with the lowest index is kept"""
+        root = self.find(index)
+        other_root = self.find(other_index)
+        if root != other_root:
+            self._parents[max(root, other_root)] = min(root, other_root)
+
+
+class MinHashLSH:  # pylint: disable=too-few-public-methods
+    """MinHash signatures of character trigrams banded for locality sensitive hashing"""
+
+    def __init__(self, bands=DEFAULT_LSH_BANDS, rows=DEFAULT_LSH_ROWS, seed=_HASH_SEED):
+        self.bands = bands
+        self.rows = rows
+        generator = random.Random(seed)
+        # universal hash functions (a * x + b) mod p
+        self._coefficients = [
+            (generator.randrange(1, _MERSENNE_PRIME), generator.randrange(0, _MERSENNE_PRIME))
+            for _ in range(bands * rows)
+        ]
+        self._band_slices = [slice(band * rows, (band + 1) * rows) for band in range(bands)]
+        # shingle -> hash vector
+        self._shingle_hashes = {}
+
+    def _get_shingle_hashes(self, shingle):
+        hashes = self._shingle_hashes.get(shingle)
+        if hashes is None:
+            value = zlib.crc32(shingle.encode("utf-8"))
+            hashes = tuple((a * value + b) % _MERSENNE_PRIME for a, b in self._coefficients)
+            self._shingle_hashes[shingle] = hashes
+        return hashes
+
+    def get_band_keys(self, shingles):
+        """Get the (band index, band signature) keys of a set of shingles"""
+        signature = list(map(min, zip(*map(self._get_shingle_hashes, shingles))))
+        return [(band, tuple(signature[s])) for band, s in enumerate(self._band_slices)]
+
+
+def jaccard_similarity(shingles, other_shingles):
+    """Get the Jaccard similarity of two sets"""
+    intersection_size = len(shingles & other_shingles)
+    return intersection_size / (len(shingles) + len(other_shingles) - intersection_size)
+
+
+def group_normalized_utterances(utterances, contractions=None):
+    """Count utterances by normalized text
+
+    Returns a list of (normalized text, count, list of distinct utterances
+    and their count) tuples by descending count. Ties keep the order of first
+    appearance.
+    """
+    utterance_counts = Counter(u for u in utterances if u is not None)
+    # normalized text -> [count, distinct utterances by descending count]
+    groups = {}
+    for utterance, count in sorted(utterance_counts.items(), key=itemgetter(1), reverse=True):
+        group = groups.setdefault(normalize_utterance(utterance, contractions), [0, []])
+        group[0] += count
+        group[1].append((utterance, count))
+    return sorted(
+        ((text, count, variants) for text, (count, variants) in groups.items()),
+        key=itemgetter(1),
+        reverse=True,
+    )
+
+
+def join_near_duplicates(texts, similarity_threshold, lsh=None):
+    """Join the texts with a trigram similarity above a threshold
+
+    Each text is compared with the leader (first text) of each of its LSH
+    buckets. Returns the index of the first text of the cluster of each text.
+    """
+    lsh = lsh or MinHashLSH()
+    disjoint_sets = _DisjointSets(len(texts))
+    text_shingles = []
+    # (band, band signature) -> index of the leader text
+    leaders = {}
+    for index, text in enumerate(texts):
+        shingles = get_shingles(text)
+        text_shingles.append(shingles)
+        for band_key in lsh.get_band_keys(shingles):
+            leader = leaders.setdefault(band_key, index)
+            if (
+                leader != index
+                and jaccard_similarity(text_shingles[leader], shingles) >= similarity_threshold
+            ):
+                disjoint_sets.union(leader, index)
+    return [disjoint_sets.find(index) for index in range(len(texts))]
+
+
+def cluster_utterances(
+    utterances,
+    contractions=None,
+    similarity_threshold=DEFAULT_SIMILARITY_THRESHOLD,
+    lsh=None,
+):
+    """Cluster utterances by normalized text and near-duplicate trigrams
+
+    Returns a list of clusters by descending count. Each cluster is a
+    dictionary with the most frequent utterance as example, the number of
+    utterances (count) and the list of distinct utterances by descending count
+    (variants). Ties keep the order of first appearance. A similarity
+    threshold above 1 only groups utterances with the same normalized text.
+    """
+    groups = group_normalized_utterances(utterances, contractions)
+    # groups are in descending count order, so the most frequent group of an
+    # LSH bucket is its leader and the first group of a cluster its root
+    if similarity_threshold <= 1:
+        roots = join_near_duplicates(
+            [text for text, _, _ in groups], similarity_threshold=similarity_threshold, lsh=lsh
+        )
+    else:
+        roots = range(len(groups))
+
+    clusters = {}
+    for root, (_, count, variants) in zip(roots, groups):
+        cluster = clusters.setdefault(root, {"count": 0, "variants": []})
+        cluster["count"] += count
+        cluster["variants"].extend(variants)
+    for cluster in clusters.values():
+        variants = sorted(cluster.pop("variants"), key=itemgetter(1), reverse=True)
+        cluster["example"] = variants[0][0]
+        cluster["variants"] = [utterance for utterance, _ in variants]
+    return sorted(clusters.values(), key=itemgetter("count"), reverse=True)
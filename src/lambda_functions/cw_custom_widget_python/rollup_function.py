@@ -0,0 +1,212 @@
+#!/usr/bin/env python3.9
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""
+Lex Analytics Hourly Rollup Materializer Lambda Handler
+
+Scheduled function that pre-aggregates hourly slot and session attribute value
+counts of closed hours so that the top N custom widgets can serve long time
+ranges without scanning the raw conversation logs. Once the 24 hours of a UTC
+day are materialized, their counts are merged into a daily rollup.
+
+The bots and locales are listed in ROLLUP_BOTS. Older hours can be backfilled
+by invoking the function with a lookbackHours event field. Runs stop before the
+Lambda deadline and the remaining hours are materialized by later runs.
+"""
+
+from collections import Counter
+from os import getenv
+from time import monotonic, time
+
+# pylint: disable=import-error
+from lib.client import get_client
+from lib.logger import get_logger
+from lib.cw_logs import QueryTimeoutError, get_query_results_as_df
+from lib.query_cache import DEFAULT_LIVE_WINDOW_IN_SECS
+from lib.rollup_store import DAY_IN_SECS, HOUR_IN_SECS, get_rollup_store_from_env
+from widgets.incremental import COUNT_WIDGETS, aggregate_messages_df
+from widgets.rollups import ROLLUP_DATASETS, get_rollup_query
+
+# pylint: enable=import-error
+
+LOGGER = get_logger(__name__)
+CLIENT = get_client("logs")
+ROLLUP_STORE = get_rollup_store_from_env(get_client=get_client)
+
+LOG_GROUP_NAME = getenv("LOG_GROUP_NAME", "")
+# number of closed hours checked on each run to fill gaps from failed runs
+LOOKBACK_HOURS = int(getenv("ROLLUP_LOOKBACK_HOURS", "3"))
+QUERY_SHARD_COUNT = int(getenv("ROLLUP_QUERY_SHARD_COUNT", "4"))
+_DEADLINE_MARGIN_IN_SECS = 10
+
+
+def get_bots_from_env():
+    """Get the (bot id, locale id) pairs to materialize from the environment
+
+    ROLLUP_BOTS is a comma separated list of bot_id:locale_id pairs. It
+    defaults to the comma separated BOT_LOCALE_IDS locales of BOT_ID.
+    """
+    bots = getenv("ROLLUP_BOTS", "")
+    if bots:
+        return [tuple(bot.strip().split(":", 1)) for bot in bots.split(",") if bot.strip()]
+    bot_id = getenv("BOT_ID", "")
+    return [
+        (bot_id, locale_id.strip())
+        for locale_id in getenv("BOT_LOCALE_IDS", "").split(",")
+        if locale_id.strip()
+    ]
+
+
+BOTS = get_bots_from_env()
+# the last dataset is written last so it marks the hour or day as complete
+_LAST_DATASET, _ = list(ROLLUP_DATASETS.values())[-1]
+
+
+def get_closed_hours(now, lookback_hours):
+    """Get the start times of the most recent hours that are no longer live"""
+    last_closed_hour_end = now - DEFAULT_LIVE_WINDOW_IN_SECS
+    last_closed_hour_end = last_closed_hour_end - (last_closed_hour_end % HOUR_IN_SECS)
+    return [last_closed_hour_end - HOUR_IN_SECS * i for i in range(lookback_hours, 0, -1)]
+
+
+def get_closed_days(hours):
+    """Get the start times of the UTC days whose hours are all in a list of closed hours"""
+    last_hour_end = max(hours) + HOUR_IN_SECS if hours else 0
+    days = sorted({hour - (hour % DAY_IN_SECS) for hour in hours})
+    return [day for day in days if day + DAY_IN_SECS <= last_hour_end]
+
+
+def materialize_hour(rollup_store, logs_client, bot_id, bot_locale_id, hour, deadline):
+    """Query an hour of conversation logs and write the rollup of each dataset"""
+    # pylint: disable=too-many-arguments
+    input_df = get_query_results_as_df(
+        log_group_names=[LOG_GROUP_NAME],
+        query=get_rollup_query(bot_id=bot_id, bot_locale_id=bot_locale_id),
+        start_time=hour,
+        end_time=hour + HOUR_IN_SECS - 1,
+        logs_client=logs_client,
+        logger=LOGGER,
+        shard_count=QUERY_SHARD_COUNT,
+        deadline=deadline,
+    )
+    for widget_type, (dataset, columns) in ROLLUP_DATASETS.items():
+        aggregate, _ = COUNT_WIDGETS[widget_type]
+        counts = aggregate_messages_df(input_df, aggregate)
+        rollup_store.write_counts(
+            dataset=dataset,
+            bot_id=bot_id,
+            bot_locale_id=bot_locale_id,
+            start_time=hour,
+            columns=columns,
+            counts=counts,
+        )
+        LOGGER.info("wrote rollup - dataset: %s, hour: %s, rows: %s", dataset, hour, len(counts))
+
+
+def materialize_day(rollup_store, bot_id, bot_locale_id, day):
+    """Merge the hourly rollups of a day into a daily rollup of each dataset
+
+    Returns False without writing the dataset if any of its hours has not been
+    materialized.
+    """
+    for dataset, columns in ROLLUP_DATASETS.values():
+        counts = Counter()
+        for hour in range(day, day + DAY_IN_SECS, HOUR_IN_SECS):
+            hour_counts = rollup_store.read_counts(
+                dataset=dataset, bot_id=bot_id, bot_locale_id=bot_locale_id, start_time=hour
+            )
+            if hour_counts is None:
+                return False
+            counts.update(hour_counts)
+        rollup_store.write_counts(
+            dataset=dataset,
+            bot_id=bot_id,
+            bot_locale_id=bot_locale_id,
+            start_time=day,
+            columns=columns,
+            counts=counts,
+            period=DAY_IN_SECS,
+        )
+        LOGGER.info(
+            "wrote daily rollup - dataset: %s, day: %s, rows: %s", dataset, day, len(counts)
+        )
+    return True
+
+
+def materialize(rollup_store, logs_client, bots, hours, deadline=None):
+    """Materialize the hours that are missing from the store and their closed days
+
+    The most recent hours are materialized first. Returns a dictionary with
+    the materialized [bot id, locale id, start time] hours and days. When the
+    deadline is reached, the run stops and the number of hours of all the bots
+    that were not materialized is returned as pendingHours.
+    """
+    # pylint: disable=too-many-arguments
+    result = {"materializedHours": [], "materializedDays": [], "pendingHours": 0}
+    bot_missing_hours = [
+        [
+            hour
+            for hour in reversed(hours)
+            if not rollup_store.has_counts(
+                dataset=_LAST_DATASET, bot_id=bot_id, bot_locale_id=bot_locale_id, start_time=hour
+            )
+        ]
+        for bot_id, bot_locale_id in bots
+    ]
+    for bot_index, (bot_id, bot_locale_id) in enumerate(bots):
+        missing_hours = bot_missing_hours[bot_index]
+        for index, hour in enumerate(missing_hours):
+            try:
+                materialize_hour(
+                    rollup_store=rollup_store,
+                    logs_client=logs_client,
+                    bot_id=bot_id,
+                    bot_locale_id=bot_locale_id,
+                    hour=hour,
+                    deadline=deadline,
+                )
+            except QueryTimeoutError as exception:
+                LOGGER.warning("stopped materializing rollups: %s", exception)
+                # the hours left of this bot and the hours of the next bots
+                result["pendingHours"] = (
+                    sum(len(remaining_hours) for remaining_hours in bot_missing_hours[bot_index:])
+                    - index
+                )
+                return result
+            result["materializedHours"].append([bot_id, bot_locale_id, hour])
+
+        for day in get_closed_days(hours):
+            is_materialized = rollup_store.has_counts(
+                dataset=_LAST_DATASET,
+                bot_id=bot_id,
+                bot_locale_id=bot_locale_id,
+                start_time=day,
+                period=DAY_IN_SECS,
+            )
+            if not is_materialized and materialize_day(
+                rollup_store=rollup_store, bot_id=bot_id, bot_locale_id=bot_locale_id, day=day
+            ):
+                result["materializedDays"].append([bot_id, bot_locale_id, day])
+    return result
+
+
+def handler(event, context):
+    """Lambda Handler"""
+    LOGGER.debug(event)
+    if ROLLUP_STORE is None:
+        raise RuntimeError("rollup store is not configured")
+
+    deadline = None
+    if context is not None:
+        remaining_time = context.get_remaining_time_in_millis() / 1000
+        deadline = monotonic() + max(remaining_time - _DEADLINE_MARGIN_IN_SECS, 0)
+
+    # scheduled events do not have the field, manual invocations can backfill
+    lookback_hours = int((event or {}).get("lookbackHours", LOOKBACK_HOURS))
+    return materialize(
+        rollup_store=ROLLUP_STORE,
+        logs_client=CLIENT,
+        bots=BOTS,
+        hours=get_closed_hours(now=int(time()), lookback_hours=lookback_hours),
+        deadline=deadline,
+    )
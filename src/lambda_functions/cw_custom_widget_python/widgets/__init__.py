@@ -0,0 +1,77 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Custom Widget Registry
+
+Widgets are registered by module and attribute names instead of being
+imported, so that a widget module (and pandas) is only imported when a widget
+of its type is rendered. This keeps the Lambda cold start import time low.
+
+The top N widgets count values with one of two engines: pandas (default) or
+stdlib, which only uses the standard library and renders without importing
+pandas. The engine is selected with the engine widget parameter or the
+WIDGET_ENGINE environment variable.
+"""
+
+from importlib import import_module
+from os import getenv
+
+PANDAS_ENGINE = "pandas"
+STDLIB_ENGINE = "stdlib"
+ENGINES = [PANDAS_ENGINE, STDLIB_ENGINE]
+# widget type -> (module name, message paths name, render from decoded messages function name)
+_WIDGETS = {}
+
+
+def register_widget(widget_type, module_name, message_paths_name, render_name):
+    """Register a widget type rendered from decoded conversation log messages
+
+    The module is imported when the widget is first rendered. Relative module
+    names are resolved from the widgets package.
+    """
+    _WIDGETS[widget_type] = (module_name, message_paths_name, render_name)
+
+
+def is_registered_widget(widget_type):
+    """Returns True if the widget type is registered"""
+    return widget_type in _WIDGETS
+
+
+def get_engine(event):
+    """Get the aggregation engine from the widget parameters or the environment"""
+    engine = event.get("engine") or getenv("WIDGET_ENGINE") or PANDAS_ENGINE
+    if engine not in ENGINES:
+        raise ValueError(f"unknown engine: {engine} - valid engines: {ENGINES}")
+    return engine
+
+
+def get_widget_renderer(widget_type):
+    """Get the (message paths, render from decoded messages function) of a widget type"""
+    module_name, message_paths_name, render_name = _WIDGETS[widget_type]
+    module = import_module(module_name, package=__name__)
+    return getattr(module, message_paths_name), getattr(module, render_name)
+
+
+register_widget(
+    widget_type="slotsTopN",
+    module_name=".slots",
+    message_paths_name="SLOTS_MESSAGE_PATHS",
+    render_name="render_slots_top_n_from_messages",
+)
+register_widget(
+    widget_type="sessionAttributesTopN",
+    module_name=".session_attributes",
+    message_paths_name="SESSION_ATTRIBUTES_MESSAGE_PATHS",
+    render_name="render_session_attributes_top_n_from_messages",
+)
+register_widget(
+    widget_type="conversationPath",
+    module_name=".conversation_path",
+    message_paths_name="CONVERSATION_PATH_MESSAGE_PATHS",
+    render_name="render_conversation_path_from_messages",
+)
+register_widget(
+    widget_type="missedUtteranceClusters",
+    module_name=".missed_utterances",
+    message_paths_name="MISSED_UTTERANCES_MESSAGE_PATHS",
+    render_name="render_missed_utterance_clusters_from_messages",
+)
@@ -0,0 +1,60 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Approximate Top N Custom Widgets
+
+Renders the top N widgets from Space-Saving sketches (see lib.sketches)
+instead of exact value counts when the approximateTopN widget parameter is
+set. Memory is bounded by the sketch capacity (sketchCapacity) per intent and
+slot or per session attribute key, regardless of the number of distinct
+values in the time range. The count error bounds are shown in the widget.
+
+The raw message and log store paths add the values to the sketches one at a
+time as they are read, and the query aggregation path adds the counts of each
+Log Insights query, so that no exact counts of all the values are kept.
+"""
+
+# pylint: disable=import-error
+from lib.sketches import GroupedSketches
+
+# pylint: enable=import-error
+
+_DEFAULT_SKETCH_CAPACITY = 1000
+# widget types that can be rendered from sketches
+_SKETCH_WIDGET_TYPES = ["slotsTopN", "sessionAttributesTopN"]
+APPROXIMATE_NOTICE = (
+    "<p><b>Approximate counts:</b> each count overestimates the true count by at"
+    " most its error. Values not listed in a table occur at most the max unlisted"
+    " count of the table.</p>"
+)
+
+
+def is_approximate_widget(widget_type, event):
+    """Returns True if the widget is rendered from sketches"""
+    return bool(event.get("approximateTopN", False)) and widget_type in _SKETCH_WIDGET_TYPES
+
+
+def get_new_sketches(event):
+    """Get a function that creates empty grouped sketches with the widget capacity"""
+    capacity = int(event.get("sketchCapacity", _DEFAULT_SKETCH_CAPACITY))
+    return lambda: GroupedSketches(capacity=capacity)
+
+
+def get_sketches(event, keys):
+    """Get grouped sketches with the widget capacity from a stream of tuple keys
+
+    Each key is added to the sketches as one occurrence.
+    """
+    sketches = get_new_sketches(event)()
+    for key in keys:
+        sketches.add(key)
+    return sketches
+
+
+def get_sketch_topn_table(sketch, top_n):
+    """Get the top N values of a sketch as a table with value, count and error columns"""
+    top_values = sketch.top(top_n)
+    return {
+        "value": [value for value, _, _ in top_values],
+        "count": [count for _, count, _ in top_values],
+        "error": [error for _, _, error in top_values],
+    }
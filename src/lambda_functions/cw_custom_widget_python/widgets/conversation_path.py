@@ -0,0 +1,189 @@
+#!/usr/bin/env python3.9
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Lex Conversation Path CloudWatch Custom Widget
+
+Counts the transitions between the fulfilled intents of each session from the
+raw conversation log messages. The messages are sorted once by session and
+time and each intent is paired with the previous intent of its session, or
+with an artificial START intent for the first intent of a session. Repeated
+intents are not counted as transitions.
+
+This is the aggregation of the conversationPath widget of the Node.js custom
+widget function, without the Log Insights STATS BY session, intent and 5s
+bin rows that grow with the number of sessions. Only the edge list, filtered
+with the minTransitionCount widget parameter, is rendered as one table of
+target intents and counts per source intent.
+"""
+
+from collections import Counter
+from operator import itemgetter
+
+# pylint: disable=import-error
+from lib.messages import decode_messages
+from lib.metrics import record_phase
+
+# pylint: enable=import-error
+from . import STDLIB_ENGINE, get_engine
+from .html_renderer import (
+    DEFAULT_MAX_OUTPUT_BYTES,
+    escape,
+    get_max_output_bytes,
+    get_table_columns,
+    render_df_table,
+    render_sections,
+)
+from .slots import FULFILLED_INTENT_STATES
+
+START_INTENT_NAME = "START"
+_SESSION_ID_PATH = "sessionId"
+_TIMESTAMP_PATH = "timestamp"
+_INTENT_NAME_PATH = "sessionState.intent.name"
+_INTENT_STATE_PATH = "sessionState.intent.state"
+# message paths decoded by the widget
+CONVERSATION_PATH_MESSAGE_PATHS = [
+    _SESSION_ID_PATH,
+    _TIMESTAMP_PATH,
+    _INTENT_NAME_PATH,
+    _INTENT_STATE_PATH,
+]
+
+
+def get_fulfilled_intents(messages):
+    """Get the (session id, timestamp, intent name) tuples of the fulfilled intents
+
+    Messages without a session id, timestamp or intent name are skipped.
+    """
+    return [
+        (session_id, timestamp, name)
+        for session_id, timestamp, name, state in zip(
+            messages[_SESSION_ID_PATH],
+            messages[_TIMESTAMP_PATH],
+            messages[_INTENT_NAME_PATH],
+            messages[_INTENT_STATE_PATH],
+        )
+        if state in FULFILLED_INTENT_STATES
+        and session_id is not None
+        and timestamp is not None
+        and name is not None
+    ]
+
+
+def get_intent_transitions_df(fulfilled_intents, min_count=1):
+    """Count the intent transitions of each session with pandas
+
+    Returns a dataframe with the source, target and count columns of the
+    transitions counted at least min_count times, by descending count and
+    then in order of first appearance.
+    """
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
+    intents_df = pd.DataFrame(
+        fulfilled_intents, columns=["session_id", "timestamp", "intent"]
+    ).sort_values(["session_id", "timestamp"], kind="stable")
+    # the previous intent of the session or START for the first intent of a session
+    is_session_start = intents_df["session_id"].ne(intents_df["session_id"].shift())
+    source = intents_df["intent"].shift().mask(is_session_start, START_INTENT_NAME)
+    transitions_df = pd.DataFrame({"source": source, "target": intents_df["intent"]})
+    transitions_df = transitions_df[transitions_df["source"].ne(transitions_df["target"])]
+
+    transition_counts = transitions_df.groupby(["source", "target"], sort=False).size()
+    return (
+        transition_counts[transition_counts >= min_count]
+        .sort_values(ascending=False, kind="stable")
+        .rename("count")
+        .reset_index()
+    )
+
+
+def get_intent_transitions(fulfilled_intents, min_count=1):
+    """Count the intent transitions of each session with the standard library
+
+    Returns a dictionary with the source, target and count columns in the same
+    order as get_intent_transitions_df.
+    """
+    transition_counts = Counter()
+    previous_session_id = None
+    previous_intent = None
+    # sorted is stable, intents with the same timestamp keep their order
+    for session_id, _, intent in sorted(fulfilled_intents, key=itemgetter(0, 1)):
+        source = previous_intent if session_id == previous_session_id else START_INTENT_NAME
+        if source != intent:
+            transition_counts[(source, intent)] += 1
+        previous_session_id = session_id
+        previous_intent = intent
+
+    # counters keep the transitions in order of first appearance
+    transitions = sorted(
+        (item for item in transition_counts.items() if item[1] >= min_count),
+        key=itemgetter(1),
+        reverse=True,
+    )
+    return {
+        "source": [source for (source, _), _ in transitions],
+        "target": [target for (_, target), _ in transitions],
+        "count": [count for _, count in transitions],
+    }
+
+
+def render_conversation_path_widget(event, input_df):
+    """Render Conversation Path Custom Widget"""
+    # extract only the session, time and intent from the json message fields
+    messages = decode_messages(input_df["@message"], CONVERSATION_PATH_MESSAGE_PATHS)
+    return render_conversation_path_from_messages(event=event, messages=messages)
+
+
+def render_conversation_path_from_messages(event, messages):
+    """Render Conversation Path Custom Widget from decoded messages
+
+    Takes a dictionary of message path to values as returned by
+    decode_messages with at least the CONVERSATION_PATH_MESSAGE_PATHS.
+    """
+    min_count = int(event.get("minTransitionCount", 1))
+
+    with record_phase("Aggregation"):
+        fulfilled_intents = get_fulfilled_intents(messages)
+        if not fulfilled_intents:
+            return "<pre>No fulfilled intents found</pre>"
+
+        if get_engine(event) == STDLIB_ENGINE:
+            transitions = get_intent_transitions(fulfilled_intents, min_count)
+        else:
+            transitions = get_intent_transitions_df(fulfilled_intents, min_count)
+
+    if len(transitions["count"]) == 0:
+        return "<pre>No intent transitions found</pre>"
+
+    return render_conversation_path_html(
+        transitions=transitions,
+        min_count=min_count,
+        max_output_bytes=get_max_output_bytes(event),
+    )
+
+
+def render_conversation_path_html(transitions, min_count, max_output_bytes=None):
+    """Render the Conversation Path Custom Widget HTML from the intent transitions
+
+    The transitions are rendered in one section per source intent, in order
+    of the most counted transition of the source.
+    """
+    columns = get_table_columns(transitions)
+    source_targets = {}
+    for source, target, count in zip(columns["source"], columns["target"], columns["count"]):
+        targets = source_targets.setdefault(source, {"target": [], "count": []})
+        targets["target"].append(target)
+        targets["count"].append(count)
+
+    header = "<h2>Intent Transitions</h2>"
+    if min_count > 1:
+        header += f"<p>Transitions counted at least {escape(min_count)} times</p>"
+    sections = (
+        f"<br><h3>From Intent: {escape(source)}</h3><br>" + render_df_table(targets)
+        for source, targets in source_targets.items()
+    )
+    with record_phase("Render"):
+        return render_sections(
+            header=header,
+            sections=sections,
+            max_output_bytes=max_output_bytes or DEFAULT_MAX_OUTPUT_BYTES,
+        )
@@ -0,0 +1,113 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Custom Widget HTML Rendering
+
+Renders the widget tables with string templates into a single joined buffer
+instead of calling DataFrame.to_html for each table. The table markup is the
+same as the one generated by DataFrame.to_html(index=False).
+
+The widget output is limited to a byte budget. Sections that do not fit are
+dropped, starting from the last (lowest ranked) one, and a notice is added.
+"""
+
+# max size of the widget HTML. Leaves room for the response envelope under the
+# custom widget payload limit
+DEFAULT_MAX_OUTPUT_BYTES = 1000000
+
+_ESCAPE_TABLE = str.maketrans(
+    {
+        "&": "&amp;",
+        "<": "&lt;",
+        ">": "&gt;",
+        # control characters are shown escaped as in DataFrame.to_html
+        "\t": "\\t",
+        "\r": "\\r",
+        "\n": "\\n",
+    }
+)
+_TABLE_START = (
+    '<table border="1" class="dataframe">\n  <thead>\n    <tr style="text-align: right;">\n'
+)
+_TABLE_BODY_START = "    </tr>\n  </thead>\n  <tbody>\n"
+_TABLE_END = "  </tbody>\n</table>"
+_TRUNCATED_NOTICE = (
+    "<p><b>Truncated:</b> {count} of {total} sections are not shown to keep the"
+    " widget output under {max_bytes} bytes.</p>"
+)
+
+
+def escape(value):
+    """Escape a value as a table cell or header text"""
+    return str(value).translate(_ESCAPE_TABLE).strip()
+
+
+def render_table(columns, rows):
+    """Render a table from column names and rows of values"""
+    buffer = [_TABLE_START]
+    buffer.extend(f"      <th>{escape(column)}</th>\n" for column in columns)
+    buffer.append(_TABLE_BODY_START)
+    for row in rows:
+        buffer.append("    <tr>\n")
+        buffer.extend(f"      <td>{escape(value)}</td>\n" for value in row)
+        buffer.append("    </tr>\n")
+    buffer.append(_TABLE_END)
+    return "".join(buffer)
+
+
+def get_table_columns(table):
+    """Get the dictionary of column name to list of values of a table
+
+    Tables are dataframes or, with the stdlib engine, dictionaries of column
+    name to list of values.
+    """
+    if isinstance(table, dict):
+        return table
+    return {column: series.tolist() for column, series in table.items()}
+
+
+def is_empty_table(table):
+    """Returns True if a dataframe or dictionary of columns table has no rows"""
+    return not any(get_table_columns(table).values())
+
+
+def render_df_table(table):
+    """Render a dataframe or dictionary of columns table without its index"""
+    columns = get_table_columns(table)
+    return render_table(columns, zip(*columns.values()))
+
+
+def get_max_output_bytes(event):
+    """Get the widget output byte budget from the widget parameters"""
+    return int(event.get("maxOutputBytes", DEFAULT_MAX_OUTPUT_BYTES))
+
+
+def render_sections(header, sections, max_output_bytes=DEFAULT_MAX_OUTPUT_BYTES):
+    """Join the widget header and sections within the output byte budget
+
+    Sections are added in order until the next one does not fit in the budget.
+    The remaining sections are replaced by a truncated notice.
+    """
+    buffer = [header]
+    size = len(header.encode("utf-8"))
+    sections = list(sections)
+    # room for the notice if sections have to be dropped
+    notice_size = len(
+        _TRUNCATED_NOTICE.format(
+            count=len(sections), total=len(sections), max_bytes=max_output_bytes
+        ).encode("utf-8")
+    )
+    for index, section in enumerate(sections):
+        section_size = len(section.encode("utf-8"))
+        is_last = index == len(sections) - 1
+        if size + section_size + (0 if is_last else notice_size) > max_output_bytes:
+            buffer.append(
+                _TRUNCATED_NOTICE.format(
+                    count=len(sections) - index,
+                    total=len(sections),
+                    max_bytes=max_output_bytes,
+                )
+            )
+            break
+        buffer.append(section)
+        size += section_size
+    return "".join(buffer)
@@ -0,0 +1,251 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Incremental Sliding Window Refresh of the Top N Custom Widgets
+
+Keeps partial aggregates (value counts) of the top N widgets per time bucket
+in the warm Lambda container. On refresh, only the buckets that have not been
+aggregated yet are queried, buckets that left the time range are dropped and
+the counts of the remaining buckets are merged to render the widget. This
+makes the scan cost of a refresh proportional to the new data instead of the
+size of the time range.
+
+Buckets that end within the live window are queried on every refresh since
+Log Insights may still be ingesting their events. The edges of the time range
+that do not cover a full bucket are also queried on every refresh, so that the
+counts are the ones of the exact time range.
+"""
+
+from collections import Counter, OrderedDict
+from time import time
+
+import pandas as pd
+
+# pylint: disable=import-error
+from lib.cw_logs import QueryTimeoutError, get_rows_as_df
+from lib.query_cache import DEFAULT_LIVE_WINDOW_IN_SECS
+
+# pylint: enable=import-error
+from .approximate import get_new_sketches, is_approximate_widget
+from .slots import (
+    aggregate_slot_value_counts,
+    render_slots_top_n_from_counts,
+    render_slots_top_n_from_sketches,
+)
+from .session_attributes import (
+    aggregate_session_attribute_value_counts,
+    render_session_attributes_top_n_from_counts,
+    render_session_attributes_top_n_from_sketches,
+)
+
+_DEFAULT_BUCKET_SIZE_IN_SECS = 300
+_MAX_AGGREGATORS = 16
+
+_AGGREGATORS = OrderedDict()
+
+
+# widget type -> (message aggregation function, render from counts function)
+COUNT_WIDGETS = {
+    "slotsTopN": (aggregate_slot_value_counts, render_slots_top_n_from_counts),
+    "sessionAttributesTopN": (
+        aggregate_session_attribute_value_counts,
+        render_session_attributes_top_n_from_counts,
+    ),
+}
+# widget type -> render from sketches function
+SKETCH_WIDGETS = {
+    "slotsTopN": render_slots_top_n_from_sketches,
+    "sessionAttributesTopN": render_session_attributes_top_n_from_sketches,
+}
+
+
+def aggregate_messages_df(input_df, aggregate):
+    """Aggregate the @message field of query results"""
+    if input_df.empty or "@message" not in input_df.columns:
+        return Counter()
+    return aggregate(input_df["@message"])
+
+
+def is_incremental_widget(widget_type):
+    """Returns True if the widget type supports incremental refresh"""
+    return widget_type in COUNT_WIDGETS
+
+
+class SlidingWindowAggregator:
+    """Per time bucket partial aggregates of a widget"""
+
+    def __init__(
+        self,
+        bucket_size,
+        aggregate,
+        live_window_in_secs=DEFAULT_LIVE_WINDOW_IN_SECS,
+        new_counts=Counter,
+    ):
+        self._bucket_size = bucket_size
+        self._aggregate = aggregate
+        self._live_window_in_secs = live_window_in_secs
+        # creates the accumulator of merged counts (Counter or sketches)
+        self._new_counts = new_counts
+        # bucket start time -> counts of closed buckets
+        self._buckets = {}
+
+    def get_missing_ranges(self, bucket_starts):
+        """Get the contiguous time ranges of buckets without aggregates"""
+        ranges = []
+        for bucket_start in bucket_starts:
+            if bucket_start in self._buckets:
+                continue
+            bucket_end = bucket_start + self._bucket_size - 1
+            if ranges and ranges[-1][1] + 1 == bucket_start:
+                ranges[-1] = (ranges[-1][0], bucket_end)
+            else:
+                ranges.append((bucket_start, bucket_end))
+        return ranges
+
+    def get_query_ranges(self, start_time, end_time, bucket_starts):
+        """Get the contiguous time ranges to query for a time range
+
+        These are the buckets without aggregates and the edges of the time
+        range that do not cover a full bucket.
+        """
+        if not bucket_starts:
+            return [(start_time, end_time)]
+        ranges = self.get_missing_ranges(bucket_starts)
+        if start_time < bucket_starts[0]:
+            if ranges and ranges[0][0] == bucket_starts[0]:
+                ranges[0] = (start_time, ranges[0][1])
+            else:
+                ranges.insert(0, (start_time, bucket_starts[0] - 1))
+        last_bucket_end = bucket_starts[-1] + self._bucket_size
+        if last_bucket_end <= end_time:
+            if ranges and ranges[-1][1] + 1 == last_bucket_end:
+                ranges[-1] = (ranges[-1][0], end_time)
+            else:
+                ranges.append((last_bucket_end, end_time))
+        return ranges
+
+    def refresh(self, start_time, end_time, get_input_df, allow_partial_results=True, now=None):
+        """Query the missing buckets of the time range and return the merged counts
+
+        get_input_df is a function that takes a start and end time and returns
+        the query results as a dataframe. Returns a tuple with the merged counts
+        and a flag indicating if the counts are based on partial results.
+        """
+        # pylint: disable=too-many-arguments,too-many-locals
+        now = time() if now is None else now
+        # full buckets of the time range
+        bucket_starts = range(
+            start_time + (-start_time % self._bucket_size),
+            (end_time + 1) - ((end_time + 1) % self._bucket_size),
+            self._bucket_size,
+        )
+        live_time = now - self._live_window_in_secs
+
+        # drop buckets that left the time range
+        for bucket_start in [b for b in self._buckets if b not in bucket_starts]:
+            del self._buckets[bucket_start]
+
+        # bucket start time -> counts, including the partial buckets of the edges
+        bucket_counts = {b: self._buckets[b] for b in bucket_starts if b in self._buckets}
+        is_partial = False
+        for range_start, range_end in self.get_query_ranges(start_time, end_time, bucket_starts):
+            try:
+                input_df = get_input_df(range_start, range_end)
+            except QueryTimeoutError as exception:
+                if not allow_partial_results:
+                    raise
+                # partial buckets are not kept
+                bucket_counts.update(self._aggregate_df_by_bucket(get_rows_as_df(exception.rows)))
+                is_partial = True
+                continue
+
+            range_counts = self._aggregate_df_by_bucket(input_df)
+            bucket_counts.update(range_counts)
+            for bucket_start in range(
+                range_start + (-range_start % self._bucket_size), range_end, self._bucket_size
+            ):
+                if bucket_start in bucket_starts and bucket_start + self._bucket_size <= live_time:
+                    self._buckets[bucket_start] = range_counts.get(bucket_start, Counter())
+
+        # merged in time order to keep the values in order of first appearance
+        merged_counts = self._new_counts()
+        for bucket_start in sorted(bucket_counts):
+            merged_counts.update(bucket_counts[bucket_start])
+        return merged_counts, is_partial
+
+    def _aggregate_df_by_bucket(self, input_df):
+        if input_df.empty or "@message" not in input_df.columns:
+            return {}
+        # repeated timestamps may be categorical, which can not be cast to int64
+        timestamps = pd.to_datetime(input_df["@timestamp"].astype(object), utc=True)
+        timestamps = timestamps.astype("int64") // 10**9
+        bucket_series = timestamps - timestamps % self._bucket_size
+        return {
+            bucket_start: self._aggregate(bucket_df["@message"])
+            for bucket_start, bucket_df in input_df.groupby(bucket_series)
+        }
+
+
+def get_sketch_aggregate(aggregate, new_sketches):
+    """Wrap an aggregation function to return sketches instead of exact counts"""
+
+    def aggregate_sketches(messages):
+        sketches = new_sketches()
+        sketches.update(aggregate(messages))
+        return sketches
+
+    return aggregate_sketches
+
+
+def get_aggregator(key, bucket_size, aggregate, new_counts=Counter):
+    """Get the aggregator of a widget kept in the warm container"""
+    aggregator = _AGGREGATORS.get(key)
+    if aggregator is None:
+        aggregator = SlidingWindowAggregator(
+            bucket_size=bucket_size, aggregate=aggregate, new_counts=new_counts
+        )
+        _AGGREGATORS[key] = aggregator
+        while len(_AGGREGATORS) > _MAX_AGGREGATORS:
+            _AGGREGATORS.popitem(last=False)
+    _AGGREGATORS.move_to_end(key)
+    return aggregator
+
+
+def render_incremental_widget(
+    widget_type,
+    event,
+    get_input_df,
+    start_time,
+    end_time,
+    bucket_size=None,
+    allow_partial_results=True,
+):
+    """Render a top N widget refreshing only the time buckets not seen before
+
+    Returns a tuple with the widget HTML and a flag indicating if it was
+    rendered from partial results.
+    """
+    # pylint: disable=too-many-arguments
+    aggregate, render = COUNT_WIDGETS[widget_type]
+    bucket_size = bucket_size or _DEFAULT_BUCKET_SIZE_IN_SECS
+    key = (widget_type, event["query"], event["logGroups"], bucket_size)
+    new_counts = Counter
+    if is_approximate_widget(widget_type, event):
+        # keep bounded size sketches per bucket instead of exact counts
+        new_counts = get_new_sketches(event)
+        aggregate = get_sketch_aggregate(aggregate, new_counts)
+        render = SKETCH_WIDGETS[widget_type]
+        key = (*key, "approximate", new_counts().capacity)
+    aggregator = get_aggregator(
+        key=key, bucket_size=bucket_size, aggregate=aggregate, new_counts=new_counts
+    )
+
+    counts, is_partial = aggregator.refresh(
+        start_time=start_time,
+        end_time=end_time,
+        get_input_df=get_input_df,
+        allow_partial_results=allow_partial_results,
+    )
+    if not counts:
+        return "<pre>No data found</pre>", is_partial
+
+    return render(event=event, counts=counts), is_partial
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3.9
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Lex Missed Utterance Clusters CloudWatch Custom Widget
+
+Groups the transcripts of the missed utterances into clusters of normalized
+and near-duplicate variants (see lib.utterance_clusters) and renders the top
+N clusters with their count, most frequent transcript and variants. Unlike
+the missedUtterance widget of the Node.js custom widget function, which lists
+every distinct transcript, the output is bounded by the topN widget
+parameter. The similarityThreshold widget parameter sets the trigram
+similarity of near-duplicates (above 1 to only group normalized variants).
+
+Contractions are expanded for English locales (botLocaleId en_*). The
+clustering only uses the standard library, the engine parameter is ignored.
+"""
+
+# pylint: disable=import-error
+from lib.messages import decode_messages
+from lib.metrics import record_phase
+from lib.utterance_clusters import (
+    DEFAULT_SIMILARITY_THRESHOLD,
+    ENGLISH_CONTRACTIONS,
+    cluster_utterances,
+)
+
+# pylint: enable=import-error
+from .html_renderer import (
+    DEFAULT_MAX_OUTPUT_BYTES,
+    escape,
+    get_max_output_bytes,
+    render_df_table,
+    render_sections,
+)
+
+_INPUT_TRANSCRIPT_PATH = "inputTranscript"
+_MISSED_UTTERANCE_PATH = "missedUtterance"
+# message paths decoded by the widget
+MISSED_UTTERANCES_MESSAGE_PATHS = [_INPUT_TRANSCRIPT_PATH, _MISSED_UTTERANCE_PATH]
+_DEFAULT_TOP_N = 25
+_MAX_VARIANTS = 5
+
+
+def get_missed_utterances(messages):
+    """Get the transcripts of the missed utterances"""
+    return [
+        transcript
+        for transcript, is_missed in zip(
+            messages[_INPUT_TRANSCRIPT_PATH], messages[_MISSED_UTTERANCE_PATH]
+        )
+        if is_missed and transcript is not None
+    ]
+
+
+def render_missed_utterance_clusters_widget(event, input_df):
+    """Render Missed Utterance Clusters Custom Widget"""
+    # extract only the transcripts from the json message fields
+    messages = decode_messages(input_df["@message"], MISSED_UTTERANCES_MESSAGE_PATHS)
+    return render_missed_utterance_clusters_from_messages(event=event, messages=messages)
+
+
+def render_missed_utterance_clusters_from_messages(event, messages):
+    """Render Missed Utterance Clusters Custom Widget from decoded messages
+
+    Takes a dictionary of message path to values as returned by
+    decode_messages with at least the MISSED_UTTERANCES_MESSAGE_PATHS.
+    """
+    top_n = event.get("topN", _DEFAULT_TOP_N)
+    similarity_threshold = float(event.get("similarityThreshold", DEFAULT_SIMILARITY_THRESHOLD))
+    bot_locale_id = event.get("botLocaleId") or "en_US"
+
+    missed_utterances = get_missed_utterances(messages)
+    if not missed_utterances:
+        return "<pre>No missed utterances found</pre>"
+
+    with record_phase("Aggregation"):
+        clusters = cluster_utterances(
+            missed_utterances,
+            contractions=ENGLISH_CONTRACTIONS if bot_locale_id.startswith("en") else None,
+            similarity_threshold=similarity_threshold,
+        )
+
+    return render_missed_utterance_clusters_html(
+        top_n=top_n,
+        clusters=clusters,
+        utterance_count=len(missed_utterances),
+        max_output_bytes=get_max_output_bytes(event),
+    )
+
+
+def render_missed_utterance_clusters_html(top_n, clusters, utterance_count, max_output_bytes=None):
+    """Render the Missed Utterance Clusters Custom Widget HTML"""
+    top_clusters = clusters[:top_n]
+    table = {
+        "example": [cluster["example"] for cluster in top_clusters],
+        "count": [cluster["count"] for cluster in top_clusters],
+        "share": [f"{cluster['count'] / utterance_count:.1%}" for cluster in top_clusters],
+        "variants": [len(cluster["variants"]) for cluster in top_clusters],
+        "other variants": [
+            " | ".join(cluster["variants"][1:_MAX_VARIANTS]) for cluster in top_clusters
+        ],
+    }
+    header = (
+        f"<h2>Top {escape(top_n)} Missed Utterance Clusters</h2>"
+        f"<p>{utterance_count} missed utterances in {len(clusters)} clusters</p>"
+    )
+    with record_phase("Render"):
+        return render_sections(
+            header=header,
+            sections=[render_df_table(table)],
+            max_output_bytes=max_output_bytes or DEFAULT_MAX_OUTPUT_BYTES,
+        )
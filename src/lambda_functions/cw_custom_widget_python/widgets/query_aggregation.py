@@ -0,0 +1,170 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Top N Custom Widgets Aggregated by Log Insights
+
+Generates Log Insights queries that count the slot and session attribute
+values with stats so that only the pre-counted rows are returned instead of
+every raw @message of the time range.
+
+Log Insights can not iterate over the keys of a JSON object, so the slot names
+(slotNames) or session attribute keys (sessionAttributeKeys) have to be listed
+in the widget parameters. One query is run for each name. Widgets without
+those parameters, names that can not be used as Log Insights fields and
+results truncated at the row limit fall back to aggregating the raw messages.
+"""
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import json
+
+# pylint: disable=import-error
+from lib.cw_logs import QueryTimeoutError, get_rows_as_df
+
+# pylint: enable=import-error
+from .approximate import get_new_sketches, is_approximate_widget
+from .incremental import COUNT_WIDGETS, SKETCH_WIDGETS
+from .slots import FULFILLED_INTENT_STATES
+
+# max number of rows returned by a Log Insights query
+_AGGREGATION_ROW_LIMIT = 10000
+_MAX_CONCURRENT_QUERIES = 4
+
+
+def _get_field(path):
+    return f"`{path}`"
+
+
+def _get_string_list(values):
+    return f"[{', '.join(json.dumps(v) for v in values)}]"
+
+
+def _is_field_name(name):
+    # dots are used by Log Insights to flatten nested JSON fields
+    return bool(name) and "`" not in name and "." not in name
+
+
+def get_slot_count_query(query, slot_name, intents_to_exclude=None):
+    """Get a query counting the values of a slot in fulfilled intents by intent name"""
+    slot_field = _get_field(f"sessionState.intent.slots.{slot_name}.value.originalValue")
+    filters = [f"sessionState.intent.state in {_get_string_list(FULFILLED_INTENT_STATES)}"]
+    if intents_to_exclude:
+        filters.append(f"sessionState.intent.name not in {_get_string_list(intents_to_exclude)}")
+    return (
+        f"{query}"
+        f" | filter {' and '.join(filters)} and ispresent({slot_field})"
+        f" | fields sessionState.intent.name as intent, {slot_field} as value"
+        " | stats count(*) as count by intent, value"
+        f" | sort count desc | limit {_AGGREGATION_ROW_LIMIT}"
+    )
+
+
+def get_session_attribute_count_query(query, key):
+    """Get a query counting the values of a session attribute"""
+    key_field = _get_field(f"sessionState.sessionAttributes.{key}")
+    return (
+        f"{query}"
+        f" | filter ispresent({key_field})"
+        f" | fields {key_field} as value"
+        " | stats count(*) as count by value"
+        f" | sort count desc | limit {_AGGREGATION_ROW_LIMIT}"
+    )
+
+
+def get_aggregation_queries(widget_type, event):
+    """Get the count queries of a widget
+
+    Returns a list of (count key prefix, query) tuples or None if the widget
+    can not be aggregated by Log Insights.
+    """
+    query = event["query"]
+    if widget_type == "slotsTopN":
+        slots_to_exclude = event.get("slotsToExclude", [])
+        intents_to_exclude = event.get("intentToExclude", [])
+        names = [s for s in event.get("slotNames", []) if s not in slots_to_exclude]
+        if not names or not all(_is_field_name(s) for s in names):
+            return None
+        return [
+            (
+                (slot_name,),
+                get_slot_count_query(
+                    query=query, slot_name=slot_name, intents_to_exclude=intents_to_exclude
+                ),
+            )
+            for slot_name in names
+        ]
+    if widget_type == "sessionAttributesTopN":
+        session_attributes_to_exclude = event.get("sessionAttributesToExclude", [])
+        names = [
+            k
+            for k in event.get("sessionAttributeKeys", [])
+            if k not in session_attributes_to_exclude
+        ]
+        if not names or not all(_is_field_name(k) for k in names):
+            return None
+        return [((key,), get_session_attribute_count_query(query=query, key=key)) for key in names]
+    return None
+
+
+def is_query_aggregation_widget(widget_type, event):
+    """Returns True if the widget values can be counted by Log Insights"""
+    return get_aggregation_queries(widget_type, event) is not None
+
+
+def get_counts_from_df(count_df, key_prefix):
+    """Convert the rows of a count query to counts keyed by tuples
+
+    Slot counts are keyed by (intent name, slot name, value) and session
+    attribute counts by (attribute key, value) as in the widgets aggregations.
+    """
+    counts = Counter()
+    if count_df.empty or "count" not in count_df.columns:
+        return counts
+    has_intent = "intent" in count_df.columns
+    intents = count_df["intent"] if has_intent else [None] * len(count_df)
+    for intent, value, count in zip(intents, count_df["value"], count_df["count"]):
+        if value is None:
+            continue
+        key = (intent, *key_prefix, value) if has_intent else (*key_prefix, value)
+        counts[key] += int(count)
+    return counts
+
+
+def render_query_aggregation_widget(widget_type, event, get_count_df, allow_partial_results=True):
+    """Render a top N widget from the counts returned by Log Insights
+
+    get_count_df is a function that takes a query and returns its results as a
+    dataframe. Returns a tuple with the widget HTML and a flag indicating if it
+    was rendered from partial results, or None if the counts were truncated at
+    the query row limit and the widget has to be rendered from raw messages.
+    """
+    _, render = COUNT_WIDGETS[widget_type]
+    aggregation_queries = get_aggregation_queries(widget_type, event)
+
+    def get_counts(aggregation_query):
+        key_prefix, query = aggregation_query
+        try:
+            count_df = get_count_df(query)
+        except QueryTimeoutError as exception:
+            if not allow_partial_results:
+                raise
+            return get_counts_from_df(get_rows_as_df(exception.rows), key_prefix), True, False
+        is_truncated = len(count_df) >= _AGGREGATION_ROW_LIMIT
+        return get_counts_from_df(count_df, key_prefix), False, is_truncated
+
+    with ThreadPoolExecutor(max_workers=_MAX_CONCURRENT_QUERIES) as executor:
+        results = list(executor.map(get_counts, aggregation_queries))
+
+    if any(is_truncated for _, _, is_truncated in results):
+        return None
+
+    counts = Counter()
+    if is_approximate_widget(widget_type, event):
+        # the counts of each query are added to the sketches
+        render = SKETCH_WIDGETS[widget_type]
+        counts = get_new_sketches(event)()
+    for query_counts, _, _ in results:
+        counts.update(query_counts)
+    is_partial = any(is_query_partial for _, is_query_partial, _ in results)
+    if not counts:
+        return "<pre>No data found</pre>", is_partial
+    return render(event=event, counts=counts), is_partial
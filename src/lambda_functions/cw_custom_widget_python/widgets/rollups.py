@@ -0,0 +1,189 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Top N Custom Widgets Served from Hourly and Daily Rollups
+
+Merges the pre-aggregated daily and hourly counts written by the rollup
+materializer for the closed days and hours of the time range. Live queries are
+only used for the edges of the time range that do not cover a full hour, the
+open hour and any hour that has not been materialized yet.
+
+The rollups count the conversation logs of a bot locale selected by the
+materializer query (see get_rollup_query). Widgets with another query are not
+served from the rollups.
+"""
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# pylint: disable=import-error
+from lib.cw_logs import QueryTimeoutError, get_rows_as_df
+from lib.log_source import get_query_tokens
+from lib.rollup_store import DAY_IN_SECS, HOUR_IN_SECS
+
+# pylint: enable=import-error
+from .approximate import get_new_sketches, is_approximate_widget
+from .incremental import COUNT_WIDGETS, SKETCH_WIDGETS, aggregate_messages_df
+
+# S3 GET requests of rollups in flight at once
+_MAX_CONCURRENT_READS = 8
+# widget type -> (rollup dataset name, count key columns)
+ROLLUP_DATASETS = {
+    "slotsTopN": ("slots", ["intent", "slot", "value"]),
+    "sessionAttributesTopN": ("session_attributes", ["key", "value"]),
+}
+
+
+def is_rollup_widget(widget_type):
+    """Returns True if the widget type can be served from rollups"""
+    return widget_type in ROLLUP_DATASETS
+
+
+def get_rollup_query(bot_id, bot_locale_id):
+    """Get the query of the conversation logs of a bot locale counted in the rollups"""
+    return f"FILTER bot.id = '{bot_id}' AND bot.localeId = '{bot_locale_id}'"
+
+
+def is_rollup_query(query, bot_id, bot_locale_id):
+    """Returns True if a widget query selects the logs counted in the rollups of a bot locale
+
+    The query has to be the rollup query of the bot locale, with any case of
+    the keywords, quotes and whitespace.
+    """
+    if not bot_id or not bot_locale_id:
+        return False
+    return get_query_tokens(query) == get_query_tokens(get_rollup_query(bot_id, bot_locale_id))
+
+
+def get_rollup_periods(first_hour, last_hour_end):
+    """Split a range of whole hours into (start, period) rollups
+
+    Full UTC days are read from their daily rollup and the remaining hours
+    from their hourly rollups.
+    """
+    periods = []
+    start = first_hour
+    while start < last_hour_end:
+        period = HOUR_IN_SECS
+        if start % DAY_IN_SECS == 0 and start + DAY_IN_SECS <= last_hour_end:
+            period = DAY_IN_SECS
+        periods.append((start, period))
+        start += period
+    return periods
+
+
+def get_rollup_ranges(
+    start_time,
+    end_time,
+    rollup_store,
+    dataset,
+    bot_id,
+    bot_locale_id,
+    new_counts=Counter,
+):
+    """Split a time range into materialized rollup counts and ranges to query live
+
+    Returns a tuple with the merged counts of the materialized days and hours
+    and a list of contiguous (start, end) time ranges to query. The counts are
+    merged in the accumulator returned by new_counts (a Counter or sketches).
+
+    The rollups are read concurrently. Days without a daily rollup are read
+    from their hourly rollups.
+    """
+    # pylint: disable=too-many-arguments,too-many-locals
+    first_hour = start_time + (-start_time % HOUR_IN_SECS)
+    last_hour_end = (end_time + 1) - ((end_time + 1) % HOUR_IN_SECS)
+
+    counts = new_counts()
+    live_ranges = []
+
+    def add_live_range(range_start, range_end):
+        if live_ranges and live_ranges[-1][1] + 1 == range_start:
+            live_ranges[-1] = (live_ranges[-1][0], range_end)
+        else:
+            live_ranges.append((range_start, range_end))
+
+    if first_hour >= last_hour_end:
+        return counts, [(start_time, end_time)]
+
+    def read_counts(rollup_period):
+        period_start, period = rollup_period
+        return rollup_store.read_counts(
+            dataset=dataset,
+            bot_id=bot_id,
+            bot_locale_id=bot_locale_id,
+            start_time=period_start,
+            period=period,
+        )
+
+    periods = get_rollup_periods(first_hour, last_hour_end)
+    with ThreadPoolExecutor(max_workers=_MAX_CONCURRENT_READS) as executor:
+        period_counts = dict(zip(periods, executor.map(read_counts, periods)))
+        missing_day_hours = [
+            (hour, HOUR_IN_SECS)
+            for (period_start, period), rollup_counts in period_counts.items()
+            if rollup_counts is None and period == DAY_IN_SECS
+            for hour in range(period_start, period_start + period, HOUR_IN_SECS)
+        ]
+        period_counts.update(zip(missing_day_hours, executor.map(read_counts, missing_day_hours)))
+
+    if start_time < first_hour:
+        add_live_range(start_time, first_hour - 1)
+    for period_start, period in sorted(period_counts):
+        rollup_counts = period_counts[(period_start, period)]
+        if rollup_counts is not None:
+            counts.update(rollup_counts)
+        elif period == HOUR_IN_SECS:
+            add_live_range(period_start, period_start + period - 1)
+    if last_hour_end <= end_time:
+        add_live_range(last_hour_end, end_time)
+
+    return counts, live_ranges
+
+
+def render_rollup_widget(
+    widget_type,
+    event,
+    get_input_df,
+    start_time,
+    end_time,
+    rollup_store,
+    allow_partial_results=True,
+):
+    """Render a top N widget from hourly rollups and live queries
+
+    Returns a tuple with the widget HTML and a flag indicating if it was
+    rendered from partial results.
+    """
+    # pylint: disable=too-many-arguments,too-many-locals
+    aggregate, render = COUNT_WIDGETS[widget_type]
+    dataset, _ = ROLLUP_DATASETS[widget_type]
+    new_counts = Counter
+    if is_approximate_widget(widget_type, event):
+        new_counts = get_new_sketches(event)
+        render = SKETCH_WIDGETS[widget_type]
+
+    counts, live_ranges = get_rollup_ranges(
+        start_time=start_time,
+        end_time=end_time,
+        rollup_store=rollup_store,
+        dataset=dataset,
+        bot_id=event["botId"],
+        bot_locale_id=event["botLocaleId"],
+        new_counts=new_counts,
+    )
+
+    is_partial = False
+    for range_start, range_end in live_ranges:
+        try:
+            input_df = get_input_df(range_start, range_end)
+        except QueryTimeoutError as exception:
+            if not allow_partial_results:
+                raise
+            input_df = get_rows_as_df(exception.rows)
+            is_partial = True
+        counts.update(aggregate_messages_df(input_df, aggregate))
+
+    if not counts:
+        return "<pre>No data found</pre>", is_partial
+
+    return render(event=event, counts=counts), is_partial
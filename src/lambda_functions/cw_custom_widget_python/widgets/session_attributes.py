@@ -3,63 +3,276 @@
 # SPDX-License-Identifier: MIT-0
 """Lex Session Attributes CloudWatch Custom Widgets"""
 
-import json
+from collections import Counter
+import heapq
+from operator import itemgetter
 
-import pandas as pd
+# pylint: disable=import-error
+from lib.messages import decode_messages
+from lib.metrics import record_phase
+from lib.sketches import DEFAULT_HLL_PRECISION, count_distinct_by_key
+
+# pylint: enable=import-error
+from . import STDLIB_ENGINE, get_engine
+from .approximate import APPROXIMATE_NOTICE, get_sketch_topn_table, get_sketches
+from .html_renderer import (
+    DEFAULT_MAX_OUTPUT_BYTES,
+    escape,
+    get_max_output_bytes,
+    is_empty_table,
+    render_df_table,
+    render_sections,
+)
+
+_SESSION_ATTRIBUTES_PATH = "sessionState.sessionAttributes"
+_SESSION_ID_PATH = "sessionId"
+# message paths decoded by the widget
+SESSION_ATTRIBUTES_MESSAGE_PATHS = [_SESSION_ATTRIBUTES_PATH, _SESSION_ID_PATH]
+
+
+def get_session_attribute_values(
+    session_attributes_list, session_ids, session_attributes_to_exclude
+):
+    """Reshape decoded session attributes into a long format list of values
+
+    Returns a tuple with the attribute keys in order of appearance and a list
+    with one (key, value, session_id) tuple per non null attribute value.
+    Excluded keys are dropped before reshaping.
+    """
+    keys = {}
+    attribute_values = []
+    for session_attributes, session_id in zip(session_attributes_list, session_ids):
+        if not isinstance(session_attributes, dict):
+            continue
+        for key, value in session_attributes.items():
+            if key in session_attributes_to_exclude:
+                continue
+            keys.setdefault(key)
+            if value is not None:
+                attribute_values.append((key, value, session_id))
+
+    return list(keys), attribute_values
+
+
+def get_top_n_session_attribute_values_df(attribute_values, top_n):
+    """Get the top N values of each session attribute key with pandas
+
+    Returns a dictionary of key to a dataframe with the value and count columns.
+    """
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
+    attribute_values_df = pd.DataFrame(attribute_values, columns=["key", "value", "session_id"])
+    # count all (key, value) groups at once. Values are kept in order of first
+    # appearance within each key and the stable sort of the group counts keeps
+    # that order for ties
+    attribute_counts = attribute_values_df.groupby(["key", "value"], sort=False).size()
+    return {
+        key: group_counts.droplevel("key")
+        .sort_values(ascending=False, kind="stable")
+        .head(top_n)
+        .rename("count")
+        .reset_index()
+        for key, group_counts in attribute_counts.groupby(level="key", sort=False)
+    }
+
+
+def get_top_n_session_attribute_values(attribute_values, top_n):
+    """Get the top N values of each session attribute key with the standard library
+
+    Returns a dictionary of key to a dictionary with the value and count
+    columns, in the same order as get_top_n_session_attribute_values_df.
+    """
+    # counters keep the (key, value) pairs in order of first appearance
+    return get_top_n_session_attribute_value_counts(
+        Counter(map(itemgetter(0, 1), attribute_values)), top_n
+    )
+
+
+def get_top_n_session_attribute_value_counts(counts, top_n):
+    """Get the top N values of each session attribute key from value counts
+
+    Takes a mapping of (key, value) to count in order of first appearance and
+    returns the same dictionary as get_top_n_session_attribute_values.
+    """
+    key_value_counts = {}
+    for (key, value), count in counts.items():
+        # skip the key order keys without value of aggregate_session_attribute_value_counts
+        if value is not None:
+            key_value_counts.setdefault(key, []).append((value, count))
+    top_n_values = {}
+    for key, value_counts in key_value_counts.items():
+        # nlargest is stable, ties keep the order of first appearance
+        top_value_counts = heapq.nlargest(top_n, value_counts, key=itemgetter(1))
+        top_n_values[key] = {
+            "value": [value for value, _ in top_value_counts],
+            "count": [count for _, count in top_value_counts],
+        }
+    return top_n_values
 
 
 def render_session_attributes_top_n_widget(event, input_df):
     """Render Session Attributes Custom Widget"""
-    # pylint: disable=too-many-locals
+    # extract only the session attributes from the json message fields
+    messages = decode_messages(input_df["@message"], SESSION_ATTRIBUTES_MESSAGE_PATHS)
+    return render_session_attributes_top_n_from_messages(event=event, messages=messages)
+
+
+def render_session_attributes_top_n_from_messages(event, messages):
+    """Render Session Attributes Custom Widget from decoded messages
+
+    Takes a dictionary of message path to values as returned by
+    decode_messages with at least the SESSION_ATTRIBUTES_MESSAGE_PATHS.
+    """
     session_attributes_to_exclude = event.get("sessionAttributesToExclude", [])
     top_n = event.get("topN", 10)
 
-    # deserialize json from message fields
-    message_series = input_df["@message"].apply(json.loads)
-    # flatten dictionaries
-    normalized_message_df = pd.DataFrame.from_records(
-        pd.json_normalize(message_series, max_level=1)
+    session_attributes_list = messages[_SESSION_ATTRIBUTES_PATH]
+    if all(v is None for v in session_attributes_list):
+        return "<pre>No session attribute values found</pre>"
+
+    with record_phase("Aggregation"):
+        keys, attribute_values = get_session_attribute_values(
+            session_attributes_list,
+            messages[_SESSION_ID_PATH],
+            set(session_attributes_to_exclude),
+        )
+
+        sketches = None
+        if event.get("approximateTopN", False):
+            sketches = get_sketches(event, ((key, value) for key, value, _ in attribute_values))
+        else:
+            if get_engine(event) == STDLIB_ENGINE:
+                attribute_topn = get_top_n_session_attribute_values(attribute_values, top_n)
+            else:
+                attribute_topn = get_top_n_session_attribute_values_df(attribute_values, top_n)
+
+            session_attributes_topn_values = [
+                {
+                    "name": key,
+                    "topn_df": attribute_topn[key],
+                }
+                for key in keys
+                if key in attribute_topn
+            ]
+
+            if event.get("distinctSessions", False):
+                add_distinct_sessions(
+                    session_attributes_topn_values=session_attributes_topn_values,
+                    attribute_values=attribute_values,
+                    precision=int(event.get("distinctSessionsPrecision", DEFAULT_HLL_PRECISION)),
+                )
+
+    # rendered after the aggregation phase, the renderers record the render phase
+    if sketches is not None:
+        return render_session_attributes_top_n_from_sketches(event=event, counts=sketches)
+
+    return render_session_attributes_top_n_html(
+        top_n=top_n,
+        session_attributes_topn_values=session_attributes_topn_values,
+        max_output_bytes=get_max_output_bytes(event),
     )
 
-    if "sessionState.sessionAttributes" not in normalized_message_df.columns:
-        return "<pre>No session attributes found</pre>"
 
-    session_attributes_series = normalized_message_df["sessionState.sessionAttributes"].dropna(
-        how="all"
+def add_distinct_sessions(session_attributes_topn_values, attribute_values, precision):
+    """Add the estimated number of distinct sessions of each top N value as a column
+
+    The sessions are counted with HyperLogLog sketches of the top N values.
+    """
+    selected_keys = {
+        (entry["name"], value)
+        for entry in session_attributes_topn_values
+        for value in entry["topn_df"]["value"]
+    }
+    session_counts = count_distinct_by_key(
+        keys=((key, value) for key, value, _ in attribute_values),
+        items=(session_id for _, _, session_id in attribute_values),
+        selected_keys=selected_keys,
+        precision=precision,
     )
+    for entry in session_attributes_topn_values:
+        # the number of sessions can not be larger than the number of records
+        entry["topn_df"]["sessions"] = [
+            min(session_counts[(entry["name"], value)], count)
+            for value, count in zip(entry["topn_df"]["value"], entry["topn_df"]["count"])
+        ]
 
-    if session_attributes_series.empty:
+
+def render_session_attributes_top_n_from_counts(event, counts):
+    """Render the Session Attributes Custom Widget from (attribute key, value) counts
+
+    The counts are the ones of aggregate_session_attribute_value_counts, merged
+    in time order by the incremental and rollup paths, so that the keys and
+    values are in order of first appearance and the tables are sorted as the
+    ones rendered from the messages.
+    """
+    session_attributes_to_exclude = event.get("sessionAttributesToExclude", [])
+    top_n = event.get("topN", 10)
+
+    attribute_topn = get_top_n_session_attribute_value_counts(counts, top_n)
+    session_attributes_topn_values = [
+        {"name": key, "topn_df": attribute_topn[key]}
+        for key in dict.fromkeys(key for key, _ in counts)
+        if key in attribute_topn and key not in session_attributes_to_exclude
+    ]
+    return render_session_attributes_top_n_html(
+        top_n=top_n,
+        session_attributes_topn_values=session_attributes_topn_values,
+        max_output_bytes=get_max_output_bytes(event),
+    )
+
+
+def render_session_attributes_top_n_from_sketches(event, counts):
+    """Render the Session Attributes Custom Widget from attribute key sketches"""
+    session_attributes_to_exclude = event.get("sessionAttributesToExclude", [])
+    top_n = event.get("topN", 10)
+
+    session_attributes_topn_values = [
+        {
+            "name": f"{key} (max unlisted count: {sketch.min_count})",
+            "topn_df": get_sketch_topn_table(sketch, top_n),
+        }
+        for (key,), sketch in counts.sketches.items()
+        if key not in session_attributes_to_exclude
+    ]
+    if not session_attributes_topn_values:
         return "<pre>No session attribute values found</pre>"
 
-    # extract sessionState.sessionAttributes dictionaries and turn then into a dataframe
-    session_attributes_df = pd.DataFrame.from_records(session_attributes_series).drop(
-        session_attributes_to_exclude,
-        axis="columns",
-        errors="ignore",
+    return APPROXIMATE_NOTICE + render_session_attributes_top_n_html(
+        top_n=top_n,
+        session_attributes_topn_values=session_attributes_topn_values,
+        max_output_bytes=get_max_output_bytes(event),
     )
 
-    session_attributes_columns = session_attributes_df.columns
-    session_attributes_topn_values = []
-    for column in session_attributes_columns:
-        topn_df = (
-            session_attributes_df[column]
-            .value_counts()
-            .to_frame()
-            .head(top_n)
-            .reset_index()
-            .rename({column: "count", "index": "value"}, axis="columns")
-        )
-        session_attributes_topn_values.append(
-            {
-                "name": column,
-                "topn_df": topn_df,
-            }
+
+def render_session_attributes_top_n_html(
+    top_n, session_attributes_topn_values, max_output_bytes=None
+):
+    """Render the Session Attributes Custom Widget HTML from the top N values of each key"""
+    sections = (
+        f"<br><h3>Session Attribute Key: {escape(entry['name'])}</h3><br>"
+        + render_df_table(entry["topn_df"])
+        for entry in session_attributes_topn_values
+        if not is_empty_table(entry["topn_df"])
+    )
+    with record_phase("Render"):
+        return render_sections(
+            header=f"<h2>Top {top_n} Session Attribute Values</h2>",
+            sections=sections,
+            max_output_bytes=max_output_bytes or DEFAULT_MAX_OUTPUT_BYTES,
         )
 
-    output = f"<h2>Top {top_n} Session Attribute Values</h2>"
-    for entry in session_attributes_topn_values:
-        if not entry["topn_df"].empty:
-            output = output + f"<br><h3>Session Attribute Key: {entry['name']}</h3><br>"
-            output = output + entry["topn_df"].to_html(index=False)
 
-    return output
+def aggregate_session_attribute_value_counts(input_messages):
+    """Count session attribute values by (attribute key, value)
+
+    Takes the JSON @message values of the query results. The counts start with
+    zero counts keyed by (attribute key, None) in order of first appearance of
+    the keys, which is the order of the tables rendered from the messages.
+    """
+    messages = decode_messages(input_messages, SESSION_ATTRIBUTES_MESSAGE_PATHS)
+    keys, attribute_values = get_session_attribute_values(
+        messages[_SESSION_ATTRIBUTES_PATH], messages[_SESSION_ID_PATH], set()
+    )
+    counts = Counter(dict.fromkeys(((key, None) for key in keys), 0))
+    counts.update((key, value) for key, value, _ in attribute_values)
+    return counts
@@ -3,90 +3,318 @@
 # SPDX-License-Identifier: MIT-0
 """Lex Slots CloudWatch Custom Widgets"""
 
-import json
+from collections import Counter
+import heapq
+from operator import itemgetter
 
-import pandas as pd
+# pylint: disable=import-error
+from lib.messages import decode_messages
+from lib.metrics import record_phase
+from lib.sketches import DEFAULT_HLL_PRECISION, count_distinct_by_key
 
-_SLOT_NAME_SUFFIX = ".value.originalValue"
+# pylint: enable=import-error
+from . import STDLIB_ENGINE, get_engine
+from .approximate import APPROXIMATE_NOTICE, get_sketch_topn_table, get_sketches
+from .html_renderer import (
+    DEFAULT_MAX_OUTPUT_BYTES,
+    escape,
+    get_max_output_bytes,
+    is_empty_table,
+    render_df_table,
+    render_sections,
+)
+
+FULFILLED_INTENT_STATES = ["Fulfilled", "ReadyForFulfillment"]
+_INTENT_PATH_COLUMNS = {
+    "sessionState.intent.name": "name",
+    "sessionState.intent.state": "state",
+    "sessionState.intent.slots": "slots",
+}
+_SESSION_ID_PATH = "sessionId"
+# message paths decoded by the widget
+SLOTS_MESSAGE_PATHS = [*_INTENT_PATH_COLUMNS, _SESSION_ID_PATH]
+
+
+def _has_value(value):
+    """Returns True if a decoded JSON value has a non null leaf value"""
+    if isinstance(value, dict):
+        return any(_has_value(v) for v in value.values())
+    return value is not None
+
+
+def get_slot_values(intents, session_ids):
+    """Reshape decoded intents into a long format list of fulfilled slot values
+
+    Takes a dictionary with the name, state and slots lists of the decoded
+    intents and the list of session ids. Returns a tuple with the intent names
+    and slot names in order of appearance and a list with one (name, slot,
+    value, session_id) tuple per slot value of a fulfilled intent.
+    """
+    intent_names = {}
+    slot_names = {}
+    slot_values = []
+    for name, state, slots, session_id in zip(
+        intents["name"], intents["state"], intents["slots"], session_ids
+    ):
+        # skip intents without any slot data
+        if not isinstance(slots, dict) or not _has_value(slots):
+            continue
+        intent_names.setdefault(name)
+        is_fulfilled = state in FULFILLED_INTENT_STATES
+        for slot_name, slot in slots.items():
+            value = slot.get("value") if isinstance(slot, dict) else None
+            if not isinstance(value, dict) or "originalValue" not in value:
+                continue
+            slot_names.setdefault(slot_name)
+            if is_fulfilled and value["originalValue"] is not None:
+                slot_values.append((name, slot_name, value["originalValue"], session_id))
+
+    return list(intent_names), list(slot_names), slot_values
+
+
+def get_top_n_slot_values_df(slot_values, top_n):
+    """Get the top N values of each (intent name, slot name) with pandas
+
+    Returns a dictionary of (intent name, slot name) to a dataframe with the
+    value and count columns.
+    """
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
+    slot_values_df = pd.DataFrame(slot_values, columns=["name", "slot", "value", "session_id"])
+    # count all (intent, slot, value) groups at once. Values are sorted within
+    # each (intent, slot) group and the stable sort of the group counts keeps
+    # that order for ties
+    intent_slot_counts = slot_values_df.groupby(["name", "slot", "value"], sort=True).size()
+    return {
+        intent_slot: group_counts.droplevel(["name", "slot"])
+        .sort_values(ascending=False, kind="stable")
+        .head(top_n)
+        .rename("count")
+        .reset_index()
+        for intent_slot, group_counts in intent_slot_counts.groupby(
+            level=["name", "slot"], sort=False
+        )
+    }
+
+
+def get_top_n_slot_values(slot_values, top_n):
+    """Get the top N values of each (intent name, slot name) with the standard library
+
+    Returns a dictionary of (intent name, slot name) to a dictionary with the
+    value and count columns, in the same order as get_top_n_slot_values_df.
+    """
+    return get_top_n_slot_value_counts(Counter(map(itemgetter(0, 1, 2), slot_values)), top_n)
+
+
+def get_top_n_slot_value_counts(counts, top_n):
+    """Get the top N values of each (intent name, slot name) from value counts
+
+    Takes a mapping of (intent name, slot name, value) to count and returns the
+    same dictionary as get_top_n_slot_values.
+    """
+    intent_slot_groups = {}
+    # null group keys are dropped as in pandas groupby, as are the name order
+    # keys without value of aggregate_slot_value_counts
+    for (name, slot_name, value), count in sorted(
+        i for i in counts.items() if i[0][0] is not None and i[0][2] is not None
+    ):
+        intent_slot_groups.setdefault((name, slot_name), []).append((value, count))
+    top_n_values = {}
+    for intent_slot, value_counts in intent_slot_groups.items():
+        # nlargest is stable, ties keep the sorted value order
+        top_value_counts = heapq.nlargest(top_n, value_counts, key=itemgetter(1))
+        top_n_values[intent_slot] = {
+            "value": [value for value, _ in top_value_counts],
+            "count": [count for _, count in top_value_counts],
+        }
+    return top_n_values
 
 
 def render_slots_top_n_widget(event, input_df):
     """Render Slots Custom Widget"""
+    # extract only the intent fields from the json message fields
+    messages = decode_messages(input_df["@message"], SLOTS_MESSAGE_PATHS)
+    return render_slots_top_n_from_messages(event=event, messages=messages)
+
+
+def render_slots_top_n_from_messages(event, messages):
+    """Render Slots Custom Widget from decoded messages
+
+    Takes a dictionary of message path to values as returned by
+    decode_messages with at least the SLOTS_MESSAGE_PATHS.
+    """
     # pylint: disable=too-many-locals
     slots_to_exclude = event.get("slotsToExclude", [])
     intents_to_exclude = event.get("intentToExclude", [])
     top_n = event.get("topN", 10)
 
-    # deserialize json from message fields
-    message_series = input_df["@message"].apply(json.loads)
-    # flatten dictionaries up to one level and create a dataframe from it
-    # only one level to selectively flatten other fields
-    normalized_message_df = pd.DataFrame.from_records(
-        pd.json_normalize(message_series, max_level=1)
-    )
-    if "sessionState.intent" not in normalized_message_df.columns:
+    intents = {column: messages[path] for path, column in _INTENT_PATH_COLUMNS.items()}
+    if all(v is None for column in intents.values() for v in column):
         return "<pre>No intent data found</pre>"
 
-    # extract sessionState.intent dictionaries and turn then into a dataframe
-    intent_df = pd.DataFrame.from_records(normalized_message_df["sessionState.intent"])
-
-    # extract slots and normalize
-    if "slots" not in intent_df.columns:
+    if all(v is None for v in intents["slots"]):
         return "<pre>No slots data found</pre>"
 
-    slots_df = pd.json_normalize(intent_df["slots"]).dropna(how="all")
+    with record_phase("Aggregation"):
+        # single pass over the intents applying the fulfilled state filter once
+        intent_names, slot_names, slot_values = get_slot_values(intents, messages[_SESSION_ID_PATH])
+        if not intent_names:
+            return "<pre>No slot values found</pre>"
 
-    # join slots with intent to get a flattened dataframe with slots and intents
-    slots_intent_df = slots_df.join(intent_df)
-    if slots_intent_df.empty:
-        return "<pre>No slot values found</pre>"
-
-    # get intent names in data without exclusion
-    slots_intent_columns = slots_intent_df.columns
-    intent_names = [i for i in slots_intent_df["name"].unique() if i not in intents_to_exclude]
+        sketches = None
+        if event.get("approximateTopN", False):
+            sketches = get_sketches(event, (slot_value[:3] for slot_value in slot_values))
+        else:
+            # get intent and slot names in data without exclusion
+            intent_names = [i for i in intent_names if i not in intents_to_exclude]
+            slot_names = [s for s in slot_names if s not in slots_to_exclude]
 
-    # get slot names in data without exclusion
-    slots_to_exclude_column_names = [f"{s}{_SLOT_NAME_SUFFIX}" for s in slots_to_exclude]
-    slot_names = [
-        c[: -len(_SLOT_NAME_SUFFIX)]
-        for c in slots_intent_columns
-        if c.endswith(_SLOT_NAME_SUFFIX) and c not in slots_to_exclude_column_names
-    ]
+            if get_engine(event) == STDLIB_ENGINE:
+                intent_slot_topn = get_top_n_slot_values(slot_values, top_n)
+            else:
+                intent_slot_topn = get_top_n_slot_values_df(slot_values, top_n)
 
-    intent_slot_topn_values = []
-    for intent_name in intent_names:
-        for slot_name in slot_names:
-            slot_column_name = f"{slot_name}{_SLOT_NAME_SUFFIX}"
-
-            intent_slot_values_df = slots_intent_df[
-                (slots_intent_df["name"] == intent_name)
-                & slots_intent_df["state"].isin(["Fulfilled", "ReadyForFulfillment"])
-            ][[slot_column_name]].rename({slot_column_name: "value"}, axis="columns")
-
-            intent_slot_topn_values_df = (
-                intent_slot_values_df.value_counts()
-                .head(top_n)
-                .to_frame()
-                .rename({0: "count"}, axis="columns")
-                .reset_index()
-            )
-
-            intent_slot_topn_values.append(
+            intent_slot_topn_values = [
                 {
                     "intent_name": intent_name,
                     "slot_name": slot_name,
-                    "topn_df": intent_slot_topn_values_df,
+                    "topn_df": intent_slot_topn[(intent_name, slot_name)],
                 }
-            )
+                for intent_name in intent_names
+                for slot_name in slot_names
+                if (intent_name, slot_name) in intent_slot_topn
+            ]
+
+            if event.get("distinctSessions", False):
+                add_distinct_sessions(
+                    intent_slot_topn_values=intent_slot_topn_values,
+                    slot_values=slot_values,
+                    precision=int(event.get("distinctSessionsPrecision", DEFAULT_HLL_PRECISION)),
+                )
+
+    # rendered after the aggregation phase, the renderers record the render phase
+    if sketches is not None:
+        return render_slots_top_n_from_sketches(event=event, counts=sketches)
+
+    return render_slots_top_n_html(
+        top_n=top_n,
+        intent_slot_topn_values=intent_slot_topn_values,
+        max_output_bytes=get_max_output_bytes(event),
+    )
 
-    output = f"<h2>Top {top_n} Slot Values in Fulfilled Intents</h2>"
+
+def add_distinct_sessions(intent_slot_topn_values, slot_values, precision):
+    """Add the estimated number of distinct sessions of each top N value as a column
+
+    The sessions are counted with HyperLogLog sketches of the top N values.
+    """
+    selected_keys = {
+        (entry["intent_name"], entry["slot_name"], value)
+        for entry in intent_slot_topn_values
+        for value in entry["topn_df"]["value"]
+    }
+    session_counts = count_distinct_by_key(
+        keys=(slot_value[:3] for slot_value in slot_values),
+        items=(session_id for _, _, _, session_id in slot_values),
+        selected_keys=selected_keys,
+        precision=precision,
+    )
     for entry in intent_slot_topn_values:
-        if not entry["topn_df"].empty:
-            output = (
-                output
-                + f"<br><h3>Intent: {entry['intent_name']}"
-                + f" Slot: {entry['slot_name']}</h3><br>"
-            )
-            output = output + entry["topn_df"].to_html(index=False)
-
-    return output
+        # the number of sessions can not be larger than the number of records
+        entry["topn_df"]["sessions"] = [
+            min(session_counts[(entry["intent_name"], entry["slot_name"], value)], count)
+            for value, count in zip(entry["topn_df"]["value"], entry["topn_df"]["count"])
+        ]
+
+
+def render_slots_top_n_from_counts(event, counts):
+    """Render the Slots Custom Widget from (intent name, slot name, value) counts
+
+    The counts are the ones of aggregate_slot_value_counts, merged in time
+    order by the incremental and rollup paths, so that the intent and slot
+    names are in order of first appearance and the tables are sorted as the
+    ones rendered from the messages.
+    """
+    slots_to_exclude = event.get("slotsToExclude", [])
+    intents_to_exclude = event.get("intentToExclude", [])
+    top_n = event.get("topN", 10)
+
+    intent_names = dict.fromkeys(name for name, _, _ in counts if name not in intents_to_exclude)
+    slot_names = dict.fromkeys(
+        slot for _, slot, _ in counts if slot is not None and slot not in slots_to_exclude
+    )
+    intent_slot_topn = get_top_n_slot_value_counts(counts, top_n)
+    intent_slot_topn_values = [
+        {
+            "intent_name": intent_name,
+            "slot_name": slot_name,
+            "topn_df": intent_slot_topn[(intent_name, slot_name)],
+        }
+        for intent_name in intent_names
+        for slot_name in slot_names
+        if (intent_name, slot_name) in intent_slot_topn
+    ]
+    return render_slots_top_n_html(
+        top_n=top_n,
+        intent_slot_topn_values=intent_slot_topn_values,
+        max_output_bytes=get_max_output_bytes(event),
+    )
+
+
+def render_slots_top_n_from_sketches(event, counts):
+    """Render the Slots Custom Widget from (intent name, slot name) sketches"""
+    slots_to_exclude = event.get("slotsToExclude", [])
+    intents_to_exclude = event.get("intentToExclude", [])
+    top_n = event.get("topN", 10)
+
+    intent_slot_topn_values = [
+        {
+            "intent_name": intent_name,
+            "slot_name": f"{slot_name} (max unlisted count: {sketch.min_count})",
+            "topn_df": get_sketch_topn_table(sketch, top_n),
+        }
+        for (intent_name, slot_name), sketch in counts.sketches.items()
+        if intent_name not in intents_to_exclude and slot_name not in slots_to_exclude
+    ]
+    if not intent_slot_topn_values:
+        return "<pre>No slot values found</pre>"
+
+    return APPROXIMATE_NOTICE + render_slots_top_n_html(
+        top_n=top_n,
+        intent_slot_topn_values=intent_slot_topn_values,
+        max_output_bytes=get_max_output_bytes(event),
+    )
+
+
+def render_slots_top_n_html(top_n, intent_slot_topn_values, max_output_bytes=None):
+    """Render the Slots Custom Widget HTML from the top N values of each intent and slot"""
+    sections = (
+        f"<br><h3>Intent: {escape(entry['intent_name'])}"
+        f" Slot: {escape(entry['slot_name'])}</h3><br>" + render_df_table(entry["topn_df"])
+        for entry in intent_slot_topn_values
+        if not is_empty_table(entry["topn_df"])
+    )
+    with record_phase("Render"):
+        return render_sections(
+            header=f"<h2>Top {top_n} Slot Values in Fulfilled Intents</h2>",
+            sections=sections,
+            max_output_bytes=max_output_bytes or DEFAULT_MAX_OUTPUT_BYTES,
+        )
+
+
+def aggregate_slot_value_counts(input_messages):
+    """Count slot values of fulfilled intents by (intent name, slot name, value)
+
+    Takes the JSON @message values of the query results. The counts start with
+    zero counts keyed by (intent name, None, None) and (None, slot name, None)
+    in order of first appearance of the intents with slot data and of the slot
+    names, fulfilled or not, which is the order of the tables rendered from the
+    messages.
+    """
+    messages = decode_messages(input_messages, SLOTS_MESSAGE_PATHS)
+    intents = {column: messages[path] for path, column in _INTENT_PATH_COLUMNS.items()}
+    intent_names, slot_names, slot_values = get_slot_values(intents, messages[_SESSION_ID_PATH])
+    counts = Counter(dict.fromkeys(((name, None, None) for name in intent_names), 0))
+    counts.update(dict.fromkeys(((None, slot_name, None) for slot_name in slot_names), 0))
+    counts.update(slot_value[:3] for slot_value in slot_values)
+    return counts
@@ -0,0 +1,111 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Shared Setup of the Python Custom Widget Benchmarks and Checks
+
+Importing this module adds the custom widget function directory to the module
+search path and sets the environment defaults of the function modules, so
+that the scripts of this directory import it before any function module:
+
+    from benchmark_env import INPUT_FIELDS, FakeLogsClient
+
+    # pylint: disable=import-error
+    from lib.cw_logs import get_rows_as_df
+
+It also has the CloudWatch Logs client stubs that serve synthetic Log
+Insights query results.
+"""
+
+from bisect import bisect_left, bisect_right
+import os
+import sys
+from threading import Lock
+
+LAMBDA_DIR = os.path.abspath(
+    os.path.join(
+        os.path.dirname(__file__),
+        "..",
+        "..",
+        "..",
+        "src",
+        "lambda_functions",
+        "cw_custom_widget_python",
+    )
+)
+# fields of the result rows of the widget queries
+INPUT_FIELDS = ["@timestamp", "@message"]
+
+if LAMBDA_DIR not in sys.path:
+    sys.path.insert(0, LAMBDA_DIR)
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+
+class FakeLogsClient:
+    """CloudWatch Logs client stub that returns the same query results for any query
+
+    Counts the start_query calls, which are thread safe like the boto3 client.
+    """
+
+    def __init__(self, rows):
+        self._rows = rows
+        self._lock = Lock()
+        self.start_query_count = 0
+
+    def start_query(self, **_):
+        """Start a query"""
+        with self._lock:
+            self.start_query_count += 1
+        return {"queryId": "benchmark"}
+
+    def get_query_results(self, queryId):  # pylint: disable=invalid-name
+        """Get the results of a completed query"""
+        return {
+            "queryId": queryId,
+            "status": "Complete",
+            "results": self._rows,
+            "statistics": {
+                "recordsMatched": len(self._rows),
+                "recordsScanned": len(self._rows),
+                "bytesScanned": 0,
+            },
+        }
+
+    def stop_query(self, **_):
+        """Stop a query"""
+        return {"success": True}
+
+
+class TimeRangeLogsClient:
+    """CloudWatch Logs client stub that returns the rows in the query time range
+
+    The timestamps in epoch seconds of the rows are in ascending order.
+    """
+
+    def __init__(self, rows, timestamps):
+        self._rows = rows
+        self._timestamps = timestamps
+        self._queries = {}
+        self._lock = Lock()
+        self.start_query_count = 0
+
+    def get_rows(self, start_time, end_time):
+        """Get the rows with a timestamp in an inclusive time range in seconds"""
+        start = bisect_left(self._timestamps, start_time)
+        end = bisect_right(self._timestamps, end_time)
+        return self._rows[slice(start, end)]
+
+    def start_query(self, startTime, endTime, **_):  # pylint: disable=invalid-name
+        """Start a query"""
+        with self._lock:
+            self.start_query_count += 1
+            query_id = str(len(self._queries))
+            self._queries[query_id] = self.get_rows(startTime, endTime)
+        return {"queryId": query_id}
+
+    def get_query_results(self, queryId):  # pylint: disable=invalid-name
+        """Get the results of a completed query"""
+        return {"queryId": queryId, "status": "Complete", "results": self._queries[queryId]}
+
+    def stop_query(self, **_):
+        """Stop a query"""
+        return {"success": True}
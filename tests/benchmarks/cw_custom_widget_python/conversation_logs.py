@@ -0,0 +1,269 @@
+#!/usr/bin/env python3.9
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Synthetic Lex V2 Conversation Log Generator
+
+Generates deterministic (seeded) Lex V2 conversation log records of the
+BankerBot sample bot, including slots, session attributes and missed
+utterances, and formats them as Log Insights query results so that the
+custom widget pipeline can be measured offline without a log group (see the
+client stubs of benchmark_env).
+
+The vocabulary is read from the BankerBot definitions of the bot tester
+function. The definitions are parsed from the source instead of imported
+since that module needs the faker package and the audio files.
+
+Usage: python tests/benchmarks/cw_custom_widget_python/conversation_logs.py [COUNT] [SEED]
+"""
+
+import ast
+from datetime import datetime, timedelta, timezone
+import json
+import os
+import random
+import sys
+
+_BOT_CONVERSATIONS_FILE = os.path.join(
+    os.path.dirname(__file__),
+    "..",
+    "..",
+    "..",
+    "src",
+    "lambda_functions",
+    "bot_tester",
+    "bot_conversations.py",
+)
+_BOT = {
+    "id": "BENCHBOTID",
+    "name": "BankerBot",
+    "aliasId": "TSTALIASID",
+    "aliasName": "TestBotAlias",
+    "localeId": "en_US",
+    "version": "DRAFT",
+}
+_START_TIME = datetime(2021, 9, 10, tzinfo=timezone.utc)
+_USER_COUNT = 500
+
+
+def load_banker_bot_definitions(locale="en_US"):
+    """Read the BankerBot vocabulary of a locale from the bot tester definitions"""
+    with open(_BOT_CONVERSATIONS_FILE, encoding="utf-8") as source_file:
+        module = ast.parse(source_file.read())
+    for node in ast.walk(module):
+        if isinstance(node, ast.ClassDef) and node.name == "BankerBot":
+            for statement in node.body:
+                if isinstance(statement, ast.Assign) and any(
+                    getattr(target, "id", None) == "DEFINITIONS" for target in statement.targets
+                ):
+                    definitions = ast.literal_eval(statement.value)
+                    return {key: sorted(values) for key, values in definitions[locale].items()}
+    raise RuntimeError("BankerBot definitions not found")
+
+
+def _get_slot(value):
+    if value is None:
+        return None
+    return {
+        "shape": "Scalar",
+        "value": {
+            "originalValue": value,
+            "interpretedValue": value,
+            "resolvedValues": [value],
+        },
+    }
+
+
+class ConversationLogGenerator:
+    """Seeded generator of BankerBot conversation log records"""
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, seed=0, definitions=None):
+        self._random = random.Random(seed)
+        self._definitions = definitions or load_banker_bot_definitions()
+        self._request_count = 0
+        self._timestamp = _START_TIME
+
+    def _choice(self, key):
+        return self._random.choice(self._definitions[key])
+
+    def _get_record(self, session, text, intent, state, slots, app_state, slot_to_elicit=None):
+        # pylint: disable=too-many-arguments
+        self._request_count += 1
+        self._timestamp += timedelta(milliseconds=self._random.randint(50, 2000))
+        is_missed = intent == "FallbackIntent"
+        request_id = f"{self._random.getrandbits(64):016x}-{self._request_count}"
+        dialog_action = (
+            {"type": "ElicitSlot", "slotToElicit": slot_to_elicit}
+            if slot_to_elicit
+            else {"type": "Close"}
+        )
+        intent_state = {
+            "name": intent,
+            "slots": slots,
+            "state": state,
+            "confirmationState": "None",
+        }
+        return {
+            "messageVersion": "2.0",
+            "bot": _BOT,
+            "inputMode": "Text",
+            "inputTranscript": text,
+            "interpretations": [
+                {
+                    "intent": intent_state,
+                    "nluConfidence": None if is_missed else round(self._random.random(), 2),
+                }
+            ],
+            "messages": [{"content": f"{intent} response", "contentType": "PlainText"}],
+            "missedUtterance": is_missed,
+            "requestId": request_id,
+            "sessionId": session["id"],
+            "sessionState": {
+                "dialogAction": dialog_action,
+                "intent": intent_state,
+                "originatingRequestId": session["originating_request_id"],
+                "sessionAttributes": {"appState": app_state, "username": session["username"]},
+            },
+            "timestamp": self._timestamp.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z",
+        }
+
+    def _welcome(self, session):
+        yield self._get_record(
+            session, self._choice("welcome_utterances"), "Welcome", "Fulfilled", {}, "init"
+        )
+
+    def _fallback(self, session):
+        key = "fallback_utterances" if self._random.random() < 0.7 else "invalid_account_types"
+        yield self._get_record(
+            session, self._choice(key), "FallbackIntent", "Failed", {}, "Fallback"
+        )
+
+    def _check_balance(self, session):
+        slots = {"accountType": None, "dateOfBirth": None}
+        yield self._get_record(
+            session,
+            self._choice("check_balance_utterances"),
+            "CheckBalance",
+            "InProgress",
+            dict(slots),
+            "CheckBalance",
+            slot_to_elicit="accountType",
+        )
+        account_type = self._choice("account_types")
+        slots["accountType"] = _get_slot(account_type)
+        yield self._get_record(
+            session,
+            account_type,
+            "CheckBalance",
+            "InProgress",
+            dict(slots),
+            "CheckBalance:Account",
+            slot_to_elicit="dateOfBirth",
+        )
+        date_of_birth = (_START_TIME - timedelta(days=self._random.randint(6570, 29200))).date()
+        slots["dateOfBirth"] = _get_slot(date_of_birth.isoformat())
+        yield self._get_record(
+            session,
+            date_of_birth.isoformat(),
+            "CheckBalance",
+            self._random.choice(["Fulfilled", "ReadyForFulfillment"]),
+            dict(slots),
+            "CheckBalance:Account:DoB",
+        )
+
+    def _transfer_funds(self, session):
+        slots = {"sourceAccountType": None, "targetAccountType": None, "transferAmount": None}
+        yield self._get_record(
+            session,
+            self._choice("transfer_funds_utterances"),
+            "TransferFunds",
+            "InProgress",
+            dict(slots),
+            "TransferFunds",
+            slot_to_elicit="sourceAccountType",
+        )
+        for slot_name, app_state, next_slot in [
+            ("sourceAccountType", "TransferFunds:SrcAccount", "targetAccountType"),
+            ("targetAccountType", "TransferFunds:DstAccount", "transferAmount"),
+        ]:
+            account_type = self._choice("account_types")
+            slots[slot_name] = _get_slot(account_type)
+            yield self._get_record(
+                session,
+                account_type,
+                "TransferFunds",
+                "InProgress",
+                dict(slots),
+                app_state,
+                slot_to_elicit=next_slot,
+            )
+        amount = f"${self._random.randint(1, 5000)}.{self._random.randint(0, 99):02d}"
+        slots["transferAmount"] = _get_slot(amount)
+        yield self._get_record(
+            session, amount, "TransferFunds", "InProgress", dict(slots), "Transfer:Amount"
+        )
+        confirmation = self._choice("confirmations")
+        yield self._get_record(
+            session,
+            confirmation,
+            "TransferFunds",
+            "Fulfilled" if confirmation == "yes" else "Failed",
+            dict(slots),
+            "TransferFunds:DstAccount",
+        )
+
+    def generate_records(self, count):
+        """Generate conversation log records in conversation order"""
+        conversations = [
+            (self._welcome, 2),
+            (self._fallback, 1),
+            (self._check_balance, 4),
+            (self._transfer_funds, 3),
+        ]
+        functions = [f for f, _ in conversations]
+        weights = [w for _, w in conversations]
+        generated = 0
+        while True:
+            session = {
+                "id": f"{self._random.getrandbits(64):016x}",
+                "originating_request_id": f"{self._random.getrandbits(64):016x}",
+                "username": f"user{self._random.randrange(_USER_COUNT)}",
+            }
+            conversation = self._random.choices(functions, weights=weights)[0]
+            for record in conversation(session):
+                if generated >= count:
+                    return
+                yield record
+                generated += 1
+
+
+def get_query_result_row(record, index):
+    """Format a conversation log record as a Log Insights query result row"""
+    timestamp = record["timestamp"].replace("T", " ").rstrip("Z")
+    return [
+        {"field": "@timestamp", "value": timestamp},
+        {"field": "@message", "value": json.dumps(record)},
+        {"field": "@ptr", "value": f"CmAKJwojMTIzNDU2Nzg5MDEyOmJlbmNobWFyaxAEEgUI{index:010d}"},
+    ]
+
+
+def generate_query_results(count, seed=0):
+    """Generate Log Insights query result rows of conversation log records"""
+    generator = ConversationLogGenerator(seed=seed)
+    return [
+        get_query_result_row(record, index)
+        for index, record in enumerate(generator.generate_records(count))
+    ]
+
+
+def main():
+    """Print generated query result rows as JSON lines"""
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    for row in generate_query_results(count=count, seed=seed):
+        print(json.dumps(row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3.9
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Check that the stdlib and pandas widget engines render the same HTML
+
+Renders the slots and session attributes top N widgets and the conversation
+path widget from synthetic conversation logs with both engines and a set of
+widget parameters, and fails if any output differs. The stdlib engine outputs
+are rendered first to also check that they do not import pandas.
+
+Usage: python tests/benchmarks/cw_custom_widget_python/engine_parity.py [--sizes 0,50,1000]
+"""
+
+import argparse
+import sys
+
+from benchmark_env import INPUT_FIELDS
+
+# pylint: disable=import-error
+from lambda_function import render_widgets
+from lib.cw_logs import get_rows_as_columns, get_rows_as_df
+from conversation_logs import generate_query_results
+
+# pylint: enable=import-error
+
+DEFAULT_SIZES = [0, 1, 50, 1000, 5000]
+DEFAULT_SEEDS = [0, 1, 2]
+# (widget types, widget parameters)
+_CASES = [
+    (["slotsTopN"], {}),
+    (["slotsTopN"], {"topN": 1}),
+    (["slotsTopN"], {"topN": 3, "intentToExclude": ["TransferFunds"]}),
+    (["slotsTopN"], {"topN": 2, "slotsToExclude": ["accountType"], "distinctSessions": True}),
+    (["sessionAttributesTopN"], {}),
+    (["sessionAttributesTopN"], {"topN": 2, "distinctSessions": True}),
+    (["sessionAttributesTopN"], {"topN": 5, "sessionAttributesToExclude": ["username"]}),
+    (["slotsTopN", "sessionAttributesTopN"], {"topN": 4, "maxOutputBytes": 3000}),
+    (["conversationPath"], {}),
+    (["conversationPath"], {"minTransitionCount": 5}),
+    (["conversationPath"], {"maxOutputBytes": 1500}),
+]
+
+
+def render_cases(rows, engine):
+    """Render all the cases with an engine"""
+    if engine == "stdlib":
+        input_df = get_rows_as_columns(rows, fields=INPUT_FIELDS)
+    else:
+        input_df = get_rows_as_df(rows, fields=INPUT_FIELDS)
+    return [
+        render_widgets(
+            widget_types=widget_types,
+            event={"widgetType": widget_types[0], "engine": engine, **params},
+            input_df=input_df,
+        )
+        for widget_types, params in _CASES
+    ]
+
+
+def main():
+    """Run the parity check"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        default=",".join(str(s) for s in DEFAULT_SIZES),
+        help="comma separated numbers of rows",
+    )
+    parser.add_argument(
+        "--seeds",
+        default=",".join(str(s) for s in DEFAULT_SEEDS),
+        help="comma separated generator seeds",
+    )
+    args = parser.parse_args()
+
+    datasets = [
+        (size, seed, generate_query_results(count=size, seed=seed))
+        for size in [int(s) for s in args.sizes.split(",")]
+        for seed in [int(s) for s in args.seeds.split(",")]
+    ]
+    stdlib_outputs = [render_cases(rows, engine="stdlib") for _, _, rows in datasets]
+    errors = []
+    if "pandas" in sys.modules:
+        errors.append("the stdlib engine imported pandas")
+
+    for (size, seed, rows), stdlib_output in zip(datasets, stdlib_outputs):
+        pandas_output = render_cases(rows, engine="pandas")
+        for (widget_types, params), stdlib_html, pandas_html in zip(
+            _CASES, stdlib_output, pandas_output
+        ):
+            if stdlib_html != pandas_html:
+                errors.append(f"output differs - rows: {size} seed: {seed} {widget_types} {params}")
+
+    print(f"checked {len(datasets) * len(_CASES)} renders of {len(datasets)} datasets")
+    for error in errors:
+        print(f"[ERROR] {error}", file=sys.stderr)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3.9
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Benchmark the file log source on synthetic exported conversation logs
+
+Writes synthetic conversation log records in each supported export format
+(JSON lines, CloudWatch Logs export and Firehose subscription data, plain and
+gzip compressed) with interleaved records of another bot, then measures the
+time to read the rows of the bot from each file with FileLogSource and the
+bot filter query of the widgets and checks that they match the Log Insights
+formatted rows of the generator. Also checks the rows of a query with an
+intent state filter and that a query with other commands is rejected.
+
+Usage: python tests/benchmarks/cw_custom_widget_python/file_log_source.py [--sizes 10000,100000]
+"""
+
+import argparse
+import copy
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+
+import benchmark_env  # noqa: F401 pylint: disable=unused-import
+
+# pylint: disable=import-error
+from lib.file_log_source import FileLogSource, parse_timestamp
+from conversation_logs import ConversationLogGenerator, get_query_result_row
+
+# pylint: enable=import-error
+
+DEFAULT_SIZES = [10000, 100000]
+_OTHER_BOT_ID = "OTHERBOTID"
+_FIREHOSE_BATCH_SIZE = 50
+_INTENT_STATE = "Fulfilled"
+_UNSUPPORTED_QUERY = "FILTER missedUtterance = 1 | STATS COUNT(*) BY inputTranscript"
+
+
+def format_jsonl(records):
+    """Format records as conversation log JSON lines"""
+    return [json.dumps(record) for record in records]
+
+
+def format_export(records):
+    """Format records as CloudWatch Logs export lines"""
+    return [f"{record['timestamp']} {json.dumps(record)}" for record in records]
+
+
+def format_firehose(records):
+    """Format records as Firehose subscription data, one batch of log events per line"""
+    lines = []
+    for start in range(0, len(records), _FIREHOSE_BATCH_SIZE):
+        end = start + _FIREHOSE_BATCH_SIZE
+        batch = records[start:end]
+        log_events = [
+            {
+                "id": str(index),
+                "timestamp": parse_timestamp(record["timestamp"]),
+                "message": json.dumps(record),
+            }
+            for index, record in enumerate(batch)
+        ]
+        lines.append(
+            json.dumps(
+                {"messageType": "DATA_MESSAGE", "logGroup": "benchmark", "logEvents": log_events}
+            )
+        )
+    return lines
+
+
+_FORMATS = {"jsonl": format_jsonl, "export": format_export, "firehose": format_firehose}
+
+
+def get_records(count, seed):
+    """Generate records of the benchmark bot interleaved with records of another bot"""
+    records = []
+    for record in ConversationLogGenerator(seed=seed).generate_records(count):
+        other_bot_record = copy.deepcopy(record)
+        other_bot_record["bot"]["id"] = _OTHER_BOT_ID
+        records.extend([record, other_bot_record])
+    return records
+
+
+def write_files(records, output_dir):
+    """Write the records in each format, plain and gzip compressed
+
+    Returns a dictionary of file name to path.
+    """
+    paths = {}
+    for format_name, format_lines in _FORMATS.items():
+        content = "\n".join(format_lines(records)) + "\n"
+        for file_name, open_file in [
+            (f"{format_name}.jsonl", open),
+            (f"{format_name}.jsonl.gz", gzip.open),
+        ]:
+            path = os.path.join(output_dir, file_name)
+            with open_file(path, "wt", encoding="utf-8") as log_file:
+                log_file.write(content)
+            paths[file_name] = path
+    return paths
+
+
+def get_widget_query(bot):
+    """Get the widget query of the conversation logs of a bot locale"""
+    return f"FILTER bot.id = '{bot['id']}' AND bot.localeId = '{bot['localeId']}'"
+
+
+def check_query_filters(path, query, expected_rows):
+    """Check the rows of a query with an intent state filter and the rejection of other queries
+
+    expected_rows are the (row, record) tuples of the query without the
+    intent state filter.
+    """
+    errors = []
+    source = FileLogSource(
+        paths=[path], query=f"{query} | FILTER sessionState.intent.state = '{_INTENT_STATE}'"
+    )
+    intent_rows = [
+        row
+        for row, record in expected_rows
+        if record["sessionState"]["intent"]["state"] == _INTENT_STATE
+    ]
+    if not intent_rows or list(source.get_rows(start_time=0, end_time=2**31)) != intent_rows:
+        errors.append(f"intent state filter rows differ - file: {os.path.basename(path)}")
+    try:
+        FileLogSource(paths=[path], query=_UNSUPPORTED_QUERY)
+        errors.append(f"unsupported query not rejected: {_UNSUPPORTED_QUERY}")
+    except ValueError:
+        pass
+    return errors
+
+
+def main():
+    """Run the benchmarks"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        default=",".join(str(s) for s in DEFAULT_SIZES),
+        help="comma separated numbers of records of the benchmark bot",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="generator seed")
+    args = parser.parse_args()
+
+    errors = []
+    print(f"{'records':>9}  {'file':<24}  {'mmap':<5}  {'size (MiB)':>10}  {'time (ms)':>10}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        records = get_records(size, seed=args.seed)
+        expected_rows = [
+            (get_query_result_row(record, index)[:2], record)
+            for index, record in enumerate(r for r in records if r["bot"]["id"] != _OTHER_BOT_ID)
+        ]
+        query = get_widget_query(records[0]["bot"])
+        with tempfile.TemporaryDirectory() as output_dir:
+            for file_name, path in write_files(records, output_dir).items():
+                for use_mmap in [False, True] if not file_name.endswith(".gz") else [False]:
+                    source = FileLogSource(paths=[path], query=query, use_mmap=use_mmap)
+                    start = time.perf_counter()
+                    rows = list(source.get_rows(start_time=0, end_time=2**31))
+                    elapsed_time = time.perf_counter() - start
+                    print(
+                        f"{size:>9}  {file_name:<24}  {str(use_mmap):<5}"
+                        f"  {os.path.getsize(path) / 2**20:>10.1f}  {elapsed_time * 1000:>10.1f}"
+                    )
+                    if rows != [row for row, _ in expected_rows]:
+                        errors.append(f"rows differ - records: {size}, file: {file_name}")
+                errors.extend(check_query_filters(path, query, expected_rows))
+
+    for error in errors:
+        print(f"[ERROR] {error}", file=sys.stderr)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
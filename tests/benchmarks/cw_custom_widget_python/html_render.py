@@ -0,0 +1,65 @@
+#!/usr/bin/env python3.9
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Benchmark the widget table renderer against DataFrame.to_html
+
+Renders a slots widget with many small top N tables with both renderers,
+checks that the HTML is the same and prints the timings.
+
+Usage: python tests/benchmarks/cw_custom_widget_python/html_render.py [TABLES] [TOP_N]
+"""
+
+import random
+import sys
+import timeit
+
+import pandas as pd
+
+import benchmark_env  # noqa: F401 pylint: disable=unused-import
+
+# pylint: disable=import-error
+from widgets.html_renderer import render_df_table
+
+# pylint: enable=import-error
+
+
+def get_topn_dfs(table_count, top_n, seed=0):
+    """Generate top N value count tables"""
+    rand = random.Random(seed)
+    return [
+        pd.DataFrame(
+            {
+                "value": [f"value <{rand.randint(0, 10**6)}> & more" for _ in range(top_n)],
+                "count": sorted((rand.randint(1, 10**5) for _ in range(top_n)), reverse=True),
+            }
+        )
+        for _ in range(table_count)
+    ]
+
+
+def main():
+    """Run the benchmark"""
+    table_count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    top_n = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    topn_dfs = get_topn_dfs(table_count, top_n)
+
+    def render_to_html():
+        return "".join(df.to_html(index=False) for df in topn_dfs)
+
+    def render_template():
+        return "".join(render_df_table(df) for df in topn_dfs)
+
+    if render_to_html() != render_template():
+        raise RuntimeError("renderers output differs")
+
+    number = 3
+    to_html_time = min(timeit.repeat(render_to_html, number=number, repeat=3)) / number
+    template_time = min(timeit.repeat(render_template, number=number, repeat=3)) / number
+    print(f"tables: {table_count}, top n: {top_n}")
+    print(f"DataFrame.to_html: {to_html_time * 1000:.1f} ms")
+    print(f"render_df_table:   {template_time * 1000:.1f} ms")
+    print(f"speedup:           {to_html_time / template_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3.9
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Check the import time of the Python custom widget Lambda handler
+
+Imports the handler module in a new interpreter with -X importtime, prints
+the slowest imports and fails if the cumulative import time exceeds the
+budget or if a heavy module that should be imported on first use (pandas,
+boto3...) is imported at cold start. The import time is the minimum of a few
+runs to reduce the noise.
+
+Usage: python tests/benchmarks/cw_custom_widget_python/import_time.py [--budget-ms 150]
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+from benchmark_env import LAMBDA_DIR
+
+_HANDLER_MODULE = "lambda_function"
+DEFAULT_BUDGET_MS = 150
+# modules that must not be imported when the handler module is loaded
+DEFAULT_LAZY_MODULES = ["pandas", "numpy", "boto3", "botocore"]
+_IMPORT_TIME_REGEX = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s+)(\S+)$")
+
+
+def get_import_times(module_name=_HANDLER_MODULE, cwd=LAMBDA_DIR):
+    """Import a module with -X importtime in a new interpreter
+
+    Returns a list of (module name, self time in us, cumulative time in us,
+    nesting level) tuples in the order reported by the interpreter.
+    """
+    env = dict(os.environ)
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module_name}"],
+        cwd=cwd,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    import_times = []
+    for line in process.stderr.splitlines():
+        match = _IMPORT_TIME_REGEX.match(line)
+        if match:
+            self_time, cumulative_time, indent, name = match.groups()
+            level = (len(indent) - 1) // 2
+            import_times.append((name, int(self_time), int(cumulative_time), level))
+    return import_times
+
+
+def main():
+    """Run the import time check"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=DEFAULT_BUDGET_MS,
+        help="max cumulative import time of the handler module in milliseconds",
+    )
+    parser.add_argument("--runs", type=int, default=3, help="number of import runs")
+    parser.add_argument("--top", type=int, default=10, help="number of slowest imports to print")
+    parser.add_argument(
+        "--lazy-modules",
+        default=",".join(DEFAULT_LAZY_MODULES),
+        help="comma separated modules that must not be imported by the handler module",
+    )
+    args = parser.parse_args()
+
+    runs = [get_import_times() for _ in range(args.runs)]
+    import_times = min(runs, key=lambda r: r[-1][2])
+    handler_time_ms = import_times[-1][2] / 1000
+
+    print(f"{'cumulative (ms)':>15}  {'self (ms)':>9}  module")
+    slowest = sorted(import_times, key=lambda i: i[2], reverse=True)[: args.top]
+    for name, self_time, cumulative_time, level in slowest:
+        print(f"{cumulative_time / 1000:>15.1f}  {self_time / 1000:>9.1f}  {'  ' * level}{name}")
+
+    errors = []
+    if handler_time_ms > args.budget_ms:
+        errors.append(
+            f"{_HANDLER_MODULE} import time {handler_time_ms:.1f} ms"
+            f" exceeds the budget of {args.budget_ms:.1f} ms"
+        )
+    imported = {name.split(".")[0] for name, _, _, _ in import_times}
+    for module_name in [m for m in args.lazy_modules.split(",") if m]:
+        if module_name in imported:
+            errors.append(f"{module_name} is imported at cold start")
+
+    print(f"{_HANDLER_MODULE} import time: {handler_time_ms:.1f} ms (budget: {args.budget_ms} ms)")
+    for error in errors:
+        print(f"[ERROR] {error}", file=sys.stderr)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
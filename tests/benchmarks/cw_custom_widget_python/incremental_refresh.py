@@ -0,0 +1,133 @@
+#!/usr/bin/env python3.9
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Check the incremental refresh of the top N widgets against the raw path
+
+Slides a time range that is not aligned to the bucket size over synthetic
+conversation logs and refreshes the incremental widgets at each step, using a
+Log Insights client stub that filters the rows by time range. Fails if:
+
+- an incremental widget renders different HTML than the widget rendered from
+  the raw messages of the exact time range
+- a refresh queries more than the new buckets and the partial edge buckets
+
+Usage: python tests/benchmarks/cw_custom_widget_python/incremental_refresh.py [--count 3000]
+"""
+
+import argparse
+from datetime import datetime, timezone
+import sys
+
+from benchmark_env import INPUT_FIELDS, TimeRangeLogsClient
+
+# pylint: disable=import-error
+from lib.cw_logs import get_rows_as_df
+from widgets.incremental import render_incremental_widget
+from widgets.slots import render_slots_top_n_widget
+from widgets.session_attributes import render_session_attributes_top_n_widget
+from conversation_logs import ConversationLogGenerator, get_query_result_row
+
+# pylint: enable=import-error
+
+DEFAULT_COUNT = 3000
+_START_TIME = int(datetime(2021, 9, 10, 18, 20, tzinfo=timezone.utc).timestamp())
+_RECORD_INTERVAL_IN_SECS = 7
+_BUCKET_SIZE_IN_SECS = 300
+_TIME_RANGE_IN_SECS = 3600
+# refresh interval, not aligned to the bucket size
+_STEP_IN_SECS = 420
+_WIDGETS = {
+    "slotsTopN": render_slots_top_n_widget,
+    "sessionAttributesTopN": render_session_attributes_top_n_widget,
+}
+# widget parameters checked for each widget type
+_CASES = [
+    {},
+    {"topN": 3},
+    {"engine": "stdlib"},
+    {"approximateTopN": True},
+    {"slotsToExclude": ["cardType"], "sessionAttributesToExclude": ["appState"]},
+]
+
+
+def generate_rows(count):
+    """Generate query result rows with one record every _RECORD_INTERVAL_IN_SECS"""
+    rows = []
+    timestamps = []
+    for index, record in enumerate(ConversationLogGenerator(seed=0).generate_records(count)):
+        timestamp = _START_TIME + index * _RECORD_INTERVAL_IN_SECS
+        record["timestamp"] = datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime(
+            "%Y-%m-%dT%H:%M:%S.000Z"
+        )
+        rows.append(get_query_result_row(record, index))
+        timestamps.append(timestamp)
+    return rows, timestamps
+
+
+def check_case(logs_client, widget_type, params, time_ranges):
+    """Check the refreshes of a widget over sliding time ranges"""
+    errors = []
+    event = {
+        "query": f"filter @message like 'case {len(params)} {sorted(params)}'",
+        "logGroups": "lex-analytics-conversation-logs",
+        **params,
+    }
+    queried_ranges = []
+
+    def get_input_df(start_time, end_time):
+        return get_rows_as_df(logs_client.get_rows(start_time, end_time), fields=INPUT_FIELDS)
+
+    def get_queried_input_df(start_time, end_time):
+        queried_ranges.append((start_time, end_time))
+        return get_input_df(start_time, end_time)
+
+    for index, (start_time, end_time) in enumerate(time_ranges):
+        queried_ranges.clear()
+        html, _ = render_incremental_widget(
+            widget_type=widget_type,
+            event=event,
+            get_input_df=get_queried_input_df,
+            start_time=start_time,
+            end_time=end_time,
+            bucket_size=_BUCKET_SIZE_IN_SECS,
+        )
+        expected_html = _WIDGETS[widget_type](event, get_input_df(start_time, end_time))
+        if html != expected_html:
+            errors.append(f"output differs - {widget_type} {params} refresh {index}")
+
+        # after the first refresh only the new buckets and the edges are queried
+        queried_time = sum(range_end - range_start + 1 for range_start, range_end in queried_ranges)
+        if index and queried_time > _STEP_IN_SECS + 2 * _BUCKET_SIZE_IN_SECS:
+            errors.append(
+                f"refresh queried {queried_time} secs - {widget_type} {params} refresh {index}"
+            )
+    return errors
+
+
+def main():
+    """Run the incremental refresh check"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=DEFAULT_COUNT, help="number of records")
+    args = parser.parse_args()
+
+    rows, timestamps = generate_rows(args.count)
+    logs_client = TimeRangeLogsClient(rows, timestamps)
+    time_ranges = [
+        (start_time + 123, start_time + 123 + _TIME_RANGE_IN_SECS - 1)
+        for start_time in range(timestamps[0], timestamps[-1] - _TIME_RANGE_IN_SECS, _STEP_IN_SECS)
+    ]
+    errors = []
+    for widget_type in _WIDGETS:
+        for params in _CASES:
+            errors.extend(check_case(logs_client, widget_type, params, time_ranges))
+    print(
+        f"checked {len(time_ranges)} refreshes of {len(_WIDGETS) * len(_CASES)} widgets"
+        f" over {args.count} records"
+    )
+    for error in errors:
+        print(f"[ERROR] {error}", file=sys.stderr)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3.9
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Benchmark the Parquet log store on synthetic conversation logs
+
+Writes synthetic conversation log records to a temporary Parquet log store,
+checks that the widgets rendered from the store match the widgets rendered
+from the Log Insights formatted rows of the same records, and measures the
+time to read the columns of each widget against decoding the JSON messages.
+
+Requires pyarrow, which is not included in the Lambda layer.
+
+Usage: python tests/benchmarks/cw_custom_widget_python/log_store.py [--sizes 10000,100000]
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+
+from benchmark_env import INPUT_FIELDS
+
+# pylint: disable=import-error
+from lambda_function import render_widgets, render_widgets_from_messages
+from lib.cw_logs import get_rows_as_columns
+from lib.file_log_source import parse_timestamp
+from lib.log_store import ParquetLogStore
+from lib.messages import decode_messages
+from widgets import get_widget_renderer
+from conversation_logs import ConversationLogGenerator, get_query_result_row
+
+# pylint: enable=import-error
+
+DEFAULT_SIZES = [10000, 100000]
+# (widget types, widget parameters)
+_CASES = [
+    (["slotsTopN"], {}),
+    (["slotsTopN"], {"topN": 2, "slotsToExclude": ["accountType"], "distinctSessions": True}),
+    (["sessionAttributesTopN"], {}),
+    (["sessionAttributesTopN"], {"topN": 5, "sessionAttributesToExclude": ["username"]}),
+    (["slotsTopN", "sessionAttributesTopN"], {"topN": 4}),
+    (["conversationPath"], {}),
+    (["missedUtteranceClusters"], {}),
+]
+
+
+def main():
+    """Run the benchmarks"""
+    # pylint: disable=too-many-locals
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        default=",".join(str(s) for s in DEFAULT_SIZES),
+        help="comma separated numbers of records",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="generator seed")
+    args = parser.parse_args()
+
+    errors = []
+    print(f"{'records':>9}  {'widget':<22}  {'decode (ms)':>11}  {'store read (ms)':>15}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        records = list(ConversationLogGenerator(seed=args.seed).generate_records(size))
+        log_events = [(parse_timestamp(record["timestamp"]), record) for record in records]
+        rows = [get_query_result_row(record, index) for index, record in enumerate(records)]
+        input_df = get_rows_as_columns(rows, fields=INPUT_FIELDS)
+        bot = records[0]["bot"]
+        start_time = log_events[0][0] // 1000
+        end_time = log_events[-1][0] // 1000
+
+        with tempfile.TemporaryDirectory() as store_dir:
+            log_store = ParquetLogStore(uri=store_dir)
+            log_store.write_records(log_events, part_name="benchmark")
+
+            def read_messages(paths):
+                return log_store.read_messages(
+                    bot_id=bot["id"],
+                    bot_locale_id=bot["localeId"],
+                    start_time=start_time,
+                    end_time=end_time,
+                    paths=paths,
+                )
+
+            for widget_types, params in _CASES:
+                event = {"widgetType": widget_types[0], "engine": "stdlib", **params}
+                expected_html = render_widgets(
+                    widget_types=widget_types, event=event, input_df=input_df
+                )
+                html = render_widgets_from_messages(
+                    widget_types=widget_types, event=event, get_messages=read_messages
+                )
+                if html != expected_html:
+                    errors.append(f"output differs - records: {size} {widget_types} {params}")
+
+            for widget_type in ["slotsTopN", "sessionAttributesTopN"]:
+                paths, _ = get_widget_renderer(widget_type)
+                start = time.perf_counter()
+                decode_messages(input_df["@message"], paths)
+                decode_time = time.perf_counter() - start
+                start = time.perf_counter()
+                read_messages(paths)
+                read_time = time.perf_counter() - start
+                print(
+                    f"{size:>9}  {widget_type:<22}"
+                    f"  {decode_time * 1000:>11.1f}  {read_time * 1000:>15.1f}"
+                )
+
+    for error in errors:
+        print(f"[ERROR] {error}", file=sys.stderr)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
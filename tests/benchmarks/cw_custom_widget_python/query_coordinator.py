@@ -0,0 +1,231 @@
+#!/usr/bin/env python3.9
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Check that concurrent identical queries share one Log Insights query
+
+Runs concurrent get_query_results requests for the same query, log groups and
+time range with a query coordinator on each flight backend, using a separate
+coordinator per request for the file and S3 backends like separate processes
+or Lambda containers (S3 with an in-memory client stub). Fails if:
+
+- two concurrent identical requests (one with a different query whitespace)
+  do not make exactly one start_query call and get different rows
+- the request waiting for a failed flight does not run the query
+- the default concurrency limit does not cap the queries of a sharded query
+
+Usage: python tests/benchmarks/cw_custom_widget_python/query_coordinator.py
+"""
+
+import logging
+import sys
+import tempfile
+from threading import Lock, Thread
+import time
+
+from benchmark_env import FakeLogsClient
+
+# pylint: disable=import-error
+from lib.cw_logs import get_query_results
+from lib.query_coordinator import (
+    FileQueryFlightBackend,
+    InProcessQueryFlightBackend,
+    InProcessQuerySlotBackend,
+    QueryCoordinator,
+    S3QueryFlightBackend,
+    get_query_coordinator_from_env,
+)
+from conversation_logs import generate_query_results
+
+# pylint: enable=import-error
+
+_QUERY = "fields @timestamp, @message | filter bot.id = 'BENCHBOTID'"
+_LOG_GROUP_NAMES = ["/aws/lex/BankerBot"]
+_START_TIME = 1631232000
+_END_TIME = _START_TIME + 6 * 3600
+_QUERY_TIME_IN_SECS = 0.3
+# the S3 leases are best effort for requests that start at the same time
+_REQUEST_INTERVAL_IN_SECS = 0.05
+_LOGGER = logging.getLogger(__name__)
+# the failed flight check logs the failed query responses
+_LOGGER.setLevel(logging.CRITICAL)
+
+
+class SlowLogsClient(FakeLogsClient):
+    """Logs client stub whose queries run for a while and can fail
+
+    Records the peak number of queries running at the same time.
+    """
+
+    def __init__(self, rows, fail_queries=0):
+        super().__init__(rows)
+        self._fail_queries = fail_queries
+        self._running = 0
+        self._running_lock = Lock()
+        self.peak_running = 0
+
+    def start_query(self, **kwargs):
+        with self._running_lock:
+            self._running += 1
+            self.peak_running = max(self.peak_running, self._running)
+        return super().start_query(**kwargs)
+
+    def get_query_results(self, queryId):  # pylint: disable=invalid-name
+        time.sleep(_QUERY_TIME_IN_SECS)
+        response = super().get_query_results(queryId)
+        with self._running_lock:
+            self._running -= 1
+            if self._fail_queries:
+                self._fail_queries -= 1
+                response["status"] = "Failed"
+        return response
+
+
+class MemoryS3Client:
+    """S3 client stub that keeps the objects in memory"""
+
+    class exceptions:  # pylint: disable=invalid-name,too-few-public-methods
+        """Client exceptions"""
+
+        class NoSuchKey(Exception):
+            """Object not found"""
+
+    class _Body:  # pylint: disable=too-few-public-methods
+        def __init__(self, payload):
+            self._payload = payload
+
+        def read(self):
+            """Read the payload"""
+            return self._payload
+
+    def __init__(self):
+        self._objects = {}
+        self._lock = Lock()
+
+    def get_object(self, Bucket, Key):  # pylint: disable=invalid-name
+        """Get an object"""
+        with self._lock:
+            if (Bucket, Key) not in self._objects:
+                raise self.exceptions.NoSuchKey(Key)
+            return {"Body": self._Body(self._objects[(Bucket, Key)])}
+
+    def put_object(self, Bucket, Key, Body, **_):  # pylint: disable=invalid-name
+        """Put an object"""
+        with self._lock:
+            self._objects[(Bucket, Key)] = Body
+
+
+def run_requests(logs_client, coordinators, queries):
+    """Run concurrent get_query_results requests and return their rows or exceptions"""
+    results = [None] * len(queries)
+
+    def run(index):
+        try:
+            results[index] = get_query_results(
+                query=queries[index],
+                log_group_names=_LOG_GROUP_NAMES,
+                start_time=_START_TIME,
+                end_time=_END_TIME,
+                logger=_LOGGER,
+                logs_client=logs_client,
+                coordinator=coordinators[index],
+            )
+        except RuntimeError as exception:
+            results[index] = exception
+
+    threads = []
+    for index in range(len(queries)):
+        threads.append(Thread(target=run, args=(index,)))
+        threads[-1].start()
+        time.sleep(_REQUEST_INTERVAL_IN_SECS)
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def get_coordinators(flight_dir):
+    """Get the coordinators of two requests for each flight backend"""
+    in_process_coordinator = QueryCoordinator(
+        backend=InProcessQuerySlotBackend(max_slots=2),
+        flight_backend=InProcessQueryFlightBackend(),
+    )
+    s3_client = MemoryS3Client()
+    return {
+        "in-process": [in_process_coordinator] * 2,
+        "file": [
+            QueryCoordinator(
+                backend=InProcessQuerySlotBackend(max_slots=2),
+                flight_backend=FileQueryFlightBackend(flight_dir=flight_dir),
+            )
+            for _ in range(2)
+        ],
+        "s3": [
+            QueryCoordinator(
+                backend=InProcessQuerySlotBackend(max_slots=2),
+                flight_backend=S3QueryFlightBackend(
+                    bucket="bucket", prefix="query_flights", get_client=lambda _: s3_client
+                ),
+            )
+            for _ in range(2)
+        ],
+    }
+
+
+def check_shared_queries(rows):
+    """Check the single-flight of each backend"""
+    errors = []
+    queries = [_QUERY, f"  {_QUERY.replace(' | ', chr(10) + '  | ')}  "]
+    for backend_name in ["in-process", "file", "s3"]:
+        with tempfile.TemporaryDirectory() as flight_dir:
+            coordinators = get_coordinators(flight_dir)[backend_name]
+            logs_client = SlowLogsClient(rows)
+            results = run_requests(logs_client, coordinators, queries)
+            print(
+                f"{backend_name:<10}  identical requests: {logs_client.start_query_count} queries"
+            )
+            if logs_client.start_query_count != 1:
+                errors.append(f"{backend_name}: {logs_client.start_query_count} start_query calls")
+            if results[0] != rows or results[1] != rows:
+                errors.append(f"{backend_name}: shared rows differ")
+
+            # the waiting request runs the query when the flight fails
+            coordinators = get_coordinators(flight_dir)[backend_name]
+            logs_client = SlowLogsClient(rows, fail_queries=1)
+            results = run_requests(logs_client, coordinators, [_QUERY, _QUERY])
+            print(f"{backend_name:<10}  failed flight: {logs_client.start_query_count} queries")
+            if not isinstance(results[0], RuntimeError) or results[1] != rows:
+                errors.append(f"{backend_name}: failed flight not run by the waiting request")
+    return errors
+
+
+def check_concurrency_limit(rows):
+    """Check that the default concurrency limit caps the shards of a query"""
+    coordinator = get_query_coordinator_from_env()
+    logs_client = SlowLogsClient(rows)
+    get_query_results(
+        query=_QUERY,
+        log_group_names=_LOG_GROUP_NAMES,
+        start_time=_START_TIME,
+        end_time=_END_TIME,
+        logger=_LOGGER,
+        logs_client=logs_client,
+        coordinator=coordinator,
+        shard_count=4,
+    )
+    print(f"sharded query peak running queries: {logs_client.peak_running} of 4 shards")
+    if logs_client.peak_running >= 4:
+        return [f"default concurrency limit not reached: {logs_client.peak_running}"]
+    return []
+
+
+def main():
+    """Run the query coordinator check"""
+    rows = generate_query_results(count=100)
+    errors = check_shared_queries(rows)
+    errors.extend(check_concurrency_limit(rows))
+    for error in errors:
+        print(f"[ERROR] {error}", file=sys.stderr)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
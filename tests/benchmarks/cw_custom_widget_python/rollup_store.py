@@ -0,0 +1,312 @@
+#!/usr/bin/env python3.9
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Check the rollup materializer and the rollup widgets with a local rollup store
+
+Materializes the hourly and daily rollups of synthetic conversation logs that
+span several UTC days into a temporary FileSystemRollupStore, using a Log
+Insights client stub that filters the rows by time range. Fails if:
+
+- a rollup does not match the counts of the records of its hour or day
+- the counts read from the rollups and the live edges of a time range differ
+  from the counts of the raw records, including with missing rollups
+- the rollup widgets render different HTML than the widgets rendered from the
+  counts of the raw records
+- a widget query other than the materializer query of the bot locale is
+  accepted as a rollup query
+- a run stopped at the deadline does not count the hours of all the bots as
+  pending
+
+Also reports the number of rollups read for the time range.
+
+Usage: python tests/benchmarks/cw_custom_widget_python/rollup_store.py [--count 5000]
+"""
+
+import argparse
+from datetime import datetime, timezone
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from benchmark_env import INPUT_FIELDS, TimeRangeLogsClient
+
+# pylint: disable=import-error
+from lib.cw_logs import get_rows_as_df
+from lib.rollup_store import (
+    DAY_IN_SECS,
+    HOUR_IN_SECS,
+    FileSystemRollupStore,
+    get_rollup_key,
+)
+from rollup_function import LOGGER as ROLLUP_LOGGER, materialize
+from widgets.approximate import get_sketches
+from widgets.incremental import COUNT_WIDGETS, SKETCH_WIDGETS, aggregate_messages_df
+from widgets.rollups import (
+    ROLLUP_DATASETS,
+    get_rollup_query,
+    get_rollup_ranges,
+    is_rollup_query,
+    render_rollup_widget,
+)
+from conversation_logs import ConversationLogGenerator, get_query_result_row
+
+# pylint: enable=import-error
+
+DEFAULT_COUNT = 5000
+_BOT_ID = "BENCHBOTID"
+_BOT_LOCALE_ID = "en_US"
+# starts before midnight so that the records span partial and full UTC days
+_START_TIME = int(datetime(2021, 9, 10, 18, 20, tzinfo=timezone.utc).timestamp())
+_RECORD_INTERVAL_IN_SECS = 40
+# the records span the first full UTC day and the hour after it
+_MIN_COUNT = (
+    _START_TIME - _START_TIME % DAY_IN_SECS + 2 * DAY_IN_SECS - _START_TIME
+) // _RECORD_INTERVAL_IN_SECS + 2
+# widget parameters rendered for each rollup widget type
+_CASES = [
+    {},
+    {"topN": 3},
+    {"approximateTopN": True, "sketchCapacity": 100000},
+]
+
+
+class CountingRollupStore(FileSystemRollupStore):  # pylint: disable=too-few-public-methods
+    """File system rollup store that counts the rollups read"""
+
+    def __init__(self, root_dir):
+        super().__init__(root_dir)
+        self.reads = 0
+
+    def get(self, key):
+        """Get the rollup payload or None if it does not exist"""
+        self.reads += 1
+        return super().get(key)
+
+
+def generate_rows(count):
+    """Generate query result rows with one record every _RECORD_INTERVAL_IN_SECS"""
+    rows = []
+    timestamps = []
+    for index, record in enumerate(ConversationLogGenerator(seed=0).generate_records(count)):
+        timestamp = _START_TIME + index * _RECORD_INTERVAL_IN_SECS
+        record["timestamp"] = datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime(
+            "%Y-%m-%dT%H:%M:%S.000Z"
+        )
+        rows.append(get_query_result_row(record, index))
+        timestamps.append(timestamp)
+    return rows, timestamps
+
+
+def get_counts(logs_client, widget_type, start_time, end_time):
+    """Count the values of the raw records of a time range"""
+    aggregate, _ = COUNT_WIDGETS[widget_type]
+    input_df = get_rows_as_df(logs_client.get_rows(start_time, end_time), fields=INPUT_FIELDS)
+    return aggregate_messages_df(input_df, aggregate)
+
+
+def get_rollup_counts(rollup_store, logs_client, widget_type, start_time, end_time):
+    """Count the values of a time range from the rollups and the live ranges"""
+    dataset, _ = ROLLUP_DATASETS[widget_type]
+    counts, live_ranges = get_rollup_ranges(
+        start_time=start_time,
+        end_time=end_time,
+        rollup_store=rollup_store,
+        dataset=dataset,
+        bot_id=_BOT_ID,
+        bot_locale_id=_BOT_LOCALE_ID,
+    )
+    for range_start, range_end in live_ranges:
+        counts.update(get_counts(logs_client, widget_type, range_start, range_end))
+    return counts, live_ranges
+
+
+def check_rollups(rollup_store, logs_client, hours, days):
+    """Check that the rollups match the counts of the raw records"""
+    errors = []
+    for widget_type, (dataset, _) in ROLLUP_DATASETS.items():
+        for start_time, period in [(h, HOUR_IN_SECS) for h in hours] + [
+            (d, DAY_IN_SECS) for d in days
+        ]:
+            rollup_counts = rollup_store.read_counts(
+                dataset=dataset,
+                bot_id=_BOT_ID,
+                bot_locale_id=_BOT_LOCALE_ID,
+                start_time=start_time,
+                period=period,
+            )
+            counts = get_counts(logs_client, widget_type, start_time, start_time + period - 1)
+            if rollup_counts != counts:
+                errors.append(f"rollup differs - dataset: {dataset} start: {start_time} {period}")
+    return errors
+
+
+def check_time_range(rollup_store, logs_client, start_time, end_time, label):
+    """Check the counts of a time range read from the rollups and live ranges"""
+    errors = []
+    for widget_type in ROLLUP_DATASETS:
+        counts, live_ranges = get_rollup_counts(
+            rollup_store, logs_client, widget_type, start_time, end_time
+        )
+        if counts != get_counts(logs_client, widget_type, start_time, end_time):
+            errors.append(f"counts differ - {label} {widget_type} live ranges: {live_ranges}")
+    return errors
+
+
+def check_render(rollup_store, logs_client, start_time, end_time):
+    """Check the rollup widgets against the widgets rendered from raw counts"""
+    errors = []
+
+    def get_input_df(range_start, range_end):
+        return get_rows_as_df(logs_client.get_rows(range_start, range_end), fields=INPUT_FIELDS)
+
+    for widget_type in ROLLUP_DATASETS:
+        counts = get_counts(logs_client, widget_type, start_time, end_time)
+        for params in _CASES:
+            event = {
+                "botId": _BOT_ID,
+                "botLocaleId": _BOT_LOCALE_ID,
+                **params,
+            }
+            if params.get("approximateTopN"):
+                expected_html = SKETCH_WIDGETS[widget_type](
+                    event=event, counts=get_sketches(event, counts.elements())
+                )
+            else:
+                _, render = COUNT_WIDGETS[widget_type]
+                expected_html = render(event=event, counts=counts)
+            html, _ = render_rollup_widget(
+                widget_type=widget_type,
+                event=event,
+                get_input_df=get_input_df,
+                start_time=start_time,
+                end_time=end_time,
+                rollup_store=rollup_store,
+            )
+            if html != expected_html:
+                errors.append(f"output differs - {widget_type} {params}")
+    return errors
+
+
+def check_rollup_query():
+    """Check that only the materializer query of the bot locale is a rollup query"""
+    errors = []
+    rollup_queries = [
+        get_rollup_query(_BOT_ID, _BOT_LOCALE_ID),
+        f"filter bot.id = '{_BOT_ID}'\n  and bot.localeId = \"{_BOT_LOCALE_ID}\"",
+    ]
+    other_queries = [
+        f"{get_rollup_query(_BOT_ID, _BOT_LOCALE_ID)} | filter sessionState.intent.name = 'A'",
+        get_rollup_query(_BOT_ID, "en_GB"),
+        get_rollup_query(_BOT_ID.lower(), _BOT_LOCALE_ID),
+        f"filter bot.id = '{_BOT_ID}'",
+    ]
+    for query in rollup_queries:
+        if not is_rollup_query(query, _BOT_ID, _BOT_LOCALE_ID):
+            errors.append(f"rollup query not accepted: {query}")
+    for query in other_queries:
+        if is_rollup_query(query, _BOT_ID, _BOT_LOCALE_ID):
+            errors.append(f"query accepted as a rollup query: {query}")
+    return errors
+
+
+def check_pending_hours(logs_client, hours):
+    """Check the pending hours of a run that reaches the deadline before the first hour"""
+    bots = [(_BOT_ID, _BOT_LOCALE_ID), (_BOT_ID, "en_GB")]
+    # the stopped run is logged as a warning
+    ROLLUP_LOGGER.setLevel(logging.ERROR)
+    with tempfile.TemporaryDirectory() as rollup_store_dir:
+        result = materialize(
+            rollup_store=FileSystemRollupStore(rollup_store_dir),
+            logs_client=logs_client,
+            bots=bots,
+            hours=hours,
+            deadline=time.monotonic() - 1,
+        )
+    if result["pendingHours"] != len(bots) * len(hours):
+        return [f"pending hours: {result['pendingHours']} of {len(bots) * len(hours)}"]
+    return []
+
+
+def remove_rollup(rollup_store_dir, start_time, period):
+    """Remove the rollups of all the datasets of an hour or day"""
+    for dataset, _ in ROLLUP_DATASETS.values():
+        os.remove(
+            os.path.join(
+                rollup_store_dir,
+                get_rollup_key(dataset, _BOT_ID, _BOT_LOCALE_ID, start_time, period),
+            )
+        )
+
+
+def main():
+    """Run the rollup store check"""
+    # pylint: disable=too-many-locals
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=DEFAULT_COUNT, help="number of records")
+    args = parser.parse_args()
+    if args.count < _MIN_COUNT:
+        parser.error(f"the count has to be at least {_MIN_COUNT} to span a full UTC day")
+
+    rows, timestamps = generate_rows(args.count)
+    logs_client = TimeRangeLogsClient(rows, timestamps)
+    first_hour = timestamps[0] - (timestamps[0] % HOUR_IN_SECS)
+    hours = list(range(first_hour, timestamps[-1] - HOUR_IN_SECS, HOUR_IN_SECS))
+
+    with tempfile.TemporaryDirectory() as rollup_store_dir:
+        rollup_store = CountingRollupStore(rollup_store_dir)
+        result = materialize(
+            rollup_store=rollup_store,
+            logs_client=logs_client,
+            bots=[(_BOT_ID, _BOT_LOCALE_ID)],
+            hours=hours,
+        )
+        days = [day for _, _, day in result["materializedDays"]]
+        print(
+            f"materialized {len(result['materializedHours'])} hours and {len(days)} days"
+            f" of {args.count} records"
+        )
+        errors = [] if days else ["no daily rollup materialized"]
+        errors.extend(check_rollup_query())
+        errors.extend(check_pending_hours(logs_client, hours))
+        errors.extend(check_rollups(rollup_store, logs_client, hours, days))
+
+        # time ranges with partial hours at both ends
+        start_time = timestamps[0] + 1234
+        end_time = timestamps[-1] - 777
+        rollup_store.reads = 0
+        errors.extend(check_time_range(rollup_store, logs_client, start_time, end_time, "all"))
+        print(
+            f"read {rollup_store.reads // len(ROLLUP_DATASETS)} rollups per dataset"
+            f" for {(end_time - start_time) // HOUR_IN_SECS} hours"
+        )
+        errors.extend(check_render(rollup_store, logs_client, hours[0], hours[-1] - 1))
+
+        # days without a daily rollup are read by hour and missing hours are queried
+        remove_rollup(rollup_store_dir, days[0], DAY_IN_SECS)
+        remove_rollup(rollup_store_dir, days[-1] + 5 * HOUR_IN_SECS, HOUR_IN_SECS)
+        remove_rollup(rollup_store_dir, hours[-1], HOUR_IN_SECS)
+        errors.extend(
+            check_time_range(rollup_store, logs_client, start_time, end_time, "missing rollups")
+        )
+
+        # a new run fills the missing hours and the missing daily rollup
+        result = materialize(
+            rollup_store=rollup_store,
+            logs_client=logs_client,
+            bots=[(_BOT_ID, _BOT_LOCALE_ID)],
+            hours=hours,
+        )
+        if len(result["materializedHours"]) != 2 or len(result["materializedDays"]) != 1:
+            errors.append(f"missing rollups not materialized: {result}")
+        errors.extend(check_rollups(rollup_store, logs_client, hours, days))
+
+    print(f"checked {len(hours)} hourly and {len(days)} daily rollups")
+    for error in errors:
+        print(f"[ERROR] {error}", file=sys.stderr)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3.9
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Check that the slots top N widget counts the same values as the original widget
+
+Renders the slots top N widget from synthetic conversation logs with both
+engines and compares it with the tables of the original implementation, which
+flattened the JSON messages with pandas and ran one value_counts per (intent,
+slot). The original value_counts orders tied counts by its unstable sort, so
+the widget lists tied values sorted by value instead. A render that differs
+from the original tables must match them with the ties of the original value
+counts sorted by value, which keeps the counts and only reorders (and at the
+top N cut selects) tied values. Fails if a render matches neither.
+
+Usage: python tests/benchmarks/cw_custom_widget_python/slots_parity.py [--sizes 1,50,1000]
+"""
+
+import argparse
+import json
+import sys
+
+from benchmark_env import INPUT_FIELDS
+
+# pylint: disable=import-error
+import pandas as pd
+
+from lib.cw_logs import get_rows_as_df
+from lib.messages import decode_messages
+from widgets.html_renderer import get_max_output_bytes
+from widgets.slots import (
+    SLOTS_MESSAGE_PATHS,
+    render_slots_top_n_from_messages,
+    render_slots_top_n_html,
+)
+from conversation_logs import generate_query_results
+
+# pylint: enable=import-error
+
+DEFAULT_SIZES = [1, 50, 1000, 5000]
+DEFAULT_SEEDS = [0, 1, 2]
+ENGINES = ["stdlib", "pandas"]
+_SLOT_NAME_SUFFIX = ".value.originalValue"
+_CASES = [
+    {},
+    {"topN": 1},
+    {"topN": 3, "intentToExclude": ["TransferFunds"]},
+    {"topN": 2, "slotsToExclude": ["accountType"]},
+    {"topN": 1000},
+]
+
+
+def get_baseline_top_n_values(event, input_df, sort_ties=False):
+    """Get the top N values of each intent and slot as the original widget did
+
+    Returns the list of intent, slot and top N dataframe entries or an
+    HTML message when there is no data. With sort_ties, the values with the
+    same count in the original value counts are sorted by value before
+    taking the top N.
+    """
+    # pylint: disable=too-many-locals
+    slots_to_exclude = event.get("slotsToExclude", [])
+    intents_to_exclude = event.get("intentToExclude", [])
+    top_n = event.get("topN", 10)
+
+    message_series = input_df["@message"].apply(json.loads)
+    normalized_message_df = pd.DataFrame.from_records(
+        pd.json_normalize(message_series, max_level=1)
+    )
+    if "sessionState.intent" not in normalized_message_df.columns:
+        return "<pre>No intent data found</pre>"
+
+    intent_df = pd.DataFrame.from_records(normalized_message_df["sessionState.intent"])
+    if "slots" not in intent_df.columns:
+        return "<pre>No slots data found</pre>"
+
+    slots_df = pd.json_normalize(intent_df["slots"]).dropna(how="all")
+    slots_intent_df = slots_df.join(intent_df)
+    if slots_intent_df.empty:
+        return "<pre>No slot values found</pre>"
+
+    intent_names = [i for i in slots_intent_df["name"].unique() if i not in intents_to_exclude]
+    slots_to_exclude_column_names = [f"{s}{_SLOT_NAME_SUFFIX}" for s in slots_to_exclude]
+    slot_names = [
+        c[: -len(_SLOT_NAME_SUFFIX)]
+        for c in slots_intent_df.columns
+        if c.endswith(_SLOT_NAME_SUFFIX) and c not in slots_to_exclude_column_names
+    ]
+
+    intent_slot_topn_values = []
+    for intent_name in intent_names:
+        for slot_name in slot_names:
+            slot_column_name = f"{slot_name}{_SLOT_NAME_SUFFIX}"
+            intent_slot_values_df = slots_intent_df[
+                (slots_intent_df["name"] == intent_name)
+                & slots_intent_df["state"].isin(["Fulfilled", "ReadyForFulfillment"])
+            ][[slot_column_name]].rename({slot_column_name: "value"}, axis="columns")
+            value_counts = intent_slot_values_df.value_counts()
+            if sort_ties:
+                value_counts = value_counts.sort_index().sort_values(ascending=False, kind="stable")
+            intent_slot_topn_values_df = (
+                value_counts.head(top_n)
+                .to_frame()
+                .rename({0: "count"}, axis="columns")
+                .reset_index()
+            )
+            intent_slot_topn_values.append(
+                {
+                    "intent_name": intent_name,
+                    "slot_name": slot_name,
+                    "topn_df": intent_slot_topn_values_df,
+                }
+            )
+    return intent_slot_topn_values
+
+
+def render_baseline(event, input_df, sort_ties=False):
+    """Render the original widget tables with the current HTML renderer"""
+    intent_slot_topn_values = get_baseline_top_n_values(event, input_df, sort_ties=sort_ties)
+    if isinstance(intent_slot_topn_values, str):
+        return intent_slot_topn_values
+    return render_slots_top_n_html(
+        top_n=event.get("topN", 10),
+        intent_slot_topn_values=intent_slot_topn_values,
+        max_output_bytes=get_max_output_bytes(event),
+    )
+
+
+def main():
+    """Run the parity check"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        default=",".join(str(s) for s in DEFAULT_SIZES),
+        help="comma separated numbers of rows",
+    )
+    parser.add_argument(
+        "--seeds",
+        default=",".join(str(s) for s in DEFAULT_SEEDS),
+        help="comma separated generator seeds",
+    )
+    args = parser.parse_args()
+
+    errors = []
+    renders = 0
+    tie_order_renders = 0
+    for size in [int(s) for s in args.sizes.split(",")]:
+        for seed in [int(s) for s in args.seeds.split(",")]:
+            input_df = get_rows_as_df(
+                generate_query_results(count=size, seed=seed), fields=INPUT_FIELDS
+            )
+            messages = decode_messages(input_df["@message"], SLOTS_MESSAGE_PATHS)
+            for params in _CASES:
+                baseline_html = render_baseline(event=params, input_df=input_df)
+                sorted_ties_html = render_baseline(event=params, input_df=input_df, sort_ties=True)
+                for engine in ENGINES:
+                    renders += 1
+                    html = render_slots_top_n_from_messages(
+                        event={"engine": engine, **params}, messages=messages
+                    )
+                    if html == baseline_html:
+                        continue
+                    if html == sorted_ties_html:
+                        tie_order_renders += 1
+                        continue
+                    errors.append(f"output differs - rows: {size} seed: {seed} {engine} {params}")
+
+    print(
+        f"checked {renders} slots top N renders against the original widget:"
+        f" {renders - tie_order_renders - len(errors)} identical,"
+        f" {tie_order_renders} with tied values sorted by value"
+    )
+    for error in errors:
+        print(f"[ERROR] {error}", file=sys.stderr)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3.9
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Benchmark the missed utterance clustering on synthetic transcripts
+
+Generates missed utterance transcripts from the BankerBot utterances with
+case, punctuation and contraction variants, typos and a long tail of unique
+utterances, then measures the clustering time at each number of utterances.
+Fails if a case, punctuation or contraction variant is not clustered with
+its utterance and reports the share of typo variants that are.
+
+Usage: python tests/benchmarks/cw_custom_widget_python/utterance_clusters.py [--sizes 10000]
+"""
+
+import argparse
+import random
+import sys
+import time
+
+import benchmark_env  # noqa: F401 pylint: disable=unused-import
+
+# pylint: disable=import-error
+from lib.utterance_clusters import ENGLISH_CONTRACTIONS, cluster_utterances
+from conversation_logs import load_banker_bot_definitions
+
+# pylint: enable=import-error
+
+DEFAULT_SIZES = [10000, 100000, 1000000]
+_TYPO_RATE = 0.1
+_UNIQUE_RATE = 0.2
+_CONTRACTED_FORMS = {
+    "i am": ["i'm", "im", "I'm"],
+    "what is": ["what's", "whats"],
+    "do not": ["don't", "dont"],
+    "can not": ["can't", "cant"],
+}
+_PUNCTUATION = ["", "", ".", "?", "!", " ..."]
+
+
+class TranscriptGenerator:
+    """Seeded generator of missed utterance transcripts and their utterance"""
+
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, seed=0):
+        self._random = random.Random(seed)
+        definitions = load_banker_bot_definitions()
+        self.utterances = sorted(
+            {
+                utterance.lower()
+                for key, values in definitions.items()
+                if key.endswith("_utterances")
+                for utterance in values
+            }
+        )
+        self._words = sorted({w for u in self.utterances for w in u.split()})
+        # frequent utterances are more common
+        self._weights = [1 / (rank + 1) for rank in range(len(self.utterances))]
+
+    def _vary(self, utterance):
+        for expanded, forms in _CONTRACTED_FORMS.items():
+            if expanded in utterance and self._random.random() < 0.5:
+                utterance = utterance.replace(expanded, self._random.choice(forms))
+        case = self._random.random()
+        if case < 0.3:
+            utterance = utterance.capitalize()
+        elif case < 0.4:
+            utterance = utterance.upper()
+        return utterance + self._random.choice(_PUNCTUATION)
+
+    def _typo(self, utterance):
+        positions = [i for i in range(1, len(utterance) - 1) if utterance[i].isalpha()]
+        position = self._random.choice(positions)
+        characters = list(utterance)
+        if self._random.random() < 0.5:
+            # dropped character
+            del characters[position]
+        else:
+            # swapped characters
+            next_position = position + 1
+            characters[position], characters[next_position] = (
+                characters[next_position],
+                characters[position],
+            )
+        return "".join(characters)
+
+    def generate(self, count):
+        """Generate (transcript, utterance, kind) tuples
+
+        The kind is variant, typo or unique. Unique transcripts have no
+        utterance.
+        """
+        transcripts = []
+        for index in range(count):
+            if self._random.random() < _UNIQUE_RATE:
+                words = self._random.sample(self._words, 4)
+                transcripts.append((f"{' '.join(words)} {index}", None, "unique"))
+                continue
+            utterance = self._random.choices(self.utterances, weights=self._weights)[0]
+            if self._random.random() < _TYPO_RATE and len(utterance) > 6:
+                transcripts.append((self._typo(utterance), utterance, "typo"))
+            else:
+                transcripts.append((self._vary(utterance), utterance, "variant"))
+        return transcripts
+
+
+def main():
+    """Run the benchmarks"""
+    # pylint: disable=too-many-locals
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        default=",".join(str(s) for s in DEFAULT_SIZES),
+        help="comma separated numbers of utterances",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="generator seed")
+    args = parser.parse_args()
+
+    errors = []
+    print(
+        f"{'utterances':>10}  {'distinct':>9}  {'clusters':>9}  {'typo recall':>11}"
+        f"  {'time (ms)':>10}  {'time per utterance (us)':>23}"
+    )
+    for size in [int(s) for s in args.sizes.split(",")]:
+        transcripts = TranscriptGenerator(seed=args.seed).generate(size)
+        start = time.perf_counter()
+        clusters = cluster_utterances(
+            [transcript for transcript, _, _ in transcripts], contractions=ENGLISH_CONTRACTIONS
+        )
+        elapsed_time = time.perf_counter() - start
+
+        cluster_indexes = {
+            variant: index
+            for index, cluster in enumerate(clusters)
+            for variant in cluster["variants"]
+        }
+        # cluster of each utterance, set by its first variant
+        utterance_clusters = {}
+        for transcript, utterance, kind in transcripts:
+            if kind != "variant":
+                continue
+            utterance_cluster = utterance_clusters.setdefault(
+                utterance, cluster_indexes[transcript]
+            )
+            if cluster_indexes[transcript] != utterance_cluster:
+                errors.append(f"variant not clustered - utterances: {size} {transcript!r}")
+        typo_matches = [
+            cluster_indexes[transcript] == utterance_clusters.get(utterance)
+            for transcript, utterance, kind in transcripts
+            if kind == "typo"
+        ]
+
+        typo_recall = sum(typo_matches) / max(len(typo_matches), 1)
+        print(
+            f"{size:>10}  {len(cluster_indexes):>9}  {len(clusters):>9}  {typo_recall:>11.1%}"
+            f"  {elapsed_time * 1000:>10.1f}  {elapsed_time / size * 1e6:>23.2f}"
+        )
+
+    for error in errors[:20]:
+        print(f"[ERROR] {error}", file=sys.stderr)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3.9
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+"""Benchmark the Python custom widget pipeline on synthetic conversation logs
+
+Measures the time and peak memory of converting the query results to a
+dataframe (get_query_results_as_df) and rendering the slots and session
+attributes top N widgets, the conversation path widget and the missed
+utterance clusters widget at each number of rows, with the pandas engine and
+with the stdlib engine from lists of values. The time is measured without
+tracing and the peak memory in a separate traced run.
+
+Usage: python tests/benchmarks/cw_custom_widget_python/widget_pipeline.py [--sizes 1000,10000]
+"""
+
+import argparse
+import logging
+import time
+import tracemalloc
+
+from benchmark_env import INPUT_FIELDS, FakeLogsClient
+
+# pylint: disable=import-error
+from lib.cw_logs import (
+    get_query_results,
+    get_query_results_as_df,
+    get_rows_as_columns,
+)
+from widgets.conversation_path import render_conversation_path_widget
+from widgets.missed_utterances import render_missed_utterance_clusters_widget
+from widgets.slots import render_slots_top_n_widget
+from widgets.session_attributes import render_session_attributes_top_n_widget
+from conversation_logs import generate_query_results
+
+# pylint: enable=import-error
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+_WIDGET_EVENT = {"topN": 10}
+_STDLIB_WIDGET_EVENT = {"topN": 10, "engine": "stdlib"}
+_LOGGER = logging.getLogger(__name__)
+
+
+def measure(function):
+    """Get the elapsed time in seconds and the traced peak memory in bytes of a function"""
+    start = time.perf_counter()
+    function()
+    elapsed_time = time.perf_counter() - start
+
+    tracemalloc.start()
+    try:
+        function()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return elapsed_time, peak_memory
+
+
+def get_benchmarks(rows):
+    """Get the benchmark functions of the pipeline steps"""
+    logs_client = FakeLogsClient(rows)
+    query_args = {
+        "query": "",
+        "log_group_names": ["benchmark"],
+        "start_time": 0,
+        "end_time": 0,
+        "logger": _LOGGER,
+        "logs_client": logs_client,
+    }
+    input_df = get_query_results_as_df(**query_args, fields=INPUT_FIELDS)
+    input_columns = get_rows_as_columns(get_query_results(**query_args), fields=INPUT_FIELDS)
+    return {
+        "get_query_results_as_df": lambda: get_query_results_as_df(
+            **query_args, fields=INPUT_FIELDS
+        ),
+        "render_slots_top_n_widget": lambda: render_slots_top_n_widget(
+            event=_WIDGET_EVENT, input_df=input_df
+        ),
+        "render_session_attributes_top_n_widget": (
+            lambda: render_session_attributes_top_n_widget(event=_WIDGET_EVENT, input_df=input_df)
+        ),
+        "render_conversation_path_widget": lambda: render_conversation_path_widget(
+            event=_WIDGET_EVENT, input_df=input_df
+        ),
+        "render_missed_utterance_clusters_widget": (
+            lambda: render_missed_utterance_clusters_widget(event=_WIDGET_EVENT, input_df=input_df)
+        ),
+        "get_rows_as_columns (stdlib)": lambda: get_rows_as_columns(
+            get_query_results(**query_args), fields=INPUT_FIELDS
+        ),
+        "render_slots_top_n_widget (stdlib)": lambda: render_slots_top_n_widget(
+            event=_STDLIB_WIDGET_EVENT, input_df=input_columns
+        ),
+        "render_session_attributes_top_n_widget (stdlib)": (
+            lambda: render_session_attributes_top_n_widget(
+                event=_STDLIB_WIDGET_EVENT, input_df=input_columns
+            )
+        ),
+        "render_conversation_path_widget (stdlib)": lambda: render_conversation_path_widget(
+            event=_STDLIB_WIDGET_EVENT, input_df=input_columns
+        ),
+    }
+
+
+def main():
+    """Run the benchmarks"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        default=",".join(str(s) for s in DEFAULT_SIZES),
+        help="comma separated numbers of rows",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="generator seed")
+    args = parser.parse_args()
+
+    print(f"{'rows':>9}  {'benchmark':<48}  {'time (ms)':>10}  {'peak memory (MiB)':>17}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        rows = generate_query_results(count=size, seed=args.seed)
+        for name, function in get_benchmarks(rows).items():
+            elapsed_time, peak_memory = measure(function)
+            print(
+                f"{size:>9}  {name:<48}  {elapsed_time * 1000:>10.1f}"
+                f"  {peak_memory / 2**20:>17.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()